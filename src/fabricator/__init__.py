@@ -7,4 +7,8 @@ from .prompts import (
 )
 from .dataset_transformations import *
 from .samplers import *
+from .backends import *
 from .dataset_generator import DatasetGenerator
+from .dataset_writer import DatasetWriter, ShardedDatasetWriter
+from .generation_config import GenerationConfig
+from .scoring import LabelScorer
@@ -0,0 +1,14 @@
+__all__ = [
+    "BackendPool",
+    "LocalBatchExecutor",
+    "ModelCascade",
+    "RequestHedger",
+    "StopStreaming",
+    "ValidatingStreamHandler",
+]
+
+from .cascade import ModelCascade
+from .hedging import RequestHedger
+from .local_batch import LocalBatchExecutor
+from .pool import BackendPool
+from .streaming import StopStreaming, ValidatingStreamHandler
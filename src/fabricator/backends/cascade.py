@@ -0,0 +1,117 @@
+"""Cost-aware cascades of models"""
+import threading
+
+from collections import Counter
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from haystack.nodes import PromptNode
+
+
+class ModelCascade:
+    """Annotates every row with the cheapest model that is confident about it. The tiers are ordered from cheap to
+    strong. A row is escalated to the next tier if the output of a tier cannot be decoded, e.g. it is no label
+    option, or if fewer than min_agreement of its samples agree. The last tier answers all remaining rows, its
+    outputs that cannot be decoded are counted as invalid and left to the caller to drop.
+
+    Example:
+        cascade = ModelCascade([cheap_prompt_node, strong_prompt_node], costs_per_call=[0.1, 1.0],
+                               samples_per_call=3, min_agreement=0.67)
+        generated_dataset = generator.generate(prompt_template, unlabeled_dataset=dataset,
+                                               generation_config=GenerationConfig(model_cascade=cascade))
+    """
+
+    def __init__(
+        self,
+        prompt_nodes: List[PromptNode],
+        costs_per_call: Optional[List[float]] = None,
+        names: Optional[List[str]] = None,
+        samples_per_call: int = 1,
+        min_agreement: float = 1.0,
+    ):
+        """Initialize the ModelCascade with its tiers.
+
+        Args:
+            prompt_nodes (List[PromptNode]): Prompt nodes of the tiers, from cheap to strong.
+            costs_per_call (Optional[List[float]], optional): Cost of a call with samples_per_call completions per
+            tier, e.g. in dollars. Defaults to None, which counts every call as 1.
+            names (Optional[List[str]], optional): Names of the tiers in the statistics. Defaults to None, which
+            names them tier_0, tier_1, ...
+            samples_per_call (int, optional): Number of completions per call to measure the agreement.
+            Defaults to 1.
+            min_agreement (float, optional): Minimum share of the completions that must agree with the most frequent
+            valid output. Defaults to 1.0.
+        """
+        if len(prompt_nodes) < 2:
+            raise ValueError("A ModelCascade requires at least two prompt nodes.")
+
+        costs_per_call = costs_per_call or [1.0] * len(prompt_nodes)
+        names = names or [f"tier_{idx}" for idx in range(len(prompt_nodes))]
+        if not len(costs_per_call) == len(names) == len(prompt_nodes):
+            raise ValueError("costs_per_call and names must have one entry per prompt node.")
+
+        if samples_per_call < 1:
+            raise ValueError(f"samples_per_call must be a positive integer, got {samples_per_call}.")
+
+        if not 0 < min_agreement <= 1:
+            raise ValueError(f"min_agreement must be between 0 and 1, got {min_agreement}.")
+
+        self.prompt_nodes = prompt_nodes
+        self.costs_per_call = costs_per_call
+        self.names = names
+        self.samples_per_call = samples_per_call
+        self.min_agreement = min_agreement
+        self.stats: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        """Resets the number of calls, accepted, escalated and invalid rows and the cost per tier."""
+        self.stats = {
+            name: {"calls": 0, "accepted": 0, "escalated": 0, "invalid": 0, "cost": 0.0} for name in self.names
+        }
+
+    def run(
+        self,
+        send: Callable[[PromptNode, int], Optional[List[str]]],
+        decode: Callable[[str], Optional[Hashable]],
+    ) -> Optional[str]:
+        """Runs a prompt on the tiers until one is confident about its output.
+
+        Args:
+            send (Callable[[PromptNode, int], Optional[List[str]]]): Sends the prompt to a prompt node with a
+            number of completions and returns them, None if the call failed.
+            decode (Callable[[str], Optional[Hashable]]): Decodes a completion to a comparable value, None if it is
+            invalid.
+
+        Returns:
+            Optional[str]: Completion with the most frequent valid output of the accepting tier, the first
+            completion of the last tier if none of them is valid, None if the last tier failed.
+        """
+        for tier_idx, (prompt_node, name) in enumerate(zip(self.prompt_nodes, self.names)):
+            is_last_tier = tier_idx == len(self.prompt_nodes) - 1
+            completions = send(prompt_node, self.samples_per_call) or []
+            self._count(name, "calls", cost=self.costs_per_call[tier_idx])
+
+            values = [decode(completion) for completion in completions]
+            votes = Counter(value for value in values if value is not None)
+            if votes:
+                value, count = votes.most_common(1)[0]
+                if count / len(completions) >= self.min_agreement or is_last_tier:
+                    self._count(name, "accepted")
+                    return completions[values.index(value)]
+
+            if is_last_tier:
+                # The invalid output of the last tier is not accepted, the caller reports it like any other invalid
+                # output, so it can be repaired
+                if completions:
+                    self._count(name, "invalid")
+                return completions[0] if completions else None
+
+            self._count(name, "escalated")
+        return None
+
+    def _count(self, name: str, key: str, cost: float = 0.0) -> None:
+        # Rows may be annotated by concurrent prompt calls
+        with self._lock:
+            self.stats[name][key] += 1
+            self.stats[name]["cost"] += cost
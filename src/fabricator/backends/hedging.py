@@ -0,0 +1,166 @@
+"""Hedged requests against slow responses"""
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from haystack.nodes import PromptNode
+from loguru import logger
+
+from ..prompts.decoding import StreamValidator
+from .streaming import ValidatingStreamHandler
+
+
+class RequestHedger:
+    """Sends a duplicate of a request that takes longer than a percentile of the recent latencies, to the same or an
+    alternate prompt node, and takes the first successful response whose stream was not found invalid. The tail
+    latency of hosted LLMs is often a multiple of the median, so a hedge cuts the time a slow request stalls the
+    generation loop. The losing request is cancelled at its next streamed token. Invocation layers that do not
+    stream never see the cancellation, so their losing requests run to completion and are billed. The hedge budget
+    caps the share of requests that are duplicated. The hedger can be shared by concurrent prompt calls.
+
+    Invocation layers that keep the kwargs of a call, e.g. the OpenAI layer, run one call at a time (see
+    exclusive_call), so a hedge to the same prompt node would wait for the primary request. Requests on such prompt
+    nodes require an alternate_prompt_node.
+
+    Example:
+        hedger = RequestHedger(percentile=95, budget=0.05, alternate_prompt_node=backup_prompt_node)
+        config = GenerationConfig(request_hedger=hedger)
+        generated_dataset = generator.generate(prompt_template, generation_config=config)
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        budget: float = 0.05,
+        alternate_prompt_node: Optional[PromptNode] = None,
+        min_samples: int = 20,
+        window_size: int = 1000,
+        max_workers: int = 4,
+    ):
+        """Initialize the RequestHedger with the hedge trigger and budget.
+
+        Args:
+            percentile (float, optional): Percentile of the recent latencies after which a request is hedged.
+            Defaults to 95.0.
+            budget (float, optional): Maximum share of requests that are hedged. Defaults to 0.05.
+            alternate_prompt_node (Optional[PromptNode], optional): Prompt node for the duplicate requests.
+            Defaults to None, which sends them to the prompt node of the generator.
+            min_samples (int, optional): Number of latencies required before requests are hedged. Defaults to 20.
+            window_size (int, optional): Number of recent latencies the percentile is computed from.
+            Defaults to 1000.
+            max_workers (int, optional): Number of threads running requests. Defaults to 4.
+        """
+        if not 0 < percentile < 100:
+            raise ValueError(f"percentile must be between 0 and 100, got {percentile}.")
+
+        if budget < 0:
+            raise ValueError(f"budget must not be negative, got {budget}.")
+
+        self.percentile = percentile
+        self.budget = budget
+        self.alternate_prompt_node = alternate_prompt_node
+        self.min_samples = min_samples
+        self.max_workers = max_workers
+        self.latencies = deque(maxlen=window_size)
+        # Statistics of all requests so far
+        self.stats = {"requests": 0, "hedged_requests": 0, "hedge_wins": 0}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def hedge_delay(self) -> Optional[float]:
+        """Latency after which a request is hedged, None if there are too few latencies to estimate it."""
+        with self._lock:
+            latencies = list(self.latencies)
+        if len(latencies) < self.min_samples:
+            return None
+        return float(np.percentile(latencies, self.percentile))
+
+    def run(
+        self,
+        send: Callable[[Any, ValidatingStreamHandler], Optional[Any]],
+        prompt_node: Any,
+        stream_handler: Optional[ValidatingStreamHandler] = None,
+        cancellable: bool = True,
+    ) -> Optional[Any]:
+        """Runs a request and hedges it if it is slow.
+
+        Args:
+            send (Callable[[Any, ValidatingStreamHandler], Optional[Any]]): Sends the request to a prompt node
+            with a stream handler and returns the response, None if the request failed.
+            prompt_node (Any): Prompt node of the primary request.
+            stream_handler (Optional[ValidatingStreamHandler], optional): Stream handler of the primary request.
+            Defaults to None, which creates one to be able to cancel it.
+            cancellable (bool, optional): Whether the request stops when its stream handler is cancelled. Requests
+            that cannot be cancelled, e.g. with several completions merged in one stream, are not hedged, because
+            the losing request would keep running. Defaults to True.
+
+        Returns:
+            Optional[Any]: First successful response that is not invalid, the first invalid response if no request
+            returned a valid one, None if all requests failed.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="RequestHedger")
+            executor = self._executor
+            self.stats["requests"] += 1
+
+        primary_handler = stream_handler or ValidatingStreamHandler()
+        start_time = time.monotonic()
+        primary = executor.submit(send, prompt_node, primary_handler)
+        primary.add_done_callback(lambda future: self._record_latency(primary_handler, start_time))
+
+        delay = self.hedge_delay() if cancellable else None
+        if delay is None or wait([primary], timeout=delay).done or not self._reserve_hedge():
+            return primary.result()
+
+        logger.info("Hedging request after {:.2f}s.", delay)
+        hedge_handler = ValidatingStreamHandler(primary_handler.validator)
+        hedge = executor.submit(send, self.alternate_prompt_node or prompt_node, hedge_handler)
+        pending = {primary: primary_handler, hedge: hedge_handler}
+        invalid_response = None
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                handler = pending.pop(future)
+                response = future.result()
+                if response is None:
+                    continue
+                # An output the validator found invalid must not cancel a request that may still return a valid one
+                if handler.status == StreamValidator.INVALID:
+                    invalid_response = invalid_response if invalid_response is not None else response
+                    continue
+                for loser, loser_handler in pending.items():
+                    loser.cancel()
+                    loser_handler.cancel()
+                if future is hedge:
+                    with self._lock:
+                        self.stats["hedge_wins"] += 1
+                return response
+        return invalid_response
+
+    def _reserve_hedge(self) -> bool:
+        """Counts a hedged request if it is within the budget."""
+        with self._lock:
+            if self.stats["hedged_requests"] >= self.budget * self.stats["requests"]:
+                return False
+            self.stats["hedged_requests"] += 1
+            return True
+
+    def _record_latency(self, handler: ValidatingStreamHandler, start_time: float) -> None:
+        # Cancelled requests did not finish, so their latency is unknown
+        if handler.status != ValidatingStreamHandler.CANCELLED:
+            with self._lock:
+                self.latencies.append(time.monotonic() - start_time)
+
+    def close(self) -> None:
+        """Waits for running requests and shuts down the threads."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
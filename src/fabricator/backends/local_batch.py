@@ -0,0 +1,234 @@
+"""Micro-batching of prompts for local transformers models"""
+import threading
+import time
+
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from haystack.nodes import PromptNode
+from loguru import logger
+
+# Prompt, its token length, its future, its submit time and its stop words
+_PendingPrompt = Tuple[str, int, Future, float, List[str]]
+
+
+class LocalBatchExecutor:
+    """Collects the prompts of the generation loop into micro-batches for a local transformers pipeline. A prompt
+    node runs one prompt per call, so a local model never batches. The executor buckets pending prompts by their
+    token length, so prompts of a batch need little padding, and runs a bucket as one batch once it holds
+    max_batch_size prompts or its oldest prompt waited max_wait_seconds. Every prompt gets a future that resolves
+    to its completions, so results are routed back to the row that submitted the prompt.
+
+    Example:
+        executor = LocalBatchExecutor.from_prompt_node(prompt_node, max_batch_size=16)
+        generated_dataset = generator.generate(prompt_template, unlabeled_dataset=dataset,
+                                               generation_config=GenerationConfig(batch_executor=executor))
+    """
+
+    def __init__(
+        self,
+        pipe: Callable[..., List[Any]],
+        max_batch_size: int = 8,
+        max_wait_seconds: float = 0.05,
+        bucket_width: int = 32,
+        max_pending: Optional[int] = None,
+        generation_kwargs: Optional[Dict[str, Any]] = None,
+        length_function: Optional[Callable[[str], int]] = None,
+    ):
+        """Initialize the LocalBatchExecutor with a transformers pipeline.
+
+        Args:
+            pipe (Callable[..., List[Any]]): Text generation pipeline, called with a list of prompts and batch_size.
+            max_batch_size (int, optional): Maximum number of prompts per batch. Defaults to 8.
+            max_wait_seconds (float, optional): Time after which a bucket is run even if it is not full.
+            Defaults to 0.05.
+            bucket_width (int, optional): Range of token lengths that are batched together. Defaults to 32.
+            max_pending (Optional[int], optional): Number of prompts the generation loop submits ahead of the row it
+            waits for. Defaults to None, which is four times max_batch_size.
+            generation_kwargs (Optional[Dict[str, Any]], optional): Keyword arguments passed to every call of the
+            pipeline. Defaults to None.
+            length_function (Optional[Callable[[str], int]], optional): Number of tokens of a prompt. Defaults to
+            None, which uses the tokenizer of the pipeline or counts words if it has none.
+        """
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size must be a positive integer, got {max_batch_size}.")
+
+        if bucket_width < 1:
+            raise ValueError(f"bucket_width must be a positive integer, got {bucket_width}.")
+
+        self.pipe = pipe
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.bucket_width = bucket_width
+        self.max_pending = max_pending or 4 * max_batch_size
+        self.generation_kwargs = generation_kwargs or {}
+        tokenizer = getattr(pipe, "tokenizer", None)
+        if length_function is None and tokenizer is not None:
+            self.length_function = lambda prompt: len(tokenizer(prompt)["input_ids"])
+        else:
+            self.length_function = length_function or (lambda prompt: len(prompt.split()))
+        # Statistics of all batches run so far
+        self.stats = {"batches": 0, "prompts": 0, "padding_tokens": 0}
+
+        # Pending prompts per (number of completions, maximum new tokens, length bucket) as
+        # (prompt, length, future, submit time, stop words)
+        self._buckets: Dict[Tuple[int, Optional[int], int], List[_PendingPrompt]] = {}
+        self._condition = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        self._closed = False
+
+    @classmethod
+    def from_prompt_node(cls, prompt_node: PromptNode, **kwargs) -> "LocalBatchExecutor":
+        """Creates an executor for the local Hugging Face model of a prompt node.
+
+        Args:
+            prompt_node (PromptNode): Prompt node with a local Hugging Face model.
+            **kwargs: Keyword arguments of the LocalBatchExecutor.
+
+        Returns:
+            LocalBatchExecutor: Executor running the pipeline of the prompt node.
+        """
+        invocation_layer = prompt_node.prompt_model.model_invocation_layer
+        pipe = getattr(invocation_layer, "pipe", None)
+        if pipe is None:
+            raise ValueError(
+                f"Batching requires a local Hugging Face model, got {invocation_layer.__class__.__name__}."
+            )
+
+        # Batched pipelines pad the prompts, decoder-only models have to be padded on the left
+        if pipe.tokenizer.pad_token is None:
+            pipe.tokenizer.pad_token = pipe.tokenizer.eos_token
+        if invocation_layer.task_name == "text-generation":
+            pipe.tokenizer.padding_side = "left"
+            generation_kwargs = {"return_full_text": False, "max_new_tokens": invocation_layer.max_length}
+        else:
+            generation_kwargs = {"max_length": invocation_layer.max_length}
+
+        kwargs.setdefault("generation_kwargs", generation_kwargs)
+        return cls(pipe, **kwargs)
+
+    def submit(
+        self,
+        prompt_text: str,
+        num_completions: int = 1,
+        max_new_tokens: Optional[int] = None,
+        stop_words: Optional[List[str]] = None,
+    ) -> Future:
+        """Adds a prompt to the bucket of its token length.
+
+        Args:
+            prompt_text (str): Prompt, already filled with the invocation context.
+            num_completions (int, optional): Number of completions to generate. Defaults to 1.
+            max_new_tokens (Optional[int], optional): Maximum number of generated tokens. Defaults to None, which
+            uses the generation kwargs of the executor.
+            stop_words (Optional[List[str]], optional): Completions are cut at the first of these words, which is
+            excluded like on the prompt node. Defaults to None.
+
+        Returns:
+            Future: Resolves to the list of completions of the prompt.
+        """
+        length = self.length_function(prompt_text)
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Cannot submit prompts to a closed executor.")
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="LocalBatchExecutor", daemon=True)
+                self._worker.start()
+            bucket = (num_completions, max_new_tokens, length // self.bucket_width)
+            self._buckets.setdefault(bucket, []).append(
+                (prompt_text, length, future, time.monotonic(), stop_words or [])
+            )
+            self._condition.notify()
+        return future
+
+    def close(self) -> None:
+        """Runs all pending prompts and stops the worker thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._worker is not None:
+            self._worker.join()
+
+    def __enter__(self) -> "LocalBatchExecutor":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                batch = self._next_batch()
+                while batch is None:
+                    if self._closed and not self._buckets:
+                        return
+                    self._condition.wait(self._time_to_next_deadline())
+                    batch = self._next_batch()
+            self._execute(*batch)
+
+    def _next_batch(self) -> Optional[Tuple[int, Optional[int], List[_PendingPrompt]]]:
+        """Takes the bucket that is full or waited longest past its deadline, None if no bucket is ready."""
+        now = time.monotonic()
+        ready_buckets = [
+            bucket for bucket, pending in self._buckets.items()
+            if self._closed or len(pending) >= self.max_batch_size or now - pending[0][3] >= self.max_wait_seconds
+        ]
+        if not ready_buckets:
+            return None
+
+        bucket = min(ready_buckets, key=lambda bucket: (len(self._buckets[bucket]) < self.max_batch_size,
+                                                        self._buckets[bucket][0][3]))
+        batch = self._buckets[bucket][:self.max_batch_size]
+        del self._buckets[bucket][:self.max_batch_size]
+        if not self._buckets[bucket]:
+            del self._buckets[bucket]
+        return bucket[0], bucket[1], batch
+
+    def _time_to_next_deadline(self) -> Optional[float]:
+        if not self._buckets:
+            return None
+        oldest_submit_time = min(pending[0][3] for pending in self._buckets.values())
+        return max(0.0, oldest_submit_time + self.max_wait_seconds - time.monotonic())
+
+    def _execute(self, num_completions: int, max_new_tokens: Optional[int], batch: List[_PendingPrompt]) -> None:
+        # Prompts whose rows are not needed anymore were cancelled by the generation loop
+        batch = [pending for pending in batch if pending[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        generation_kwargs = dict(self.generation_kwargs)
+        if num_completions > 1:
+            generation_kwargs["num_return_sequences"] = num_completions
+        if max_new_tokens is not None:
+            generation_kwargs.pop("max_length", None)
+            generation_kwargs["max_new_tokens"] = max_new_tokens
+
+        try:
+            outputs = self.pipe([prompt for prompt, *_ in batch], batch_size=len(batch), **generation_kwargs)
+        except Exception as error:
+            logger.error(f"Error while generating batch: {error}")
+            for _, _, future, _, _ in batch:
+                future.set_exception(error)
+            return
+
+        max_length = max(length for _, length, _, _, _ in batch)
+        self.stats["batches"] += 1
+        self.stats["prompts"] += len(batch)
+        self.stats["padding_tokens"] += sum(max_length - length for _, length, _, _, _ in batch)
+
+        for (_, _, future, _, stop_words), output in zip(batch, outputs):
+            # Pipelines return a list of generations per prompt, or a single one for some tasks
+            generations = output if isinstance(output, list) else [output]
+            future.set_result([
+                _truncate_at_stop_words(generation["generated_text"], stop_words) for generation in generations
+            ])
+
+
+def _truncate_at_stop_words(text: str, stop_words: List[str]) -> str:
+    """Cuts a completion at the first stop word it contains. A batched pipeline generates every sequence up to
+    the longest one of the batch, so completions continue past the stop word the prompt node would have stopped at."""
+    stop_positions = [position for position in map(text.find, stop_words) if position >= 0]
+    if not stop_positions:
+        return text
+    return text[:min(stop_positions)].rstrip()
@@ -0,0 +1,166 @@
+"""Routing of prompt calls over several backends"""
+import random
+import threading
+import time
+
+from typing import Any, Dict, List, Optional
+
+from haystack.nodes import PromptNode
+from loguru import logger
+
+from ..utils import exclusive_call
+from .streaming import StopStreaming
+
+
+class _Backend:
+    """Routing state of a single backend of a BackendPool."""
+
+    def __init__(self, name: str, prompt_node: PromptNode, weight: float, requests_per_minute: Optional[float]):
+        self.name = name
+        self.prompt_node = prompt_node
+        self.weight = weight
+        self.min_interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self.next_request_time = 0.0
+        self.healthy_time = 0.0
+        self.consecutive_failures = 0
+        self.running_calls = 0
+        self.stats = {"requests": 0, "failures": 0, "throttled": 0}
+
+
+class BackendPool:
+    """Routes prompt calls over several prompt nodes, e.g. deployments or API keys with separate quotas. A pool is
+    used in place of a single prompt node. Every call goes to a healthy backend that is within its rate limit,
+    chosen at random by weight. A backend that throttles a call, or fails max_failures calls in a row, is left out
+    for cooldown_seconds, and the failed call is rerouted to another backend. Combined with concurrent prompt calls
+    of the generator, the throughput scales with the number of backends. Backends without a running call are
+    preferred, since invocation layers that keep the kwargs of a call, e.g. the OpenAI layer, run one call at a
+    time.
+
+    Example:
+        pool = BackendPool([prompt_node_key_1, prompt_node_key_2], requests_per_minute=[60, 60])
+        generator = DatasetGenerator(pool)
+        config = GenerationConfig(max_concurrent_calls=2)
+        generated_dataset = generator.generate(prompt_template, generation_config=config)
+    """
+
+    def __init__(
+        self,
+        prompt_nodes: List[PromptNode],
+        weights: Optional[List[float]] = None,
+        requests_per_minute: Optional[List[Optional[float]]] = None,
+        names: Optional[List[str]] = None,
+        max_failures: int = 3,
+        cooldown_seconds: float = 30.0,
+    ):
+        """Initialize the BackendPool with the prompt nodes to route to.
+
+        Args:
+            prompt_nodes (List[PromptNode]): Prompt nodes of the backends.
+            weights (Optional[List[float]], optional): Share of the calls per backend. Defaults to None, which
+            weights all backends equally.
+            requests_per_minute (Optional[List[Optional[float]]], optional): Rate limit per backend, None for no
+            limit. Defaults to None.
+            names (Optional[List[str]], optional): Names of the backends in the statistics. Defaults to None, which
+            names them backend_0, backend_1, ...
+            max_failures (int, optional): Number of failed calls in a row after which a backend is left out.
+            Defaults to 3.
+            cooldown_seconds (float, optional): Time a failed or throttled backend is left out. Defaults to 30.0.
+        """
+        if not prompt_nodes:
+            raise ValueError("A BackendPool requires at least one prompt node.")
+
+        weights = weights or [1.0] * len(prompt_nodes)
+        requests_per_minute = requests_per_minute or [None] * len(prompt_nodes)
+        names = names or [f"backend_{idx}" for idx in range(len(prompt_nodes))]
+        if not len(weights) == len(requests_per_minute) == len(names) == len(prompt_nodes):
+            raise ValueError("weights, requests_per_minute and names must have one entry per prompt node.")
+
+        if any(weight <= 0 for weight in weights):
+            raise ValueError("Weights of the backends must be positive.")
+
+        self.backends = [
+            _Backend(name, prompt_node, weight, rpm)
+            for name, prompt_node, weight, rpm in zip(names, prompt_nodes, weights, requests_per_minute)
+        ]
+        self.max_failures = max_failures
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Number of requests, failures and throttled requests per backend."""
+        return {backend.name: dict(backend.stats) for backend in self.backends}
+
+    def run(self, *args, **kwargs) -> Any:
+        """Runs a prompt call like PromptNode.run on one of the backends and reroutes it if it fails.
+
+        Returns:
+            Any: Output of PromptNode.run of the backend that answered.
+        """
+        tried_backends = set()
+        last_error = None
+        for _ in range(len(self.backends)):
+            backend = self._acquire(tried_backends)
+            try:
+                with exclusive_call(backend.prompt_node):
+                    output = backend.prompt_node.run(*args, **kwargs)
+            except StopStreaming:
+                # The stream was stopped on purpose, the backend did not fail
+                raise
+            except Exception as error:
+                self._record_failure(backend, error)
+                tried_backends.add(backend.name)
+                last_error = error
+                continue
+            finally:
+                with self._lock:
+                    backend.running_calls -= 1
+
+            with self._lock:
+                backend.consecutive_failures = 0
+            return output
+
+        raise last_error
+
+    def _acquire(self, tried_backends: set) -> _Backend:
+        """Chooses a backend by weight and reserves its next request slot, waits if all are rate limited."""
+        with self._lock:
+            now = time.monotonic()
+            candidates = [backend for backend in self.backends if backend.name not in tried_backends] \
+                or self.backends
+            healthy = [backend for backend in candidates if backend.healthy_time <= now]
+            if healthy:
+                available = [backend for backend in healthy if backend.next_request_time <= now]
+                if available:
+                    available = [backend for backend in available if backend.running_calls == 0] or available
+                    backend = random.choices(available, weights=[backend.weight for backend in available])[0]
+                else:
+                    backend = min(healthy, key=lambda backend: backend.next_request_time)
+            else:
+                # All backends cool down, so take the one that recovers first
+                backend = min(candidates, key=lambda backend: max(backend.healthy_time, backend.next_request_time))
+
+            start_time = max(now, backend.next_request_time, backend.healthy_time)
+            backend.next_request_time = start_time + backend.min_interval
+            backend.running_calls += 1
+            backend.stats["requests"] += 1
+
+        if start_time > now:
+            time.sleep(start_time - now)
+        return backend
+
+    def _record_failure(self, backend: _Backend, error: Exception) -> None:
+        throttled = self._is_throttling_error(error)
+        with self._lock:
+            backend.stats["failures"] += 1
+            backend.consecutive_failures += 1
+            if throttled:
+                backend.stats["throttled"] += 1
+            if throttled or backend.consecutive_failures >= self.max_failures:
+                backend.healthy_time = time.monotonic() + self.cooldown_seconds
+                logger.warning("Leaving out {} for {}s after error: {}", backend.name, self.cooldown_seconds, error)
+
+    @staticmethod
+    def _is_throttling_error(error: Exception) -> bool:
+        """Whether the error is a rate limit error, e.g. an OpenAIRateLimitError or an HTTP 429 response."""
+        return "ratelimit" in type(error).__name__.lower() or getattr(error, "status_code", None) == 429
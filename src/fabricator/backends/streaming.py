@@ -0,0 +1,65 @@
+"""Streaming of predictions with early stopping"""
+import time
+
+from typing import Optional
+
+from haystack.nodes.prompt.invocation_layer import TokenStreamingHandler
+
+from ..prompts.decoding import StreamValidator
+
+
+class StopStreaming(Exception):
+    """Raised by a ValidatingStreamHandler to stop a streamed request."""
+
+
+class ValidatingStreamHandler(TokenStreamingHandler):
+    """Consumes the tokens of a streamed prediction and checks the output with a StreamValidator after every token.
+    Once the output is final or invalid, the handler raises StopStreaming, which cancels the request in the
+    invocation layer, e.g. closes the connection to OpenAI or stops generate() of a local model. The request can
+    also be cancelled from another thread with cancel(). The handler is created right before the request and
+    records the time to the first token."""
+
+    CANCELLED = "cancelled"
+
+    def __init__(self, validator: Optional[StreamValidator] = None):
+        """Initialize the ValidatingStreamHandler with the validator of the prediction.
+
+        Args:
+            validator (Optional[StreamValidator], optional): Validator checking the output streamed so far.
+            Defaults to None, which only allows to cancel the request.
+        """
+        self.validator = validator
+        self.text = ""
+        self.status = StreamValidator.CONTINUE
+        self.time_to_first_token: Optional[float] = None
+        self._start_time = time.monotonic()
+        self._cancelled = False
+
+    def cancel(self) -> None:
+        """Cancels the request at its next token."""
+        self._cancelled = True
+
+    def __call__(self, token_received: str, **kwargs) -> str:
+        """Adds a token to the output and stops the stream if the output is final or invalid.
+
+        Args:
+            token_received (str): Token received from the stream.
+
+        Returns:
+            str: The received token.
+        """
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.monotonic() - self._start_time
+
+        if self._cancelled:
+            self.status = self.CANCELLED
+            raise StopStreaming(self.status)
+
+        if self.validator is None:
+            self.text += token_received
+            return token_received
+
+        self.status, self.text = self.validator.check(self.text + token_received)
+        if self.status != StreamValidator.CONTINUE:
+            raise StopStreaming(self.status)
+        return token_received
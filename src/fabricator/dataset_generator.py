@@ -1,20 +1,48 @@
 import json
+import math
 import time
 
+from collections import deque
+from dataclasses import dataclass, field
+from functools import partial
+from itertools import islice
 from pathlib import Path
-from collections import defaultdict
-from typing import Any, Callable, Dict, Optional, Union, Tuple, List
+from typing import Any, Callable, Dict, Iterator, Optional, Union, Tuple, List
 from tqdm import tqdm
 from loguru import logger
 
-from datasets import Dataset
+from datasets import ClassLabel, Dataset, Features, Sequence, Value, concatenate_datasets
 from numpy.random import choice
 from haystack.nodes import PromptNode
 from haystack.nodes import PromptTemplate as HaystackPromptTemplate
-
-from .prompts import BasePrompt
-from .samplers import single_label_stratified_sample
-from .utils import log_dir, create_timestamp_path
+from haystack.nodes.prompt.invocation_layer import CohereInvocationLayer, OpenAIInvocationLayer
+
+from .backends import BackendPool, ModelCascade, RequestHedger, StopStreaming, ValidatingStreamHandler
+from .dataset_writer import DatasetWriter, ShardedDatasetWriter
+from .generation_config import GenerationConfig
+from .prompt_calls import BatchedPromptCalls, ConcurrentPromptCalls, PromptCalls, ScoredPromptCalls
+from .prompts import BasePrompt, OutputDecoder, StreamValidator
+from .samplers import LabelQuotaScheduler, single_label_stratified_sample
+from .utils import log_dir, create_timestamp_path, exclusive_call, get_invocation_layer, keeps_call_kwargs
+
+
+@dataclass
+class _GenerationRun:  # pylint: disable=too-many-instance-attributes
+    """Log, writer and output decoder of a generation run, shared by the steps of the generation loop."""
+
+    prompt_template: BasePrompt
+    log_file: Path
+    writer: Union[DatasetWriter, ShardedDatasetWriter]
+    passthrough_columns: List[str]
+    output_decoder: OutputDecoder
+    generates_target_columns: bool
+    target_columns: List[str]
+    annotates_unlabeled_examples: bool
+    label_scheduler: Optional[LabelQuotaScheduler] = None
+    num_samples_to_generate: int = 0
+    # Indices of the unlabeled examples that were annotated, in the order of the generated rows. Examples with
+    # invalid predictions are skipped, so the indices have gaps and are only used to select rows.
+    consumed_indices: List[int] = field(default_factory=list)
 
 
 class DatasetGenerator:
@@ -30,10 +58,13 @@ class DatasetGenerator:
         self.prompt_node = prompt_node
         self._base_log_dir = log_dir()
         self._max_tries = max_tries
+        # Statistics of the last generation run
+        self.run_summary: Dict[str, Any] = {}
 
     def _setup_log(self, prompt_template: BasePrompt) -> Path:
         """For every generation run create a new log file.
-        Current format: <timestamp>_<prompt_template_name>.jsonl
+        Current format: <timestamp>_<prompt_template_name>.jsonl, runs started within the same second get a
+        numbered suffix, since the generated dataset is written next to the log.
 
         Args:
             prompt_template (BasePrompt): Prompt template to generate the dataset with.
@@ -45,8 +76,15 @@ class DatasetGenerator:
         timestamp_path = create_timestamp_path(self._base_log_dir)
         log_file = Path(f"{timestamp_path}_{prompt_template.__class__.__name__}.jsonl")
         log_file.parent.mkdir(parents=True, exist_ok=True)
-        log_file.touch()
-        return log_file
+
+        run_idx = 0
+        while True:
+            try:
+                log_file.touch(exist_ok=False)
+                return log_file
+            except FileExistsError:
+                run_idx += 1
+                log_file = Path(f"{timestamp_path}_{prompt_template.__class__.__name__}_{run_idx}.jsonl")
 
     def generate(
         self,
@@ -61,7 +99,8 @@ class DatasetGenerator:
         num_samples_to_generate: int = 10,
         timeout_per_prompt: Optional[int] = None,
         log_every_n_api_calls: int = 25,
-        dummy_response: Optional[Union[str, Callable]] = None
+        dummy_response: Optional[Union[str, Callable]] = None,
+        generation_config: Optional[GenerationConfig] = None,
     ) -> Union[Dataset, Tuple[Dataset, Dataset]]:
         """Generate a dataset based on a prompt template and support examples.
         Optionally, unlabeled examples can be provided to annotate unlabeled data.
@@ -79,26 +118,41 @@ class DatasetGenerator:
             fewshot_sampling_column (str, optional): Column to sample from. Defaults to None and function will try
                 to sample from the generate_data_for_column attribute of the prompt template.
             unlabeled_dataset (Optional[Dataset], optional): Unlabeled examples to annotate. Defaults to None.
-            return_unlabeled_dataset (bool, optional): Whether to return the original dataset. Defaults to False.
+            return_unlabeled_dataset (bool, optional): Whether to return the annotated rows of the original dataset.
+                They are selected by index, so the original dataset is not copied. Defaults to False.
             max_prompt_calls (int, optional): Maximum number of prompt calls. Defaults to 10.
             num_samples_to_generate (int, optional): Number of samples to generate. Defaults to 10.
             timeout_per_prompt (Optional[int], optional): Timeout per prompt call. Defaults to None.
             log_every_n_api_calls (int, optional): Log every n api calls. Defaults to 25.
             dummy_response (Optional[Union[str, Callable]], optional): Dummy response for dry runs. Defaults to None.
+            generation_config (Optional[GenerationConfig], optional): Options of the run beyond prompting, e.g. how
+                the rows are written and how the prompt calls are run. Defaults to None, which uses the defaults of
+                GenerationConfig.
 
         Returns:
             Union[Dataset, Tuple[Dataset, Dataset]]: Generated dataset or tuple of generated dataset and original
             dataset.
         """
+        generation_config = generation_config or GenerationConfig()
         if fewshot_dataset:
             self._assert_fewshot_dataset_matches_prompt(prompt_template, fewshot_dataset)
 
         assert fewshot_sampling_strategy in [None, "uniform", "stratified"], \
             "Sampling strategy must be 'uniform' or 'stratified'"
 
+        self._check_generation_config(prompt_template, unlabeled_dataset, fewshot_sampling_strategy, generation_config)
+
         if fewshot_dataset and not fewshot_sampling_column:
             fewshot_sampling_column = prompt_template.generate_data_for_column[0]
 
+        label_scheduler = None
+        if generation_config.label_quotas:
+            label_scheduler = LabelQuotaScheduler(
+                generation_config.label_quotas, num_samples_to_generate, max_failures_per_label=self._max_tries
+            )
+            num_samples_to_generate = label_scheduler.total
+            fewshot_sampling_strategy = "uniform"
+
         generated_dataset, original_dataset = self._inner_generate_loop(
             prompt_template,
             fewshot_dataset,
@@ -111,7 +165,9 @@ class DatasetGenerator:
             num_samples_to_generate,
             timeout_per_prompt,
             log_every_n_api_calls,
-            dummy_response
+            dummy_response,
+            generation_config,
+            label_scheduler,
         )
 
         if return_unlabeled_dataset:
@@ -119,77 +175,417 @@ class DatasetGenerator:
 
         return generated_dataset
 
+    def _check_generation_config(
+        self,
+        prompt_template: BasePrompt,
+        unlabeled_dataset: Optional[Dataset],
+        fewshot_sampling_strategy: Optional[str],
+        generation_config: GenerationConfig,
+    ) -> None:
+        """Raises a ValueError if the options of the generation config do not fit the prompt, the datasets or the
+        prompt node. Options that do not fit each other are rejected by the config itself."""
+        if generation_config.request_hedger is not None \
+                and generation_config.request_hedger.alternate_prompt_node is None \
+                and keeps_call_kwargs(self.prompt_node):
+            raise ValueError("The invocation layer of the prompt node keeps the kwargs and the stream handler of a "
+                             "call and runs one call at a time, so its requests can only be hedged to an "
+                             "alternate_prompt_node of the request_hedger.")
+
+        if generation_config.model_cascade is not None and not unlabeled_dataset:
+            raise ValueError("A model_cascade annotates unlabeled examples and requires an unlabeled_dataset.")
+
+        if generation_config.fewshot_group_size > 1 and not unlabeled_dataset:
+            raise ValueError("fewshot_group_size groups unlabeled examples and requires an unlabeled_dataset.")
+
+        if generation_config.label_scorer is not None and (
+            not prompt_template.label_options or not unlabeled_dataset or prompt_template.generates_multiple_columns
+        ):
+            raise ValueError("A label_scorer can only annotate unlabeled examples with a single target column and "
+                             "label_options.")
+
+        label_quotas = generation_config.label_quotas
+        if label_quotas:
+            if unlabeled_dataset:
+                raise ValueError("label_quotas can only be used for generation, not for annotating unlabeled data.")
+
+            if fewshot_sampling_strategy == "stratified":
+                raise ValueError("label_quotas condition every prompt on a single label and cannot be combined with "
+                                 "the 'stratified' sampling strategy.")
+
+            if not prompt_template.label_options or not set(label_quotas) <= set(prompt_template.label_options):
+                raise ValueError("All labels of label_quotas must be label_options of the prompt template.")
+
+    def repair(
+        self,
+        run_log: Union[str, Path],
+        prompt_template: BasePrompt,
+        generated_dataset: Dataset,
+        validator: Optional[Callable[[Dict[str, Any]], bool]] = None,
+        fewshot_dataset: Optional[Dataset] = None,
+        fewshot_sampling_strategy: Optional[str] = None,
+        fewshot_examples_per_class: int = None,
+        fewshot_sampling_column: Optional[str] = None,
+        max_tries_per_row: int = 1,
+        timeout_per_prompt: Optional[int] = None,
+        dummy_response: Optional[Union[str, Callable]] = None,
+    ) -> Dataset:
+        """Re-queries only the failed or invalid rows of a generation run instead of rerunning it. Invalid rows are
+        predictions of the run log that could not be generated or decoded, and rows of the generated dataset that
+        the validator rejects. Rows that are valid after the repair replace their invalid counterparts, rows that
+        were missing are inserted at the position of their prompt in the run log, so the rows keep the order of the
+        prompts. A repaired copy of the run log is written next to it, so a repaired dataset can
+        be repaired again.
+
+        Args:
+            run_log (Union[str, Path]): JSONL log of the run, see run_summary["log_file"].
+            prompt_template (BasePrompt): Prompt template the dataset was generated with.
+            generated_dataset (Dataset): Dataset generated by the run.
+            validator (Optional[Callable[[Dict[str, Any]], bool]], optional): Function that returns whether a
+                generated row is valid, e.g. whether the answer occurs in the context. Defaults to None.
+            fewshot_dataset (Optional[Dataset], optional): Support examples to sample fresh fewshot examples from.
+                Defaults to None, which re-uses the logged prompts.
+            fewshot_sampling_strategy (Optional[str], optional): Sampling strategy for support examples. See
+                generate(). Defaults to None.
+            fewshot_examples_per_class (int, optional): Number of support examples for a certain class per prompt.
+                Defaults to None.
+            fewshot_sampling_column (Optional[str], optional): Column to sample from. Defaults to None.
+            max_tries_per_row (int, optional): Number of prompt calls per invalid row. Defaults to 1.
+            timeout_per_prompt (Optional[int], optional): Timeout per prompt call. Defaults to None.
+            dummy_response (Optional[Union[str, Callable]], optional): Dummy response for dry runs. Defaults to None.
+
+        Returns:
+            Dataset: Generated dataset with repaired rows.
+        """
+        run_log = Path(run_log)
+        with open(run_log, "r", encoding="utf-8") as log_file:
+            log_entries = [json.loads(line) for line in log_file if line.strip()]
+
+        if fewshot_dataset and not fewshot_sampling_column:
+            fewshot_sampling_column = prompt_template.generate_data_for_column[0]
+
+        entry_idx_by_row = {
+            entry["row_idx"]: entry_idx for entry_idx, entry in enumerate(log_entries)
+            if entry.get("row_idx") is not None
+        }
+        entries_to_repair = [entry_idx for entry_idx, entry in enumerate(log_entries) if not entry.get("valid", True)]
+        if validator is not None:
+            for row_idx, row in enumerate(generated_dataset):
+                if not validator(row) and row_idx in entry_idx_by_row:
+                    entries_to_repair.append(entry_idx_by_row[row_idx])
+
+        self.run_summary = {"rows_to_repair": len(entries_to_repair), "prompt_calls": 0, "repaired_rows": 0}
+        features = generated_dataset.features
+        replaced_rows, appended_rows = {}, []
+
+        for entry_idx in tqdm(sorted(entries_to_repair), desc="Repairing dataset"):
+            entry = log_entries[entry_idx]
+            invocation_context = entry["invocation_context"]
+            prompt_labels = entry.get("labels")
+            generates_target_columns = self._generates_target_columns(prompt_template, invocation_context is not None)
+            target_columns = prompt_template.generate_data_for_column if generates_target_columns \
+                else prompt_template.DEFAULT_TEXT_COLUMN
+            output_decoder = prompt_template.get_output_decoder(
+                Features({column: features[column] for column in target_columns})
+            )
+
+            for _ in range(max_tries_per_row):
+                prompt_text = entry["prompt"]
+                if fewshot_dataset:
+                    prompt_labels, fewshot_examples = self._sample_fewshot_examples(
+                        prompt_template, fewshot_dataset, fewshot_sampling_strategy, fewshot_examples_per_class,
+                        fewshot_sampling_column, prompt_labels if isinstance(prompt_labels, str) else None
+                    )
+                    prompt_text = prompt_template.get_prompt_text(prompt_labels, fewshot_examples)
+
+                prediction = self._try_generate(prompt_text, invocation_context, dummy_response)
+                self.run_summary["prompt_calls"] += 1
+                if timeout_per_prompt is not None:
+                    time.sleep(timeout_per_prompt)
+                if prediction is None:
+                    continue
+
+                completion = prediction if isinstance(prediction, str) else prediction[0]
+                decoded_values, invalid_columns = output_decoder.decode(
+                    self._parse_completion(prompt_template, completion, generates_target_columns)
+                )
+                if invalid_columns:
+                    continue
+
+                generated_sample = self._build_generated_sample(
+                    prompt_template, decoded_values, invocation_context, prompt_labels
+                )
+                if validator is not None and not validator(generated_sample):
+                    continue
+
+                if entry.get("row_idx") is not None:
+                    replaced_rows[entry["row_idx"]] = features.encode_example(
+                        {column: generated_sample.get(column) for column in features}
+                    )
+                else:
+                    entry["row_idx"] = len(generated_dataset) + len(appended_rows)
+                    appended_rows.append(generated_sample)
+                entry.update({"prompt": prompt_text, "labels": prompt_labels, "prediction": completion, "valid": True})
+                self.run_summary["repaired_rows"] += 1
+                break
+
+        if replaced_rows:
+            generated_dataset = generated_dataset.map(
+                self._replace_rows,
+                batched=True,
+                with_indices=True,
+                features=features,
+                fn_kwargs={"replaced_rows": replaced_rows},
+            )
+
+        if appended_rows:
+            num_generated_rows = len(generated_dataset)
+            generated_dataset = concatenate_datasets([
+                generated_dataset,
+                Dataset.from_dict(
+                    {column: [row.get(column) for row in appended_rows] for column in features}, features=features
+                ),
+            ])
+
+            # Rows that were missing are moved to the position of their prompt in the run log, rows without a log
+            # entry stay at the end
+            logged_entries = [entry for entry in log_entries if entry.get("row_idx") is not None]
+            row_order = [entry["row_idx"] for entry in logged_entries]
+            logged_rows = set(row_order)
+            row_order += [row_idx for row_idx in range(num_generated_rows) if row_idx not in logged_rows]
+            generated_dataset = generated_dataset.select(row_order)
+            for row_idx, entry in enumerate(logged_entries):
+                entry["row_idx"] = row_idx
+
+        repaired_log = run_log.with_name(f"{run_log.stem}_repaired.jsonl")
+        with open(repaired_log, "w", encoding="utf-8") as log_file:
+            for entry in log_entries:
+                log_file.write(f"{json.dumps(entry)}\n")
+
+        self.run_summary["log_file"] = str(repaired_log)
+        logger.info("Repair summary: {}", self.run_summary)
+        return generated_dataset
+
+    @staticmethod
+    def _replace_rows(
+        examples: Dict[str, List], indices: List[int], replaced_rows: Dict[int, Dict[str, Any]]
+    ) -> Dict[str, List]:
+        """Batched replacement of the rows at the given indices with encoded repaired rows."""
+        for batch_idx, row_idx in enumerate(indices):
+            if row_idx in replaced_rows:
+                for column, value in replaced_rows[row_idx].items():
+                    examples[column][batch_idx] = value
+        return examples
+
     def _try_generate(
-        self, prompt_text: str, invocation_context: Dict, dummy_response: Optional[Union[str, Callable]]
-    ) -> Optional[str]:
+        self,
+        prompt_text: str,
+        invocation_context: Dict,
+        dummy_response: Optional[Union[str, Callable]],
+        completions_per_call: int = 1,
+        generation_kwargs: Optional[Dict[str, Any]] = None,
+        stream_handler: Optional[ValidatingStreamHandler] = None,
+        request_hedger: Optional[RequestHedger] = None,
+        model_cascade: Optional[ModelCascade] = None,
+        decode: Optional[Callable[[str], Optional[str]]] = None,
+    ) -> Optional[Union[str, List[str]]]:
         """Tries to generate a single example. Restrict the time spent on this.
 
         Args:
             prompt_text: Prompt text to generate an example for.
             invocation_context: Invocation context to generate an example for.
             dry_run: Whether to actually generate the example or just return a dummy example.
+            completions_per_call: Number of completions to request in a single call.
+            generation_kwargs: Further generation kwargs of the backend, e.g. the maximum length.
+            stream_handler: Handler that streams the prediction and stops the request once its output is final
+                or invalid.
+            request_hedger: Hedger duplicating the request if it is slow.
+            model_cascade: Cascade of prompt nodes that runs the prompt instead of the prompt node. Its predictions
+                are not streamed, the configuration rejects streaming with a cascade.
+            decode: Decodes a completion for the agreement of the cascade, None if it is invalid.
 
         Returns:
-            Generated example
+            Generated example or list of completions
         """
 
         if dummy_response:
 
             if isinstance(dummy_response, str):
                 logger.info(f"Returning dummy response: {dummy_response}")
-                return dummy_response
+                return dummy_response if completions_per_call == 1 else [dummy_response] * completions_per_call
 
             if callable(dummy_response):
-                dummy_value = dummy_response(prompt_text)
+                dummy_value = [dummy_response(prompt_text) for _ in range(completions_per_call)]
                 logger.info(f"Returning dummy response: {dummy_response}")
-                return dummy_value
+                return dummy_value[0] if completions_per_call == 1 else dummy_value
 
             raise ValueError("Dummy response must be a string or a callable")
 
+        if model_cascade is not None:
+            return self._generate_with_cascade(
+                prompt_text, invocation_context, model_cascade, decode, generation_kwargs
+            )
+
+        generation_kwargs = dict(generation_kwargs or {})
+        if completions_per_call > 1:
+            # haystack maps top_k to the number of completions of the backend, e.g. n for OpenAI
+            generation_kwargs["top_k"] = completions_per_call
+
+        if request_hedger is not None:
+            # Every hedged request streams to its own handler, so the losing request can be cancelled. Several
+            # completions of a request would be merged in the stream, so they are not cancellable and not hedged.
+            return request_hedger.run(
+                lambda prompt_node, handler: self._run_prompt_node(
+                    prompt_node, prompt_text, invocation_context, generation_kwargs,
+                    handler if completions_per_call == 1 else None,
+                ),
+                self.prompt_node,
+                stream_handler,
+                cancellable=completions_per_call == 1,
+            )
+
+        return self._run_prompt_node(
+            self.prompt_node, prompt_text, invocation_context, generation_kwargs, stream_handler
+        )
+
+    @staticmethod
+    def _run_prompt_node(
+        prompt_node: PromptNode,
+        prompt_text: str,
+        invocation_context: Optional[Dict],
+        generation_kwargs: Dict[str, Any],
+        stream_handler: Optional[ValidatingStreamHandler] = None,
+    ) -> Optional[List[str]]:
+        """Runs a prompt on a prompt node, None if the request failed or was cancelled."""
+        if stream_handler is not None:
+            generation_kwargs = {**generation_kwargs, "stream_handler": stream_handler}
+
         # Haystack internally uses timeouts and retries, so we dont have to do it
         # We dont catch authentification errors here, because we want to fail fast
         try:
-            prediction = self.prompt_node.run(
-                prompt_template=HaystackPromptTemplate(prompt=prompt_text),
-                invocation_context=invocation_context,
-            )[0]["results"]
+            # The kwargs and the stream handler of this call must not be shared with other calls of the prompt node
+            with exclusive_call(prompt_node):
+                if stream_handler is not None and stream_handler.status == ValidatingStreamHandler.CANCELLED:
+                    # The request lost against its hedge while it waited for the prompt node
+                    return None
+                prediction = prompt_node.run(
+                    prompt_template=HaystackPromptTemplate(prompt=prompt_text),
+                    invocation_context=invocation_context,
+                    generation_kwargs=generation_kwargs or None,
+                )[0]["results"]
+        except StopStreaming:
+            if stream_handler is None or stream_handler.status == ValidatingStreamHandler.CANCELLED:
+                return None
+            # The output is final or invalid, the handler holds the output streamed so far
+            return [stream_handler.text]
         except Exception as error:
             logger.error(f"Error while generating example: {error}")
             return None
 
         return prediction
 
-    def _inner_generate_loop(
+    def _generate_with_cascade(
         self,
+        prompt_text: str,
+        invocation_context: Dict,
+        model_cascade: ModelCascade,
+        decode: Callable[[str], Optional[str]],
+        generation_kwargs: Optional[Dict[str, Any]] = None,
+    ) -> Optional[List[str]]:
+        """Runs a prompt on the prompt nodes of a cascade until one is confident about its output, None if the
+        last prompt node failed."""
+
+        def send(prompt_node: PromptNode, num_completions: int) -> Optional[List[str]]:
+            kwargs = dict(generation_kwargs or {})
+            if num_completions > 1:
+                kwargs["top_k"] = num_completions
+            return self._run_prompt_node(prompt_node, prompt_text, invocation_context, kwargs)
+
+        completion = model_cascade.run(send, decode)
+        return None if completion is None else [completion]
+
+    @staticmethod
+    def _decode_for_cascade(
         prompt_template: BasePrompt,
-        fewshot_dataset: Dataset,
-        fewshot_examples_per_class: int,
-        fewshot_sampling_strategy: str,
-        fewshot_sampling_column: str,
-        unlabeled_dataset: Dataset,
-        return_unlabeled_dataset: bool,
-        max_prompt_calls: int,
-        num_samples_to_generate: int,
-        timeout_per_prompt: Optional[int],
-        log_every_n_api_calls: int = 25,
-        dummy_response: Optional[Union[str, Callable]] = None
-    ):
-        current_tries_left = self._max_tries
-        current_log_file = self._setup_log(prompt_template)
+        output_decoder: OutputDecoder,
+        generates_target_columns: bool,
+        completion: str,
+    ) -> Optional[str]:
+        """Decodes a completion to a comparable value for the agreement of a cascade, None if it is invalid."""
+        decoded_values, invalid_columns = output_decoder.decode(
+            DatasetGenerator._parse_completion(prompt_template, completion, generates_target_columns)
+        )
+        if invalid_columns:
+            return None
+        return json.dumps(decoded_values, sort_keys=True, default=str)
+
+    def _derive_generation_kwargs(
+        self, prompt_template: BasePrompt, fewshot_dataset: Optional[Dataset], use_label_options: bool
+    ) -> Dict[str, Any]:
+        """Derives the maximum number of new tokens and the stop sequences of the predictions for a prompt."""
+        generation_kwargs = {}
+        stop_words = prompt_template.get_stop_words()
+        if stop_words:
+            generation_kwargs["stop_words"] = stop_words
+
+        max_new_tokens = prompt_template.estimate_max_new_tokens(
+            self._get_token_counter(), fewshot_dataset, use_label_options=use_label_options
+        )
+        if max_new_tokens is not None:
+            # OpenAI and Cohere models read max_tokens, the other layers, e.g. local Hugging Face models, max_length
+            invocation_layer = self._get_invocation_layer()
+            if isinstance(invocation_layer, (OpenAIInvocationLayer, CohereInvocationLayer)):
+                generation_kwargs["max_tokens"] = max_new_tokens
+            else:
+                generation_kwargs["max_length"] = max_new_tokens
 
-        generated_dataset = defaultdict(list)
-        original_dataset = defaultdict(list)
+        logger.info("Derived generation kwargs: {}", generation_kwargs)
+        return generation_kwargs
 
-        if unlabeled_dataset:
-            api_calls = range(min(max_prompt_calls, len(unlabeled_dataset)))
-        else:
-            api_calls = range(min(max_prompt_calls, num_samples_to_generate))
+    def _get_token_counter(self) -> Callable[[str], int]:
+        """Counts tokens with the tokenizer of the prompt node, or characters as upper bound if it has none."""
+        invocation_layer = self._get_invocation_layer()
 
-        for prompt_call_idx, unlabeled_example_idx in tqdm(
-            enumerate(api_calls, start=1), desc="Generating dataset", total=len(api_calls)
-        ):
-            fewshot_examples = None
-            unlabeled_example = None
+        pipe = getattr(invocation_layer, "pipe", None)
+        if pipe is not None:
+            return lambda text: len(pipe.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+        # OpenAI invocation layers tokenize with tiktoken
+        tokenizer = getattr(invocation_layer, "_tokenizer", None)
+        if tokenizer is not None and hasattr(tokenizer, "encode"):
+            return lambda text: len(tokenizer.encode(text))
+
+        return len
+
+    def _get_invocation_layer(self) -> Optional[Any]:
+        """Invocation layer of the prompt node, or of the first backend if the prompt node is a BackendPool."""
+        if isinstance(self.prompt_node, BackendPool):
+            return get_invocation_layer(self.prompt_node.backends[0].prompt_node)
+        return get_invocation_layer(self.prompt_node)
+
+    def _iter_prompt_requests(
+        self,
+        prompt_template: BasePrompt,
+        fewshot_dataset: Optional[Dataset],
+        fewshot_examples_per_class: int,
+        fewshot_sampling_strategy: str,
+        fewshot_sampling_column: str,
+        api_calls: range,
+        unlabeled_examples: Optional[Iterator[Dict[str, Any]]],
+        label_scheduler: Optional[LabelQuotaScheduler],
+        log_every_n_api_calls: int,
+        fewshot_group_size: int = 1,
+    ) -> Iterator[Tuple[int, Optional[int], str, Optional[Dict[str, Any]], Optional[Union[str, List[str]]]]]:
+        """Builds the prompt of every prompt call lazily, so labels are scheduled and fewshot examples are sampled
+        only when a prompt is submitted. Fewshot examples are sampled once per group of fewshot_group_size
+        consecutive prompt calls.
+
+        Yields:
+            Tuple of the prompt call index, the index of the unlabeled example, the prompt text, the invocation
+            context and the labels of the prompt.
+        """
+        fewshot_examples = None
+        fewshot_labels = None
+        for prompt_call_idx, unlabeled_example_idx in enumerate(api_calls, start=1):
             invocation_context = None
             prompt_labels = None
 
@@ -198,19 +594,26 @@ class DatasetGenerator:
                 # require a second parameter for sample from label options and not from fewshot examples
                 prompt_labels = prompt_template.label_options
 
+            if label_scheduler:
+                prompt_labels = label_scheduler.next_label()
+                if prompt_labels is None:
+                    return
+
             if fewshot_dataset:
-                prompt_labels, fewshot_examples = self._sample_fewshot_examples(
-                    prompt_template, fewshot_dataset, fewshot_sampling_strategy, fewshot_examples_per_class,
-                    fewshot_sampling_column
-                )
+                # All prompts of a group share the fewshot examples and hence the prefix of the prompt text
+                if (prompt_call_idx - 1) % fewshot_group_size == 0:
+                    fewshot_labels, fewshot_examples = self._sample_fewshot_examples(
+                        prompt_template, fewshot_dataset, fewshot_sampling_strategy, fewshot_examples_per_class,
+                        fewshot_sampling_column, prompt_labels if label_scheduler else None
+                    )
+                prompt_labels = fewshot_labels
 
             prompt_text = prompt_template.get_prompt_text(prompt_labels, fewshot_examples)
 
-            if unlabeled_dataset:
-                unlabeled_example = unlabeled_dataset[unlabeled_example_idx]
-                invocation_context = prompt_template.filter_example_by_columns(
-                    unlabeled_example, prompt_template.fewshot_example_columns
-                )
+            if unlabeled_examples is not None:
+                invocation_context = next(unlabeled_examples, None)
+                if invocation_context is None:
+                    return
 
             if log_every_n_api_calls > 0:
                 if prompt_call_idx % log_every_n_api_calls == 0:
@@ -220,100 +623,536 @@ class DatasetGenerator:
                         f"Invocation context: {invocation_context} \n"
                     )
 
-            prediction = self._try_generate(prompt_text, invocation_context, dummy_response)
+            yield prompt_call_idx, unlabeled_example_idx, prompt_text, invocation_context, prompt_labels
+
+    def _inner_generate_loop(
+        self,
+        prompt_template: BasePrompt,
+        fewshot_dataset: Dataset,
+        fewshot_examples_per_class: int,
+        fewshot_sampling_strategy: str,
+        fewshot_sampling_column: str,
+        unlabeled_dataset: Dataset,
+        return_unlabeled_dataset: bool,
+        max_prompt_calls: int,
+        num_samples_to_generate: int,
+        timeout_per_prompt: Optional[int],
+        log_every_n_api_calls: int = 25,
+        dummy_response: Optional[Union[str, Callable]] = None,
+        generation_config: Optional[GenerationConfig] = None,
+        label_scheduler: Optional[LabelQuotaScheduler] = None,
+    ):
+        config = generation_config or GenerationConfig()
+        current_tries_left = self._max_tries
+        run = self._start_run(prompt_template, fewshot_dataset, unlabeled_dataset, fewshot_sampling_strategy, config)
+        run.label_scheduler = label_scheduler
+
+        unlabeled_examples = None
+        if unlabeled_dataset:
+            api_calls = range(min(max_prompt_calls, len(unlabeled_dataset)))
+            unlabeled_examples = self._iter_unlabeled_examples(
+                unlabeled_dataset.select(api_calls), prompt_template.fewshot_example_columns,
+                config.prefetch_batch_size
+            )
+            # All unlabeled examples of the run are annotated, num_samples_to_generate only limits generation
+            num_samples_to_generate = len(api_calls) * config.completions_per_call
+        elif label_scheduler:
+            # Failed outputs are scheduled again, so the run only ends when all quotas are met
+            api_calls = range(max_prompt_calls)
+        else:
+            api_calls = range(min(max_prompt_calls, math.ceil(num_samples_to_generate / config.completions_per_call)))
+        run.num_samples_to_generate = num_samples_to_generate
+
+        generation_kwargs = None
+        if config.limit_generation_length:
+            generation_kwargs = self._derive_generation_kwargs(
+                prompt_template,
+                fewshot_dataset,
+                use_label_options=bool(unlabeled_dataset) and not prompt_template.generates_multiple_columns,
+            )
+
+        self._reset_run_summary(run)
+        stream_validator = None
+        times_to_first_token = []
+        if config.stream_predictions:
+            # Outputs are only checked against the labels if they have to be one of them
+            stream_validator = prompt_template.get_stream_validator(
+                use_label_options=prompt_template.constrain_to_label_options
+                and not prompt_template.generates_multiple_columns
+            )
+            self.run_summary.update({"time_to_first_token": None, "stopped_final": 0, "stopped_invalid": 0})
+
+        backend_stats = self._snapshot_backend_stats(config, dummy_response)
+        prompt_calls = self._create_prompt_calls(run, config, dummy_response, generation_kwargs)
+        prompt_requests = self._iter_prompt_requests(
+            prompt_template,
+            fewshot_dataset,
+            fewshot_examples_per_class,
+            fewshot_sampling_strategy,
+            fewshot_sampling_column,
+            api_calls,
+            unlabeled_examples,
+            label_scheduler,
+            log_every_n_api_calls,
+            config.fewshot_group_size,
+        )
+        pending_calls = deque()
+        progress_bar = tqdm(desc="Generating dataset", total=len(api_calls))
+
+        while True:
+            num_new_calls = prompt_calls.max_pending - len(pending_calls)
+            if label_scheduler:
+                # Calls in flight reserve rows of their label, so no more calls are issued than the quotas need
+                num_new_calls = min(num_new_calls, sum(
+                    math.ceil(missing / config.completions_per_call)
+                    for missing in label_scheduler.unreserved.values()
+                ))
+
+            for prompt_request in islice(prompt_requests, num_new_calls):
+                prompt_text, invocation_context, prompt_labels = prompt_request[2:5]
+                reserved_rows = label_scheduler.reserve(prompt_labels, config.completions_per_call) \
+                    if label_scheduler else 0
+                # Prompt calls are counted when they are issued, calls cancelled before they ran are subtracted
+                self.run_summary["prompt_calls"] += 1
+                stream_handler = ValidatingStreamHandler(stream_validator) if stream_validator else None
+                # Calls that run when their row is processed have no future
+                future = prompt_calls.submit(  # pylint: disable=assignment-from-none
+                    prompt_text, invocation_context, stream_handler
+                )
+                pending_calls.append((prompt_request, future, stream_handler, reserved_rows))
+
+            if not pending_calls:
+                break
+
+            prompt_request, future, stream_handler, reserved_rows = pending_calls.popleft()
+            prompt_call_idx, _, prompt_text, invocation_context, prompt_labels = prompt_request
+            progress_bar.update()
+
+            prediction, row_values = prompt_calls.result(prompt_text, invocation_context, stream_handler, future)
+            if stream_handler is not None:
+                self._record_stream(stream_handler, times_to_first_token)
+            if label_scheduler:
+                # The outputs of the call are recorded instead
+                label_scheduler.release(prompt_labels, reserved_rows)
 
             if prediction is None:
                 current_tries_left -= 1
-                logger.warning(f"Could not generate example for prompt {prompt_text}.")
+                self._record_failed_call(run, prompt_request)
                 if current_tries_left == 0:
                     logger.warning(
                         f"Max tries ({self._max_tries}) exceeded. Returning generated dataset with"
-                        f" {len(generated_dataset)} examples."
+                        f" {len(run.writer)} examples."
                     )
                     break
+                continue
 
-            if len(prediction) == 1:
-                prediction = prediction[0]
-
-            # If we have a target variable, we re-use the relevant columns of the input example
-            # and add the prediction to the generated dataset
-            if prompt_template.generate_data_for_column and unlabeled_example:
-                generated_sample = prompt_template.filter_example_by_columns(
-                    unlabeled_example, prompt_template.fewshot_example_columns
-                )
-
-                for key, value in generated_sample.items():
-                    generated_dataset[key].append(value)
-
-                # Try to safely convert the prediction to the type of the target variable
-                if not prompt_template.generate_data_for_column[0] in unlabeled_example:
-                    prediction = self._convert_prediction(
-                        prediction, type(prompt_template.generate_data_for_column[0])
-                    )
+            self._write_completions(run, prompt_request, prediction, row_values)
 
-                generated_dataset[prompt_template.generate_data_for_column[0]].append(prediction)
-
-            else:
-                generated_dataset[prompt_template.DEFAULT_TEXT_COLUMN[0]].append(prediction)
-                if prompt_labels and isinstance(prompt_labels, str):
-                    generated_dataset[prompt_template.DEFAULT_LABEL_COLUMN[0]].append(prompt_labels)
-
-            log_entry = {
-                "prompt": prompt_text,
-                "invocation_context": invocation_context,
-                "prediction": prediction,
-                "target": prompt_template.generate_data_for_column[0]
-                if prompt_template.generate_data_for_column
-                else prompt_template.DEFAULT_TEXT_COLUMN[0],
-            }
-            with open(current_log_file, "a", encoding="utf-8") as log_file:
-                log_file.write(f"{json.dumps(log_entry)}\n")
-
-            if return_unlabeled_dataset:
-                for key, value in unlabeled_example.items():
-                    original_dataset[key].append(value)
+            if label_scheduler and label_scheduler.done:
+                logger.info("Met all label quotas: {}.", label_scheduler.counts)
+                break
 
             if prompt_call_idx >= max_prompt_calls:
                 logger.info("Reached maximum number of prompt calls ({}).", max_prompt_calls)
                 break
 
-            if len(generated_dataset) >= num_samples_to_generate:
+            if len(run.writer) >= num_samples_to_generate:
                 logger.info("Generated {} samples.", num_samples_to_generate)
                 break
 
             if timeout_per_prompt is not None:
                 time.sleep(timeout_per_prompt)
 
-        generated_dataset = Dataset.from_dict(generated_dataset)
+        progress_bar.close()
+        self._cancel_pending_calls(pending_calls, label_scheduler)
+        prompt_calls.close()
+
+        self._record_backend_stats(config, backend_stats, dummy_response)
+        if times_to_first_token:
+            self.run_summary["time_to_first_token"] = sum(times_to_first_token) / len(times_to_first_token)
+
+        return self._finish_run(run, unlabeled_dataset, return_unlabeled_dataset)
+
+    def _start_run(
+        self,
+        prompt_template: BasePrompt,
+        fewshot_dataset: Optional[Dataset],
+        unlabeled_dataset: Optional[Dataset],
+        fewshot_sampling_strategy: Optional[str],
+        config: GenerationConfig,
+    ) -> _GenerationRun:
+        """Sets up the log, the writer and the output decoder of a generation run."""
+        log_file = self._setup_log(prompt_template)
+        generated_features = self._infer_generated_features(
+            prompt_template, fewshot_dataset, unlabeled_dataset, fewshot_sampling_strategy
+        )
+        if config.label_scorer:
+            generated_features[f"{prompt_template.generate_data_for_column[0]}_probabilities"] = \
+                Sequence(Value("float32"))
+
+        if config.output_dir is not None:
+            # Shards on disk are self-contained, so they hold the passthrough columns as well
+            passthrough_columns = []
+            writer = ShardedDatasetWriter(
+                config.output_dir, generated_features, rows_per_shard=config.rows_per_shard,
+                shard_format=config.output_format
+            )
+        else:
+            # Passthrough columns of the unlabeled examples are taken from the unlabeled dataset after the run
+            passthrough_columns = [
+                column for column in generated_features
+                if prompt_template.generate_data_for_column and unlabeled_dataset
+                and column in (prompt_template.fewshot_example_columns or [])
+                and column not in prompt_template.generate_data_for_column
+            ]
+            writer = DatasetWriter(
+                log_file.with_suffix(".arrow"),
+                Features({
+                    column: feature for column, feature in generated_features.items()
+                    if column not in passthrough_columns
+                }),
+            )
+
+        generates_target_columns = self._generates_target_columns(prompt_template, bool(unlabeled_dataset))
+        target_columns = prompt_template.generate_data_for_column if generates_target_columns \
+            else prompt_template.DEFAULT_TEXT_COLUMN
+        target_features = Features({column: generated_features[column] for column in target_columns})
+        output_decoder = prompt_template.get_output_decoder(target_features)
+        if config.model_cascade is not None and prompt_template.label_options and generates_target_columns \
+                and not prompt_template.generates_multiple_columns:
+            # A cascade only accepts outputs that are one of the labels, even if they are not constrained to them.
+            # Rows are decoded like the cascade checks them, so they hold the matched label.
+            output_decoder = OutputDecoder(
+                target_features,
+                label_options=prompt_template.label_options,
+                label_columns=target_columns,
+                fuzzy_cutoff=prompt_template.fuzzy_matching_cutoff,
+            )
+
+        return _GenerationRun(
+            prompt_template=prompt_template,
+            log_file=log_file,
+            writer=writer,
+            passthrough_columns=passthrough_columns,
+            output_decoder=output_decoder,
+            generates_target_columns=generates_target_columns,
+            target_columns=target_columns,
+            annotates_unlabeled_examples=bool(unlabeled_dataset),
+        )
+
+    def _create_prompt_calls(
+        self,
+        run: _GenerationRun,
+        config: GenerationConfig,
+        dummy_response: Optional[Union[str, Callable]],
+        generation_kwargs: Optional[Dict[str, Any]],
+    ) -> PromptCalls:
+        """Picks how the prompt calls of a run are executed: scored by a label scorer, batched by a batch
+        executor, concurrently or one at a time."""
+        prompt_template = run.prompt_template
+        if config.label_scorer is not None:
+            return ScoredPromptCalls(
+                config.label_scorer,
+                prompt_template.label_options,
+                f"{prompt_template.generate_data_for_column[0]}_probabilities",
+            )
+
+        if config.batch_executor is not None and not dummy_response:
+            return BatchedPromptCalls(config.batch_executor, config.completions_per_call, generation_kwargs)
+
+        model_cascade = config.model_cascade if not dummy_response else None
+        generate = partial(
+            self._try_generate,
+            dummy_response=dummy_response,
+            completions_per_call=config.completions_per_call,
+            generation_kwargs=generation_kwargs,
+            request_hedger=config.request_hedger,
+            model_cascade=model_cascade,
+            decode=partial(
+                self._decode_for_cascade, prompt_template, run.output_decoder, run.generates_target_columns
+            ) if model_cascade is not None else None,
+        )
+        if config.max_concurrent_calls > 1:
+            return ConcurrentPromptCalls(generate, config.max_concurrent_calls)
+        return PromptCalls(generate)
+
+    def _reset_run_summary(self, run: _GenerationRun) -> None:
+        """Starts the statistics of a generation run."""
+        self.run_summary = {
+            "log_file": str(run.log_file),
+            "prompt_calls": 0,
+            "failed_prompt_calls": 0,
+            "completions": 0,
+            "generated_rows": 0,
+            "invalid_rows": 0,
+            "column_failures": dict.fromkeys(run.target_columns, 0),
+        }
+        if run.label_scheduler:
+            self.run_summary["label_counts"] = run.label_scheduler.counts
+            self.run_summary["label_failures"] = run.label_scheduler.failures
+
+    def _record_failed_call(
+        self,
+        run: _GenerationRun,
+        prompt_request: Tuple[int, Optional[int], str, Optional[Dict[str, Any]], Optional[Union[str, List[str]]]],
+    ) -> None:
+        """Logs a prompt call without prediction as invalid, so it can be repaired later."""
+        _, _, prompt_text, invocation_context, prompt_labels = prompt_request
+        self.run_summary["failed_prompt_calls"] += 1
+        if run.label_scheduler:
+            run.label_scheduler.record(prompt_labels, success=False)
+        self._write_log_entry(
+            run.log_file, run.prompt_template, prompt_text, invocation_context, prompt_labels, None, None
+        )
+        logger.warning(f"Could not generate example for prompt {prompt_text}.")
+
+    def _cancel_pending_calls(self, pending_calls: deque, label_scheduler: Optional[LabelQuotaScheduler]) -> None:
+        """Cancels the prompt calls submitted ahead, which are not needed anymore once the loop stops."""
+        for (_, _, _, _, prompt_labels), future, stream_handler, reserved_rows in pending_calls:
+            if future is not None and future.cancel():
+                self.run_summary["prompt_calls"] -= 1
+            if label_scheduler:
+                label_scheduler.release(prompt_labels, reserved_rows)
+            if stream_handler is not None:
+                stream_handler.cancel()
+
+    def _write_completions(
+        self,
+        run: _GenerationRun,
+        prompt_request: Tuple[int, Optional[int], str, Optional[Dict[str, Any]], Optional[Union[str, List[str]]]],
+        prediction: Union[str, List[str]],
+        row_values: Dict[str, Any],
+    ) -> None:
+        """Decodes the completions of a prompt call and writes the valid ones as rows, up to the number of samples
+        still missing. Every completion is logged, invalid ones are reported, not kept."""
+        _, unlabeled_example_idx, prompt_text, invocation_context, prompt_labels = prompt_request
+        prompt_template = run.prompt_template
+        label_scheduler = run.label_scheduler
+        completions = [prediction] if isinstance(prediction, str) else list(prediction)
+        self.run_summary["completions"] += len(completions)
+
+        if label_scheduler:
+            num_missing_samples = label_scheduler.remaining[prompt_labels]
+        else:
+            num_missing_samples = run.num_samples_to_generate - len(run.writer)
+
+        for completion in completions[:num_missing_samples]:
+            # Cast the prediction to the features of the target columns
+            decoded_values, invalid_columns = run.output_decoder.decode(
+                self._parse_completion(prompt_template, completion, run.generates_target_columns)
+            )
+            for column in invalid_columns:
+                self.run_summary["column_failures"][column] += 1
+
+            if label_scheduler:
+                # Only valid outputs count towards the quota, the label is scheduled again otherwise
+                label_scheduler.record(prompt_labels, success=not invalid_columns)
+
+            self._write_log_entry(
+                run.log_file, prompt_template, prompt_text, invocation_context, prompt_labels, completion,
+                None if invalid_columns else len(run.writer)
+            )
+
+            if invalid_columns:
+                self.run_summary["invalid_rows"] += 1
+                logger.warning("Could not decode {} from prediction {}.", invalid_columns, repr(completion))
+                continue
+
+            decoded_values.update(row_values)
+            run.writer.add(
+                self._build_generated_sample(prompt_template, decoded_values, invocation_context, prompt_labels)
+            )
+            if run.annotates_unlabeled_examples:
+                run.consumed_indices.append(unlabeled_example_idx)
+
+    def _record_stream(self, stream_handler: ValidatingStreamHandler, times_to_first_token: List[float]) -> None:
+        """Records the time to the first token of a streamed prediction and whether it was stopped early."""
+        if stream_handler.time_to_first_token is not None:
+            times_to_first_token.append(stream_handler.time_to_first_token)
+        # The handler of a hedged request that lost was cancelled
+        if stream_handler.status in (StreamValidator.FINAL, StreamValidator.INVALID):
+            self.run_summary[f"stopped_{stream_handler.status}"] += 1
+
+    def _snapshot_backend_stats(
+        self, config: GenerationConfig, dummy_response: Optional[Union[str, Callable]]
+    ) -> Dict[str, Any]:
+        """Statistics of the hedger at the start of a run, the statistics of the cascade are reset instead."""
+        if config.model_cascade is not None and not dummy_response:
+            config.model_cascade.reset_stats()
+        return dict(config.request_hedger.stats) if config.request_hedger is not None else {}
+
+    def _record_backend_stats(
+        self,
+        config: GenerationConfig,
+        backend_stats: Dict[str, Any],
+        dummy_response: Optional[Union[str, Callable]],
+    ) -> None:
+        """Adds the statistics of the backend pool, the hedger and the cascade during the run to run_summary."""
+        if isinstance(self.prompt_node, BackendPool):
+            self.run_summary["backends"] = self.prompt_node.stats
+
+        if config.request_hedger is not None:
+            for stat in ("hedged_requests", "hedge_wins"):
+                self.run_summary[stat] = config.request_hedger.stats[stat] - backend_stats[stat]
+
+        if config.model_cascade is not None and not dummy_response:
+            self.run_summary["cascade"] = config.model_cascade.stats
+
+    def _finish_run(
+        self, run: _GenerationRun, unlabeled_dataset: Optional[Dataset], return_unlabeled_dataset: bool
+    ) -> Tuple[Dataset, Optional[Dataset]]:
+        """Finalizes the written rows and adds the passthrough columns of the annotated unlabeled examples."""
+        generated_dataset = run.writer.finalize()
+        self.run_summary["generated_rows"] = len(generated_dataset)
+        logger.info("Run summary: {}", self.run_summary)
+
+        if run.passthrough_columns:
+            # Datasets are concatenated along the columns only without an indices mapping, so the annotated rows of
+            # the passthrough columns are copied into a contiguous table once
+            passthrough_dataset = unlabeled_dataset.select_columns(run.passthrough_columns)
+            passthrough_dataset = passthrough_dataset.select(run.consumed_indices).flatten_indices()
+            generated_dataset = concatenate_datasets([passthrough_dataset, generated_dataset], axis=1)
 
         if return_unlabeled_dataset:
-            original_dataset = Dataset.from_dict(original_dataset)
-            return generated_dataset, original_dataset
+            return generated_dataset, unlabeled_dataset.select(run.consumed_indices)
 
         return generated_dataset, None
 
-    def _convert_prediction(self, prediction: str, target_type: type) -> Any:
-        """Converts a prediction to the target type.
+    @staticmethod
+    def _iter_unlabeled_examples(
+        unlabeled_dataset: Dataset, columns: Optional[List[str]], batch_size: int
+    ) -> Iterator[Dict[str, Any]]:
+        """Iterates over the unlabeled examples restricted to the given columns. Rows are read in batches, which
+        avoids the overhead of indexing the dataset for every single example.
 
         Args:
-            prediction: Prediction to convert.
-            target_type: Type to convert the prediction to.
+            unlabeled_dataset (Dataset): Unlabeled examples to annotate.
+            columns (Optional[List[str]]): Columns to keep, in the order of the dataset.
+            batch_size (int): Number of examples to read at once.
 
-        Returns:
-            Converted prediction.
+        Yields:
+            Dict[str, Any]: Unlabeled example restricted to the given columns.
         """
+        columns = [column for column in unlabeled_dataset.column_names if column in (columns or [])]
+        if not columns:
+            for _ in range(len(unlabeled_dataset)):
+                yield {}
+            return
 
-        if isinstance(prediction, target_type):
-            return prediction
+        for batch in unlabeled_dataset.select_columns(columns).iter(batch_size=batch_size):
+            for values in zip(*(batch[column] for column in columns)):
+                yield dict(zip(columns, values))
 
-        try:
-            return target_type(prediction)
-        except ValueError:
-            logger.warning(
-                "Could not convert prediction {} to type {}. "
-                "Returning original prediction.", repr(prediction), target_type
-            )
-            return prediction
+    @staticmethod
+    def _generates_target_columns(prompt_template: BasePrompt, annotates_unlabeled_examples: bool) -> bool:
+        """Whether the predictions are written to the target columns of the prompt template. This is the case when
+        annotating unlabeled examples or generating several columns at once, otherwise the prediction is written to
+        the default text column."""
+        return bool(prompt_template.generate_data_for_column) and (
+            annotates_unlabeled_examples or prompt_template.generates_multiple_columns
+        )
+
+    @staticmethod
+    def _parse_completion(
+        prompt_template: BasePrompt, completion: str, generates_target_columns: bool
+    ) -> Dict[str, Optional[str]]:
+        """Parses a completion into the values of the columns it is written to."""
+        if generates_target_columns:
+            return prompt_template.parse_prediction(completion)
+        return {prompt_template.DEFAULT_TEXT_COLUMN[0]: completion}
+
+    @staticmethod
+    def _build_generated_sample(
+        prompt_template: BasePrompt,
+        decoded_values: Dict[str, Any],
+        invocation_context: Optional[Dict[str, Any]],
+        prompt_labels: Optional[Union[List[str], str]],
+    ) -> Dict[str, Any]:
+        """Builds a generated row from the decoded prediction. When annotating, the relevant columns of the
+        unlabeled example are re-used. When generating for a single label, the label is added."""
+        generated_sample = dict(invocation_context or {})
+        generated_sample.update(decoded_values)
+
+        if invocation_context is None and prompt_labels and isinstance(prompt_labels, str):
+            generated_sample[prompt_template.DEFAULT_LABEL_COLUMN[0]] = prompt_labels
+
+        return generated_sample
+
+    @staticmethod
+    def _write_log_entry(
+        log_file: Path,
+        prompt_template: BasePrompt,
+        prompt_text: str,
+        invocation_context: Optional[Dict[str, Any]],
+        prompt_labels: Optional[Union[List[str], str]],
+        prediction: Optional[str],
+        row_idx: Optional[int],
+    ) -> None:
+        """Appends a prediction to the log of the run. Predictions that were not written to the generated dataset
+        have no row index and are marked as invalid, so that they can be repaired later."""
+        log_entry = {
+            "prompt": prompt_text,
+            "invocation_context": invocation_context,
+            "labels": prompt_labels,
+            "prediction": prediction,
+            "target": prompt_template.generate_data_for_column
+            if prompt_template.generates_multiple_columns
+            else prompt_template.generate_data_for_column[0]
+            if prompt_template.generate_data_for_column
+            else prompt_template.DEFAULT_TEXT_COLUMN[0],
+            "row_idx": row_idx,
+            "valid": row_idx is not None,
+        }
+        with open(log_file, "a", encoding="utf-8") as file:
+            file.write(f"{json.dumps(log_entry)}\n")
+
+    @staticmethod
+    def _infer_generated_features(
+        prompt_template: BasePrompt,
+        fewshot_dataset: Optional[Dataset],
+        unlabeled_dataset: Optional[Dataset],
+        fewshot_sampling_strategy: Optional[str],
+    ) -> Features:
+        """Infers the schema of the generated dataset from the prompt template and the datasets. Columns passed
+        through from the unlabeled examples keep their features. Target columns take the features declared by the
+        unlabeled or fewshot dataset and are strings otherwise. A declared ClassLabel is only kept if the predictions
+        are constrained to label options that are among its names.
+
+        Args:
+            prompt_template (BasePrompt): Prompt template to generate the dataset with.
+            fewshot_dataset (Optional[Dataset]): Support examples to generate the dataset from.
+            unlabeled_dataset (Optional[Dataset]): Unlabeled examples to annotate.
+            fewshot_sampling_strategy (Optional[str]): Sampling strategy for support examples.
+
+        Returns:
+            Features: Features of the generated dataset.
+        """
+        if DatasetGenerator._generates_target_columns(prompt_template, bool(unlabeled_dataset)):
+            unlabeled_features = unlabeled_dataset.features if unlabeled_dataset else {}
+            features = Features({
+                column: feature for column, feature in unlabeled_features.items()
+                if column in (prompt_template.fewshot_example_columns or [])
+            })
+            for column in prompt_template.generate_data_for_column:
+                declared_features = [
+                    dataset.features[column] for dataset in (unlabeled_dataset, fewshot_dataset)
+                    if dataset and column in dataset.features
+                ]
+                feature = declared_features[0] if declared_features else Value("string")
+                # Label ids are only written if the predictions are constrained to labels that have an id
+                if isinstance(feature, ClassLabel) and not (
+                    prompt_template.constrain_to_label_options
+                    and set(prompt_template.label_options) <= set(feature.names)
+                ):
+                    feature = Value("string")
+                features[column] = feature
+        else:
+            features = Features({prompt_template.DEFAULT_TEXT_COLUMN[0]: Value("string")})
+
+        # Only uniform sampling conditions the prompt on a single label
+        if not unlabeled_dataset and prompt_template.label_options and fewshot_sampling_strategy == "uniform":
+            features[prompt_template.DEFAULT_LABEL_COLUMN[0]] = Value("string")
+        return features
 
     @staticmethod
     def _sample_fewshot_examples(
@@ -321,11 +1160,12 @@ class DatasetGenerator:
         fewshot_dataset: Dataset,
         fewshot_sampling_strategy: str,
         fewshot_examples_per_class: int,
-        fewshot_sampling_column: str
+        fewshot_sampling_column: str,
+        prompt_label: Optional[str] = None,
     ) -> Tuple[Union[List[str], str], Dataset]:
 
         if fewshot_sampling_strategy == "uniform":
-            prompt_labels = choice(prompt_template.label_options, 1)[0]
+            prompt_labels = prompt_label if prompt_label is not None else choice(prompt_template.label_options, 1)[0]
             fewshot_examples = fewshot_dataset.filter(
                 lambda example: example[fewshot_sampling_column] == prompt_labels
             ).shuffle().select(range(fewshot_examples_per_class))
@@ -3,12 +3,16 @@ __all__ = [
     "postprocess_squad_format",
     "calculate_answer_start",
     "convert_label_ids_to_texts",
+    "convert_texts_to_label_ids",
     "get_labels_from_dataset",
     "replace_class_labels",
     "convert_token_labels_to_spans",
     "convert_spans_to_token_labels",
+    "TransformationPipeline",
 ]
 
 from .question_answering import preprocess_squad_format, postprocess_squad_format, calculate_answer_start
-from .text_classification import convert_label_ids_to_texts, get_labels_from_dataset, replace_class_labels
+from .text_classification import convert_label_ids_to_texts, convert_texts_to_label_ids, get_labels_from_dataset, \
+    replace_class_labels
 from .token_classification import convert_token_labels_to_spans, convert_spans_to_token_labels
+from .pipeline import TransformationPipeline
@@ -0,0 +1,176 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from datasets import Dataset, DatasetDict, Features, IterableDataset, IterableDatasetDict
+from datasets.fingerprint import Hasher
+
+from .question_answering import _resolve_flatten_answers, _resolve_nest_answers
+from .text_classification import _resolve_label_ids_to_texts, _resolve_texts_to_label_ids
+from .token_classification import _resolve_spans_to_token_labels, _resolve_token_labels_to_spans
+from .utils import BatchedTransformation, apply_transformation, get_features
+
+
+class TransformationPipeline:
+    """Chains dataset transformations lazily. The steps are only recorded when they are added and resolved against
+    the features of the dataset when the pipeline is applied. All steps then run fused in a single batched map, so
+    only one new Arrow table is written. The fingerprint of the result is derived from the fingerprint of the input
+    dataset and the resolved steps, so reruns hit the datasets cache. Streamed datasets are transformed lazily while
+    iterating.
+
+    Example:
+        pipeline = TransformationPipeline().convert_token_labels_to_spans("tokens", "ner_tags")
+        dataset, label_options = pipeline.apply(dataset, num_proc=4, return_label_options=True)
+    """
+
+    def __init__(self):
+        self._steps: List[Tuple[Callable[..., BatchedTransformation], Dict[str, Any]]] = []
+
+    def __len__(self) -> int:
+        return len(self._steps)
+
+    def _add_step(self, resolve: Callable[..., BatchedTransformation], **kwargs) -> "TransformationPipeline":
+        self._steps.append((resolve, kwargs))
+        return self
+
+    def convert_label_ids_to_texts(
+        self, label_column: str, expanded_label_mapping: Dict = None
+    ) -> "TransformationPipeline":
+        """Adds a step converting label ids to natural language labels. See convert_label_ids_to_texts."""
+        return self._add_step(
+            _resolve_label_ids_to_texts, label_column=label_column, expanded_label_mapping=expanded_label_mapping
+        )
+
+    def convert_texts_to_label_ids(
+        self, label_column: str, id2label: Union[Dict[int, str], List[str]]
+    ) -> "TransformationPipeline":
+        """Adds a step converting natural language labels to label ids. See convert_texts_to_label_ids."""
+        return self._add_step(_resolve_texts_to_label_ids, label_column=label_column, id2label=id2label)
+
+    def convert_token_labels_to_spans(
+        self, token_column: str, label_column: str, expanded_label_mapping: Dict = None
+    ) -> "TransformationPipeline":
+        """Adds a step converting token level labels to spans. See convert_token_labels_to_spans."""
+        return self._add_step(
+            _resolve_token_labels_to_spans,
+            token_column=token_column,
+            label_column=label_column,
+            expanded_label_mapping=expanded_label_mapping,
+        )
+
+    def convert_spans_to_token_labels(
+        self, token_column: str, label_column: str, id2label: Dict, annotate_identical_words: bool = False
+    ) -> "TransformationPipeline":
+        """Adds a step converting span level labels to token level labels. See convert_spans_to_token_labels."""
+        return self._add_step(
+            _resolve_spans_to_token_labels,
+            token_column=token_column,
+            label_column=label_column,
+            id2label=id2label,
+            annotate_identical_words=annotate_identical_words,
+        )
+
+    def preprocess_squad_format(self) -> "TransformationPipeline":
+        """Adds a step flattening nested SQuAD answers. See preprocess_squad_format."""
+        return self._add_step(_resolve_flatten_answers)
+
+    def postprocess_squad_format(self, add_answer_start: bool = True) -> "TransformationPipeline":
+        """Adds a step nesting flat SQuAD answers. See postprocess_squad_format."""
+        return self._add_step(_resolve_nest_answers, add_answer_start=add_answer_start)
+
+    def resolve(self, features: Features) -> BatchedTransformation:
+        """Resolves all steps against the features of a dataset and fuses them into one transformation.
+
+        Args:
+            features (Features): features of the input dataset
+
+        Returns:
+            BatchedTransformation: fused transformation with the label options of the last step that provides them
+        """
+        if not self._steps:
+            raise ValueError("The pipeline has no steps. Add at least one transformation before applying it.")
+
+        transformations = []
+        for resolve, kwargs in self._steps:
+            transformation = resolve(features, **kwargs)
+            features = transformation.features
+            transformations.append(transformation)
+
+        label_options = next(
+            (transformation.label_options for transformation in reversed(transformations)
+             if transformation.label_options is not None),
+            None,
+        )
+
+        return BatchedTransformation(
+            function=_apply_transformations,
+            fn_kwargs={"transformations": transformations},
+            features=features,
+            label_options=label_options,
+        )
+
+    def fingerprint(self, dataset: Dataset) -> str:
+        """Deterministic fingerprint of the dataset after applying the pipeline.
+
+        Args:
+            dataset (Dataset): huggingface Dataset to apply the pipeline to
+
+        Returns:
+            str: fingerprint of the transformed dataset
+        """
+        return Hasher.hash([dataset._fingerprint, self.resolve(dataset.features)])
+
+    def apply(
+        self,
+        dataset: Union[Dataset, DatasetDict, IterableDataset, IterableDatasetDict],
+        num_proc: Optional[int] = None,
+        batch_size: int = 1000,
+        return_label_options: bool = False,
+    ) -> Union[
+        Dataset, DatasetDict, IterableDataset, IterableDatasetDict,
+        Tuple[Union[Dataset, DatasetDict, IterableDataset, IterableDatasetDict], Optional[List[str]]]
+    ]:
+        """Applies all steps in a single batched map.
+
+        Args:
+            dataset (Union[Dataset, DatasetDict, IterableDataset, IterableDatasetDict]): huggingface Dataset to
+            transform, can be streamed
+            num_proc (int, optional): number of processes, ignored for streamed datasets. Defaults to None.
+            batch_size (int, optional): number of examples per batch. Defaults to 1000.
+            return_label_options (bool, optional): whether to return the label options of the last step that
+            provides them. Defaults to False.
+
+        Returns:
+            Union[Dataset, DatasetDict, Tuple[Union[Dataset, DatasetDict], List[str]]]: transformed huggingface
+            Dataset and optionally the label options
+        """
+        if isinstance(dataset, (DatasetDict, IterableDatasetDict)):
+            transformed = type(dataset)({
+                split: self.apply(split_dataset, num_proc=num_proc, batch_size=batch_size)
+                for split, split_dataset in dataset.items()
+            })
+            label_options = self.resolve(get_features(next(iter(dataset.values())))).label_options
+        else:
+            transformation = self.resolve(get_features(dataset))
+            transformed = apply_transformation(
+                dataset,
+                transformation,
+                num_proc=num_proc,
+                batch_size=batch_size,
+                new_fingerprint=self.fingerprint(dataset) if isinstance(dataset, Dataset) else None,
+            )
+            label_options = transformation.label_options
+
+        if return_label_options:
+            return transformed, label_options
+
+        return transformed
+
+    __call__ = apply
+
+
+def _apply_transformations(
+    examples: Dict[str, List], transformations: List[BatchedTransformation]
+) -> Dict[str, List]:
+    """Applies resolved transformations one after another to the same batch."""
+    for transformation in transformations:
+        examples = transformation(examples)
+    return examples
@@ -1,89 +1,143 @@
-from datasets import Dataset
+from typing import Dict, List, Optional, Tuple, Union
+
+from datasets import Dataset, Features, IterableDataset, Sequence, Value
 from loguru import logger
 
+from .utils import BatchedTransformation, apply_transformation, get_features
+
 
-def preprocess_squad_format(dataset: Dataset) -> Dataset:
+def preprocess_squad_format(
+    dataset: Union[Dataset, IterableDataset], num_proc: Optional[int] = None
+) -> Union[Dataset, IterableDataset]:
     """Preprocesses a dataset in SQuAD format (nested answers) to a dataset in SQuAD format that has flat answers.
     {"answer": {"text": "answer", "start": 0}} -> {"text": "answer"}
 
     Args:
-        dataset (Dataset): A huggingface dataset in SQuAD format.
+        dataset (Union[Dataset, IterableDataset]): A huggingface dataset in SQuAD format, can be streamed.
+        num_proc (int, optional): Number of processes for the batched conversion, ignored for streamed datasets.
+        Defaults to None.
 
     Returns:
         Dataset: A huggingface dataset in SQuAD format with flat answers.
     """
+    dataset = apply_transformation(dataset, _resolve_flatten_answers(get_features(dataset)), num_proc=num_proc)
+    return dataset
 
-    def preprocess(example):
-        if example["answers"]:
-            example["answers"] = example["answers"].pop()
-        else:
-            example["answers"] = ""
-        return example
 
-    dataset = dataset.flatten().rename_column("answers.text", "answers").map(preprocess)
-    return dataset
+def _resolve_flatten_answers(features: Features) -> BatchedTransformation:
+    """Resolves the conversion of nested answers to flat answers against the features of a dataset."""
+    features = features.copy()
+    features["answers"] = Value("string")
+    return BatchedTransformation(function=_flatten_answers, fn_kwargs={}, features=features)
+
 
+def _flatten_answers(examples: Dict[str, List]) -> Dict[str, List]:
+    """Batched conversion of nested answers to the last answer text, or an empty string if there is no answer."""
+    examples["answers"] = [answers["text"][-1] if answers["text"] else "" for answers in examples["answers"]]
+    return examples
 
-def postprocess_squad_format(dataset: Dataset, add_answer_start: bool = True) -> Dataset:
+
+def postprocess_squad_format(
+    dataset: Union[Dataset, IterableDataset], add_answer_start: bool = True, num_proc: Optional[int] = None
+) -> Union[Dataset, IterableDataset]:
     """Postprocesses a dataset in SQuAD format (flat answers) to a dataset in SQuAD format that has nested answers.
     {"text": "answer"} -> {"answer": {"text": "answer", "start": 0}}
 
     Args:
-        dataset (Dataset): A huggingface dataset in SQuAD format.
+        dataset (Union[Dataset, IterableDataset]): A huggingface dataset in SQuAD format, can be streamed.
         add_answer_start (bool, optional): Whether to add the answer start index to the dataset. Defaults to True.
+        num_proc (int, optional): Number of processes for the batched conversion, ignored for streamed datasets.
+        Defaults to None.
 
     Returns:
         Dataset: A huggingface dataset in SQuAD format with nested answers.
     """
-    # remove punctuation and whitespace from the start and end of the answer
-    def remove_punctuation(example):
-        example["answers"] = example["answers"].strip(".,;!? ")
-        return example
+    transformation = _resolve_nest_answers(get_features(dataset), add_answer_start)
+    dataset = apply_transformation(dataset, transformation, num_proc=num_proc)
+    return dataset
+
+
+def _resolve_nest_answers(features: Features, add_answer_start: bool = True) -> BatchedTransformation:
+    """Resolves the conversion of flat answers to nested answers against the features of a dataset."""
+    features = features.copy()
+    features["answers"] = {"text": Sequence(Value("string")), "answer_start": Sequence(Value("int64"))}
+    features.pop("answer_start", None)
+    return BatchedTransformation(
+        function=_nest_answers, fn_kwargs={"add_answer_start": add_answer_start}, features=features
+    )
+
 
-    dataset = dataset.map(remove_punctuation)
+def _nest_answers(examples: Dict[str, List], add_answer_start: bool) -> Dict[str, List]:
+    """Batched conversion of flat answers to nested answers. Removes punctuation and whitespace from the start and
+    end of the answer and, if requested, calculates the answer start in the same pass.
+
+    Args:
+        examples (Dict[str, List]): A batch of SQuAD examples with flat answers.
+        add_answer_start (bool): Whether to calculate the answer start index.
+
+    Returns:
+        Dict[str, List]: The batch with nested answers.
+    """
+    answers = [(answer or "").strip(".,;!? ") for answer in examples["answers"]]
 
     if add_answer_start:
-        dataset = dataset.map(calculate_answer_start)
-
-    def unify_answers(example):
-        is_answerable = "answer_start" in example
-        if is_answerable:
-            example["answers"] = {"text": [example["answers"]], "answer_start": [example["answer_start"]]}
-        else:
-            example["answers"] = {"text": [], "answer_start": []}
-        return example
-
-    dataset = dataset.map(unify_answers)
-    if "answer_start" in dataset.column_names:
-        dataset = dataset.remove_columns("answer_start")
-    return dataset
+        answer_starts = []
+        for idx, (context, answer) in enumerate(zip(examples["context"], answers)):
+            answer_start, answers[idx] = _find_answer_start(context, answer)
+            answer_starts.append(answer_start)
+    else:
+        answer_starts = examples.get("answer_start")
 
+    if answer_starts is None:
+        examples["answers"] = [{"text": [], "answer_start": []} for _ in answers]
+    else:
+        examples["answers"] = [
+            {"text": [answer], "answer_start": [answer_start]} for answer, answer_start in zip(answers, answer_starts)
+        ]
+    examples.pop("answer_start", None)
+    return examples
 
-def calculate_answer_start(example):
-    """Calculates the answer start index for a SQuAD example.
+
+def _find_answer_start(context: str, answer: str) -> Tuple[int, str]:
+    """Finds the unique, case-insensitive occurrence of the answer in the context.
 
     Args:
-        example (Dict): A SQuAD example.
+        context (str): The context to search in.
+        answer (str): The answer to search for.
 
     Returns:
-        Dict: The SQuAD example with the answer start index added.
+        Tuple[int, str]: The answer start index or -1 if the answer is not found or not unique, and the answer with
+        the capitalization of the context if it is found.
     """
-    answer_start = example["context"].lower().find(example["answers"].lower())
+    lower_context = context.lower()
+    lower_answer = answer.lower()
+
+    answer_start = lower_context.find(lower_answer)
     if answer_start < 0:
         logger.info(
             'Could not calculate the answer start because the context "{}" ' 'does not contain the answer "{}".',
-            example["context"],
-            example["answers"],
+            context,
+            answer,
         )
-        answer_start = -1
-    else:
-        # check that the answer doesn't occur more than once in the context
-        second_answer_start = example["context"].lower().find(example["answers"].lower(), answer_start + 1)
-        if second_answer_start >= 0:
-            logger.info("Could not calculate the answer start because the context contains the answer more than once.")
-            answer_start = -1
-        else:
-            # correct potential wrong capitalization of the answer compared to the context
-            example["answers"] = example["context"][answer_start : answer_start + len(example["answers"])]
-    example["answer_start"] = answer_start
+        return -1, answer
+
+    # check that the answer doesn't occur more than once in the context
+    if lower_context.find(lower_answer, answer_start + 1) >= 0:
+        logger.info("Could not calculate the answer start because the context contains the answer more than once.")
+        return -1, answer
+
+    # correct potential wrong capitalization of the answer compared to the context
+    return answer_start, context[answer_start : answer_start + len(answer)]
+
+
+def calculate_answer_start(example):
+    """Calculates the answer start index for a SQuAD example.
+
+    Args:
+        example (Dict): A SQuAD example.
+
+    Returns:
+        Dict: The SQuAD example with the answer start index added.
+    """
+    example["answer_start"], example["answers"] = _find_answer_start(example["context"], example["answers"])
     return example
@@ -1,30 +1,42 @@
-from typing import Dict, List, Tuple, Union
+from typing import Dict, List, Optional, Tuple, Union
 
-from datasets import Dataset, DatasetDict, ClassLabel, Sequence
+import pyarrow as pa
+import pyarrow.compute as pc
+from datasets import Dataset, DatasetDict, ClassLabel, Features, IterableDataset, IterableDatasetDict, Sequence, Value
 
+from .utils import BatchedTransformation, apply_transformation, get_features
 
-def get_labels_from_dataset(dataset: Union[Dataset, DatasetDict], label_column: str) -> List[str]:
-    """Gets the list of labels from a huggingface Dataset.
+
+def get_labels_from_dataset(
+    dataset: Union[Dataset, DatasetDict, IterableDataset, IterableDatasetDict], label_column: str
+) -> List[str]:
+    """Gets the list of labels from a huggingface Dataset. The labels are taken from the features, so streamed
+    datasets are not scanned.
 
     Args:
-        dataset (Union[Dataset, DatasetDict]): huggingface Dataset
+        dataset (Union[Dataset, DatasetDict, IterableDataset, IterableDatasetDict]): huggingface Dataset
         label_column (str): name of the column with the labels
 
     Returns:
         List[str]: list of labels
     """
-    if isinstance(dataset, DatasetDict):
+    if isinstance(dataset, (DatasetDict, IterableDatasetDict)):
         tmp_ref_dataset = dataset["train"]
     else:
         tmp_ref_dataset = dataset
 
-    if isinstance(tmp_ref_dataset.features[label_column], ClassLabel):
-        features = tmp_ref_dataset.features[label_column]
-    elif isinstance(tmp_ref_dataset.features[label_column], Sequence):
-        features = tmp_ref_dataset.features[label_column].feature
+    return _get_label_names(get_features(tmp_ref_dataset), label_column)
+
+
+def _get_label_names(features: Features, label_column: str) -> List[str]:
+    """Gets the list of labels from the features of a huggingface Dataset."""
+    if isinstance(features[label_column], ClassLabel):
+        label_feature = features[label_column]
+    elif isinstance(features[label_column], Sequence):
+        label_feature = features[label_column].feature
     else:
         raise ValueError(f"Label column {label_column} is not of type ClassLabel or Sequence.")
-    return features.names
+    return label_feature.names
 
 
 def replace_class_labels(id2label: Union[Dict[str, str], Dict[int, str]], expanded_labels: Dict) -> Dict:
@@ -61,46 +73,214 @@ def replace_class_labels(id2label: Union[Dict[str, str], Dict[int, str]], expand
 
 
 def convert_label_ids_to_texts(
-    dataset: Union[Dataset, DatasetDict],
+    dataset: Union[Dataset, DatasetDict, IterableDataset, IterableDatasetDict],
     label_column: str,
     expanded_label_mapping: Dict = None,
     return_label_options: bool = False,
-) -> Union[Dataset, DatasetDict, Tuple[Union[Dataset, DatasetDict], List[str]]]:
+    num_proc: Optional[int] = None,
+) -> Union[
+    Dataset, DatasetDict, IterableDataset, IterableDatasetDict,
+    Tuple[Union[Dataset, DatasetDict, IterableDataset, IterableDatasetDict], List[str]]
+]:
     """Converts label IDs to natural language labels for any classification problem with a single label such as text
     classification. Note that if the function is not applied to a Dataset, the label column will contain the IDs.
     If the function is applied, the label column will contain the natural language labels.
+    ClassLabel columns are converted with a single Arrow take on the label names, other label columns (i.e.
+    sequences of class labels) and streamed datasets with a batched map. The converted column replaces the label
+    column without rewriting the other columns, unless the dataset has an indices mapping (i.e. after select or
+    shuffle), which is flattened first and copies all columns once.
 
     Args:
-        dataset (Dataset): huggingface Dataset with label ids.
+        dataset (Dataset): huggingface Dataset with label ids, can be streamed.
         label_column (str): name of the label column.
         expanded_label_mapping (Dict, optional): dictionary mapping label ids to natural language labels.
         Defaults to None.
         return_label_options (bool, optional): whether to return the list of possible labels. Defaults to False.
+        num_proc (int, optional): number of processes if the labels cannot be converted with Arrow. Defaults to None.
 
     Returns:
         Tuple[Dataset, List[str]]: huggingface Dataset with natural language labels and list of natural language
         labels.
     """
-    labels = get_labels_from_dataset(dataset, label_column)
-    id2label = dict(enumerate(labels))
+    tmp_ref_dataset = dataset["train"] if isinstance(dataset, (DatasetDict, IterableDatasetDict)) else dataset
+    transformation = _resolve_label_ids_to_texts(get_features(tmp_ref_dataset), label_column, expanded_label_mapping)
+
+    if isinstance(dataset, (DatasetDict, IterableDatasetDict)):
+        dataset = type(dataset)({
+            split: _convert_label_ids_to_texts(split_dataset, label_column, transformation, num_proc)
+            for split, split_dataset in dataset.items()
+        })
+    else:
+        dataset = _convert_label_ids_to_texts(dataset, label_column, transformation, num_proc)
+
+    if return_label_options:
+        return dataset, transformation.label_options
+
+    return dataset
+
+
+def _resolve_label_ids_to_texts(
+    features: Features, label_column: str, expanded_label_mapping: Dict = None
+) -> BatchedTransformation:
+    """Resolves the conversion of label ids to natural language labels against the features of a dataset.
+
+    Args:
+        features (Features): features of the dataset with label ids
+        label_column (str): name of the label column
+        expanded_label_mapping (Dict, optional): dictionary mapping label ids to natural language labels.
+
+    Returns:
+        BatchedTransformation: batched conversion with the natural language labels as label options
+    """
+    id2label = dict(enumerate(_get_label_names(features, label_column)))
 
     if expanded_label_mapping is not None:
         id2label = replace_class_labels(id2label, expanded_label_mapping)
 
-    new_label_column = f"{label_column}_natural_language"
-    label_options = list(id2label.values())
+    is_sequence = isinstance(features[label_column], Sequence)
+    features = features.copy()
+    features[label_column] = Sequence(Value("string")) if is_sequence else Value("string")
 
-    def labels_to_natural_language(examples):
-        examples[new_label_column] = id2label[examples[label_column]]
-        return examples
+    return BatchedTransformation(
+        function=_label_ids_to_texts,
+        fn_kwargs={"label_column": label_column, "id2label": id2label},
+        features=features,
+        label_options=list(id2label.values()),
+    )
+
+
+def _convert_label_ids_to_texts(
+    dataset: Union[Dataset, IterableDataset],
+    label_column: str,
+    transformation: BatchedTransformation,
+    num_proc: Optional[int],
+) -> Union[Dataset, IterableDataset]:
+    """Converts the label ids of a single Dataset to natural language labels. Invalid ids (i.e. -1 for unlabeled
+    examples) are converted to None."""
+    if isinstance(dataset, IterableDataset) or not isinstance(dataset.features[label_column], ClassLabel):
+        return apply_transformation(dataset, transformation, num_proc=num_proc)
 
-    dataset = (
-        dataset.map(labels_to_natural_language)
-        .remove_columns(label_column)
-        .rename_column(new_label_column, label_column)
+    id2label = transformation.fn_kwargs["id2label"]
+    label_names = pa.array([id2label.get(idx) for idx in range(max(id2label) + 1)], type=pa.string())
+    label_ids = dataset.with_format("arrow")[label_column]
+    valid_label_ids = pc.if_else(
+        pc.and_(pc.greater_equal(label_ids, 0), pc.less(label_ids, len(label_names))), label_ids, None
     )
+    label_texts = pc.take(label_names, valid_label_ids)
 
-    if return_label_options:
-        return dataset, label_options
+    return _replace_column(dataset, label_column, label_texts, num_proc)
 
-    return dataset
+
+def _replace_column(dataset: Dataset, column: str, values: pa.Array, num_proc: Optional[int]) -> Dataset:
+    """Replaces a column with values computed on the selected rows. Columns can only be added to the table itself,
+    so an indices mapping (i.e. after select or shuffle) is flattened explicitly, which copies all columns once.
+    Otherwise, the other columns are not rewritten."""
+    if dataset._indices is not None:  # pylint: disable=protected-access
+        dataset = dataset.flatten_indices(num_proc=num_proc)
+    return dataset.remove_columns(column).add_column(column, values)
+
+
+def _label_ids_to_texts(examples: Dict[str, List], label_column: str, id2label: Dict[int, str]) -> Dict[str, List]:
+    """Batched conversion of label ids (or lists of label ids) to natural language labels."""
+    examples[label_column] = [
+        [id2label.get(label_id) for label_id in label_ids] if isinstance(label_ids, list) else id2label.get(label_ids)
+        for label_ids in examples[label_column]
+    ]
+    return examples
+
+
+def convert_texts_to_label_ids(
+    dataset: Union[Dataset, DatasetDict, IterableDataset, IterableDatasetDict],
+    label_column: str,
+    id2label: Union[Dict[int, str], List[str]],
+    num_proc: Optional[int] = None,
+) -> Union[Dataset, DatasetDict, IterableDataset, IterableDatasetDict]:
+    """Converts natural language labels, i.e. generated by the LLM, back to label IDs. This is the inverse of
+    convert_label_ids_to_texts. The label column becomes a ClassLabel column and labels that are not part of id2label
+    are converted to -1. String columns are converted with a single Arrow lookup, other label columns (i.e.
+    sequences of labels) and streamed datasets with a batched map. Like in convert_label_ids_to_texts, a dataset
+    with an indices mapping is flattened first.
+
+    Args:
+        dataset (Union[Dataset, DatasetDict]): huggingface Dataset with natural language labels, can be streamed.
+        label_column (str): name of the label column.
+        id2label (Union[Dict[int, str], List[str]]): mapping from label ids to natural language labels or list of
+        natural language labels ordered by their ids.
+        num_proc (int, optional): number of processes if the labels cannot be converted with Arrow. Defaults to None.
+
+    Returns:
+        Union[Dataset, DatasetDict]: huggingface Dataset with label ids.
+    """
+    if isinstance(dataset, (DatasetDict, IterableDatasetDict)):
+        return type(dataset)({
+            split: _convert_texts_to_label_ids(split_dataset, label_column, id2label, num_proc)
+            for split, split_dataset in dataset.items()
+        })
+
+    return _convert_texts_to_label_ids(dataset, label_column, id2label, num_proc)
+
+
+def _resolve_texts_to_label_ids(
+    features: Features, label_column: str, id2label: Union[Dict[int, str], List[str]]
+) -> BatchedTransformation:
+    """Resolves the conversion of natural language labels to label ids against the features of a dataset.
+
+    Args:
+        features (Features): features of the dataset with natural language labels
+        label_column (str): name of the label column
+        id2label (Union[Dict[int, str], List[str]]): mapping from label ids to natural language labels or list of
+        natural language labels ordered by their ids.
+
+    Returns:
+        BatchedTransformation: batched conversion with the natural language labels as label options
+    """
+    if isinstance(id2label, list):
+        id2label = dict(enumerate(id2label))
+
+    if sorted(id2label) != list(range(len(id2label))):
+        raise ValueError("Label ids of id2label must be consecutive integers starting at 0.")
+
+    label_names = [id2label[idx] for idx in range(len(id2label))]
+
+    is_sequence = isinstance(features[label_column], Sequence)
+    features = features.copy()
+    features[label_column] = Sequence(ClassLabel(names=label_names)) if is_sequence else ClassLabel(names=label_names)
+
+    return BatchedTransformation(
+        function=_texts_to_label_ids,
+        fn_kwargs={"label_column": label_column, "label2id": {label: idx for idx, label in enumerate(label_names)}},
+        features=features,
+        label_options=label_names,
+    )
+
+
+def _convert_texts_to_label_ids(
+    dataset: Union[Dataset, IterableDataset],
+    label_column: str,
+    id2label: Union[Dict[int, str], List[str]],
+    num_proc: Optional[int],
+) -> Union[Dataset, IterableDataset]:
+    """Converts the natural language labels of a single Dataset to label ids."""
+    transformation = _resolve_texts_to_label_ids(get_features(dataset), label_column, id2label)
+    feature = dataset.features[label_column]
+
+    if isinstance(dataset, IterableDataset) or not (
+        isinstance(feature, Value) and feature.dtype in ("string", "large_string")
+    ):
+        return apply_transformation(dataset, transformation, num_proc=num_proc)
+
+    label_names = transformation.label_options
+    label_texts = dataset.with_format("arrow")[label_column]
+    label_ids = pc.fill_null(pc.index_in(label_texts, value_set=pa.array(label_names, type=label_texts.type)), -1)
+
+    dataset = _replace_column(dataset, label_column, pc.cast(label_ids, pa.int64()), num_proc)
+    return dataset.cast_column(label_column, transformation.features[label_column])
+
+
+def _texts_to_label_ids(examples: Dict[str, List], label_column: str, label2id: Dict[str, int]) -> Dict[str, List]:
+    """Batched conversion of natural language labels (or lists of natural language labels) to label ids."""
+    examples[label_column] = [
+        [label2id.get(label, -1) for label in labels] if isinstance(labels, list) else label2id.get(labels, -1)
+        for labels in examples[label_column]
+    ]
+    return examples
@@ -1,105 +1,167 @@
 import re
-from typing import Dict, List, Tuple, Union
-from datasets import Dataset, Sequence
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from datasets import Dataset, Features, IterableDataset, Sequence, Value
 
 from loguru import logger
 
+from .utils import BatchedTransformation, apply_transformation, get_features
+
 # These are fixed for encoding the prompt and decoding the output of the LLM
 SPAN_ANNOTATION_TEMPLATE = "{entity} is {label} entity."
 SPAN_ANNOTATION_REGEX = r'(.+) is (.+) entity\.'
+SPAN_ANNOTATION_PATTERN = re.compile(SPAN_ANNOTATION_REGEX)
 
 
 def convert_token_labels_to_spans(
-    dataset: Dataset,
+    dataset: Union[Dataset, IterableDataset],
     token_column: str,
     label_column: str,
     expanded_label_mapping: Dict = None,
-    return_label_options: bool = False
-) -> Union[Dataset, Tuple[Dataset, List[str]]]:
+    return_label_options: bool = False,
+    num_proc: Optional[int] = None,
+) -> Union[Dataset, IterableDataset, Tuple[Union[Dataset, IterableDataset], List[str]]]:
     """Converts token level labels to spans. Useful for NER tasks to prompt the LLM with natural language labels.
 
     Args:
-        dataset (Dataset): huggingface Dataset with token level labels
+        dataset (Union[Dataset, IterableDataset]): huggingface Dataset with token level labels, can be streamed
         token_column (str): name of the column with the tokens
         label_column (str): name of the column with the token level labels
         expanded_label_mapping (Dict): mapping from label ids to label names. Defaults to None.
         return_label_options (bool): whether to return a list of all possible annotations of the provided dataset
+        num_proc (int, optional): number of processes for the batched conversion, ignored for streamed datasets.
+        Defaults to None.
 
     Returns:
         Tuple[Dataset, List[str]]: huggingface Dataset with span labels and list of possible labels for the prompt
     """
+    transformation = _resolve_token_labels_to_spans(
+        get_features(dataset), token_column, label_column, expanded_label_mapping
+    )
+    dataset = apply_transformation(dataset, transformation, num_proc=num_proc)
+
+    if return_label_options:
+        return dataset, transformation.label_options
+
+    return dataset
+
+
+def _resolve_token_labels_to_spans(
+    features: Features,
+    token_column: str,
+    label_column: str,
+    expanded_label_mapping: Dict = None,
+) -> BatchedTransformation:
+    """Resolves the conversion of token level labels to spans against the features of a dataset.
+
+    Args:
+        features (Features): features of the dataset with token level labels
+        token_column (str): name of the column with the tokens
+        label_column (str): name of the column with the token level labels
+        expanded_label_mapping (Dict): mapping from label ids to label names. Defaults to None.
+
+    Returns:
+        BatchedTransformation: batched conversion with the span labels as label options
+    """
     if expanded_label_mapping:
-        if not len(expanded_label_mapping) == len(dataset.features[label_column].feature.names):
+        if not len(expanded_label_mapping) == len(features[label_column].feature.names):
             raise ValueError(
                 f"Length of expanded label mapping and original number of labels in dataset do not match.\n"
-                f"Original labels: {dataset.features[label_column].feature.names}"
+                f"Original labels: {features[label_column].feature.names}"
                 f"Expanded labels: {list(expanded_label_mapping.values())}"
             )
         id2label = expanded_label_mapping
-    elif isinstance(dataset.features[label_column], Sequence):
-        id2label = dict(enumerate(dataset.features[label_column].feature.names))
+    elif isinstance(features[label_column], Sequence):
+        id2label = dict(enumerate(features[label_column].feature.names))
     else:
         raise ValueError("Labels must be a Sequence feature or expanded_label_mapping must be provided.")
 
-    span_column = "span_annotations"
-
-    def labels_to_spans(example):
-        span_annotations = [id2label.get(label).replace("B-", "").replace("I-", "") for label in example[label_column]]
-
-        annotations_for_prompt = ""
-
-        current_entity = None
-        current_entity_type = None
-        for idx, span_annotation in enumerate(span_annotations):
-            if span_annotation == "O":
-                if current_entity is not None:
-                    annotations_for_prompt += SPAN_ANNOTATION_TEMPLATE.format(entity=current_entity,
-                                                                              label=current_entity_type) + "\n"
-                    current_entity = None
-                    current_entity_type = None
-                continue
-            if current_entity is None:
-                current_entity = example[token_column][idx]
-                current_entity_type = span_annotation
-                continue
-            if current_entity_type == span_annotation:
-                current_entity += " " + example[token_column][idx]
-            else:
-                annotations_for_prompt += SPAN_ANNOTATION_TEMPLATE.format(entity=current_entity,
-                                                                          label=current_entity_type) + "\n"
-                current_entity = example[token_column][idx]
-                current_entity_type = span_annotation
+    # Spans have implicit BIO format, so sequences come in BIO format, we can ignore it
+    span_labels = []
+    label_id_to_span_label = np.full(max(id2label) + 1, -1, dtype=np.int64)
+    for label_id, label in id2label.items():
+        span_label = _strip_bio_prefix(label)
+        # Ignore "outside" tokens
+        if span_label == "O":
+            continue
+        if span_label not in span_labels:
+            span_labels.append(span_label)
+        label_id_to_span_label[label_id] = span_labels.index(span_label)
+
+    features = features.copy()
+    features[token_column] = Value("string")
+    features[label_column] = Value("string")
+
+    return BatchedTransformation(
+        function=_token_labels_to_spans,
+        fn_kwargs={
+            "token_column": token_column,
+            "label_column": label_column,
+            "label_id_to_span_label": label_id_to_span_label,
+            "span_labels": span_labels,
+        },
+        features=features,
+        label_options=span_labels,
+    )
 
-        if current_entity is not None:
-            annotations_for_prompt += SPAN_ANNOTATION_TEMPLATE.format(entity=current_entity,
-                                                                      label=current_entity_type) + "\n"
 
-        example[token_column] = " ".join(example[token_column])
-        example[span_column] = annotations_for_prompt.rstrip("\n")
-        return example
+def _strip_bio_prefix(label: str) -> str:
+    """Removes the BIO prefixes from a token level label, i.e. B-PER -> PER."""
+    return label.replace("B-", "").replace("I-", "")
 
-    dataset = dataset.map(labels_to_spans).remove_columns(label_column).rename_column(span_column, label_column)
 
-    if return_label_options:
-        # Spans have implicit BIO format, so sequences come in BIO format, we can ignore it
-        label_options = list({label.replace("B-", "").replace("I-", "") for label in id2label.values()})
+def _token_labels_to_spans(
+    examples: Dict[str, List],
+    token_column: str,
+    label_column: str,
+    label_id_to_span_label: np.ndarray,
+    span_labels: List[str],
+) -> Dict[str, List]:
+    """Batched conversion of token level labels to span annotations. Consecutive tokens with the same span label
+    form one entity.
 
-        # Ignore "outside" tokens
-        if "O" in label_options:
-            label_options.remove("O")
+    Args:
+        examples (Dict[str, List]): batch of examples
+        token_column (str): name of the column with the tokens
+        label_column (str): name of the column with the token level labels
+        label_id_to_span_label (np.ndarray): lookup from label id to index in span_labels, -1 for "outside" tokens
+        span_labels (List[str]): span labels without BIO prefixes
 
-        return dataset, label_options
+    Returns:
+        Dict[str, List]: batch with joined tokens and span annotations
+    """
+    texts = []
+    annotations = []
+    for tokens, label_ids in zip(examples[token_column], examples[label_column]):
+        entity_types = label_id_to_span_label[np.asarray(label_ids, dtype=np.int64)]
+        boundaries = np.flatnonzero(entity_types[1:] != entity_types[:-1]) + 1
+        starts = np.concatenate(([0], boundaries))
+        ends = np.concatenate((boundaries, [len(entity_types)]))
+
+        annotations.append("\n".join(
+            SPAN_ANNOTATION_TEMPLATE.format(
+                entity=" ".join(tokens[start:end]), label=span_labels[entity_types[start]]
+            )
+            for start, end in zip(starts.tolist(), ends.tolist())
+            if end > start and entity_types[start] >= 0
+        ))
+        texts.append(" ".join(tokens))
 
-    return dataset
+    examples[token_column] = texts
+    examples[label_column] = annotations
+    return examples
 
 
 def convert_spans_to_token_labels(
-        dataset: Dataset,
+        dataset: Union[Dataset, IterableDataset],
         token_column: str,
         label_column: str,
         id2label: Dict,
-        annotate_identical_words: bool = False
-) -> Dataset:
+        annotate_identical_words: bool = False,
+        num_proc: Optional[int] = None,
+) -> Union[Dataset, IterableDataset]:
     """Converts span level labels to token level labels.
     First, the function extracts all entities with its annotated types.
     Second, if annotations are present, the function converts them to a tag sequence in BIO format.
@@ -107,82 +169,161 @@ def convert_spans_to_token_labels(
     This is useful for NER tasks to decode the output of the LLM.
 
     Args:
-        dataset (Dataset): huggingface Dataset with span level labels
+        dataset (Union[Dataset, IterableDataset]): huggingface Dataset with span level labels, can be streamed
         token_column (str): name of the column with the tokens
         label_column (str): name of the column with the span level labels
         id2label (Dict): mapping from label ids to label names
         annotate_identical_words (bool): whether to annotate all identical words in a sentence with a found entity
         type
+        num_proc (int, optional): number of processes for the batched conversion, ignored for streamed datasets.
+        Defaults to None.
 
     Returns:
         Dataset: huggingface Dataset with token level labels in BIO format
     """
-    new_label_column = "sequence_tags"
-    lower_label2id = {label.lower(): idx for idx, label in id2label.items()}
+    transformation = _resolve_spans_to_token_labels(
+        get_features(dataset), token_column, label_column, id2label, annotate_identical_words
+    )
+    dataset = apply_transformation(dataset, transformation, num_proc=num_proc)
 
-    def labels_to_spans(example):
-        span_annotations = example[label_column].split("\n")
+    return dataset
 
-        ner_tag_tuples = []
 
-        for span_annotation in span_annotations:
-            matches = re.match(SPAN_ANNOTATION_REGEX, span_annotation)
-            if matches:
-                matched_entity = matches.group(1)
-                matched_label = matches.group(2)
+def _resolve_spans_to_token_labels(
+    features: Features,
+    token_column: str,
+    label_column: str,
+    id2label: Dict,
+    annotate_identical_words: bool = False,
+) -> BatchedTransformation:
+    """Resolves the conversion of span level labels to token level labels against the features of a dataset.
 
-                span_tokens = matched_entity.split(" ")
-                span_labels = ["B-" + matched_label if idx == 0 else "B-" + matched_label.lower()
-                               for idx, _ in enumerate(span_tokens)]
+    Args:
+        features (Features): features of the dataset with span level labels
+        token_column (str): name of the column with the tokens
+        label_column (str): name of the column with the span level labels
+        id2label (Dict): mapping from label ids to label names
+        annotate_identical_words (bool): whether to annotate all identical words in a sentence with a found entity
+        type
 
-                for token, label in zip(span_tokens, span_labels):
-                    label_id = lower_label2id.get(label.lower())
-                    if label_id is None:
-                        logger.info(f"Entity {token} with label {label} is not in id2label: {id2label}.")
-                    else:
-                        ner_tag_tuples.append((token, label_id))
-            else:
-                pass
-
-        if ner_tag_tuples:
-            lower_tokens = example[token_column].lower().split(" ")
-            # initialize all tokens with O type
-            ner_tags = [0] * len(lower_tokens)
-            for reference_token, entity_type_id in ner_tag_tuples:
-                if lower_tokens.count(reference_token.lower()) == 0:
-                    logger.info(
-                        f"Entity {reference_token} is not found or occurs more than once: {lower_tokens}. "
-                        f"Thus, setting label to O."
-                    )
-                elif lower_tokens.count(reference_token.lower()) > 1:
-                    if annotate_identical_words:
-                        insert_at_idxs = [index for index, value in enumerate(lower_tokens)
-                                            if value == reference_token.lower()]
-                        for insert_at_idx in insert_at_idxs:
-                            ner_tags[insert_at_idx] = entity_type_id
-                    else:
-                        logger.info(
-                            f"Entity {reference_token} occurs more than once: {lower_tokens}. "
-                            f"Thus, setting label to O."
-                        )
-                else:
-                    insert_at_idx = lower_tokens.index(reference_token.lower())
-                    ner_tags[insert_at_idx] = entity_type_id
+    Returns:
+        BatchedTransformation: batched conversion
+    """
+    features = features.copy()
+    features[token_column] = Sequence(Value("string"))
+    features[label_column] = Sequence(Value("int64"))
+
+    return BatchedTransformation(
+        function=_spans_to_token_labels,
+        fn_kwargs={
+            "token_column": token_column,
+            "label_column": label_column,
+            "span_label2ids": _build_span_label2ids(id2label),
+            "annotate_identical_words": annotate_identical_words,
+        },
+        features=features,
+    )
+
+
+def _build_span_label2ids(id2label: Dict) -> Dict[str, Tuple[int, int]]:
+    """Builds a lookup from lower-cased span labels to the ids of their B- and I- tags. Labels without BIO prefix
+    use the same id for both tags.
+
+    Args:
+        id2label (Dict): mapping from label ids to label names
+
+    Returns:
+        Dict[str, Tuple[int, int]]: mapping from lower-cased span labels to (B- tag id, I- tag id)
+    """
+    lower_label2id = {label.lower(): idx for idx, label in id2label.items()}
+
+    span_label2ids = {}
+    for label in lower_label2id:
+        if label.startswith(("b-", "i-")):
+            span_label = label[2:]
         else:
-            ner_tags = [0] * len(example[token_column].split(" "))
+            span_label = label
+        begin_id = lower_label2id.get(f"b-{span_label}", lower_label2id.get(span_label))
+        inside_id = lower_label2id.get(f"i-{span_label}", begin_id)
+        span_label2ids.setdefault(span_label, (begin_id, inside_id))
 
-        example[token_column] = example[token_column].split(" ")
-        example[new_label_column] = ner_tags
+    # The LLM may also answer with the tag itself, i.e. B-PER
+    for label, idx in lower_label2id.items():
+        span_label2ids.setdefault(label, (idx, idx))
 
-        return example
+    return span_label2ids
 
-    dataset = (
-        dataset.map(labels_to_spans)
-        .remove_columns(label_column)
-        .rename_column(new_label_column, label_column)
-    )
 
-    return dataset
+def _spans_to_token_labels(
+    examples: Dict[str, List],
+    token_column: str,
+    label_column: str,
+    span_label2ids: Dict[str, Tuple[int, int]],
+    annotate_identical_words: bool,
+) -> Dict[str, List]:
+    """Batched conversion of span annotations to token level labels in BIO format.
+
+    Args:
+        examples (Dict[str, List]): batch of examples
+        token_column (str): name of the column with the space-separated tokens
+        label_column (str): name of the column with the span annotations
+        span_label2ids (Dict[str, Tuple[int, int]]): mapping from lower-cased span labels to (B- tag id, I- tag id)
+        annotate_identical_words (bool): whether to annotate all occurrences of an entity in a sentence
+
+    Returns:
+        Dict[str, List]: batch with tokens and token level labels
+    """
+    all_tokens = []
+    all_ner_tags = []
+    for text, span_annotations in zip(examples[token_column], examples[label_column]):
+        tokens = text.split(" ")
+        ner_tags = [0] * len(tokens)
+
+        lower_tokens, token_positions = None, None
+        for span_annotation in (span_annotations or "").split("\n"):
+            matches = SPAN_ANNOTATION_PATTERN.match(span_annotation)
+            if not matches:
+                continue
+
+            matched_entity, matched_label = matches.group(1), matches.group(2)
+            label_ids = span_label2ids.get(matched_label.lower())
+            if label_ids is None:
+                logger.info(f"Entity {matched_entity} with label {matched_label} is not in id2label.")
+                continue
+
+            # Index the positions of each token once per sentence
+            if token_positions is None:
+                lower_tokens = text.lower().split(" ")
+                token_positions = defaultdict(list)
+                for position, token in enumerate(lower_tokens):
+                    token_positions[token].append(position)
+
+            span_tokens = matched_entity.lower().split(" ")
+            occurrences = [
+                position for position in token_positions.get(span_tokens[0], [])
+                if lower_tokens[position:position + len(span_tokens)] == span_tokens
+            ]
+
+            if not occurrences:
+                logger.info(f"Entity {matched_entity} is not found in: {tokens}. Thus, setting label to O.")
+                continue
+
+            if len(occurrences) > 1 and not annotate_identical_words:
+                logger.info(f"Entity {matched_entity} occurs more than once: {tokens}. Thus, setting label to O.")
+                continue
+
+            begin_id, inside_id = label_ids
+            for position in occurrences:
+                ner_tags[position] = begin_id
+                for offset in range(1, len(span_tokens)):
+                    ner_tags[position + offset] = inside_id
+
+        all_tokens.append(tokens)
+        all_ner_tags.append(ner_tags)
+
+    examples[token_column] = all_tokens
+    examples[label_column] = all_ner_tags
+    return examples
 
 
 def replace_token_labels(id2label: Dict, expanded_labels: Dict) -> Dict:
@@ -0,0 +1,87 @@
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Union
+
+from datasets import Dataset, Features, IterableDataset
+
+
+class BatchedTransformation(NamedTuple):
+    """A transformation resolved against the features of a dataset. It is applied as a batched map and only holds
+    module-level functions and picklable arguments, so it can run with multiple processes and be fingerprinted.
+
+    Attributes:
+        function (Callable): batched function taking a batch and fn_kwargs and returning the transformed batch
+        fn_kwargs (Dict[str, Any]): keyword arguments of the function
+        features (Features): features of the transformed dataset
+        label_options (List[str], optional): natural language labels for the prompt, if the transformation
+        produces them
+    """
+
+    function: Callable[..., Dict[str, List]]
+    fn_kwargs: Dict[str, Any]
+    features: Features
+    label_options: Optional[List[str]] = None
+
+    def __call__(self, examples: Dict[str, List]) -> Dict[str, List]:
+        return self.function(examples, **self.fn_kwargs)
+
+
+def get_features(dataset: Union[Dataset, IterableDataset]) -> Features:
+    """Gets the features of a dataset. Streaming datasets only know their features if they were loaded or cast with
+    features, since we do not scan the data to infer them.
+
+    Args:
+        dataset (Union[Dataset, IterableDataset]): huggingface Dataset or streaming IterableDataset
+
+    Returns:
+        Features: features of the dataset
+    """
+    if dataset.features is None:
+        raise ValueError(
+            "The features of the streaming dataset are unknown. Load the dataset with features or cast it to its "
+            "features before applying transformations."
+        )
+    return dataset.features
+
+
+def apply_transformation(
+    dataset: Union[Dataset, IterableDataset],
+    transformation: BatchedTransformation,
+    num_proc: Optional[int] = None,
+    batch_size: int = 1000,
+    new_fingerprint: Optional[str] = None,
+) -> Union[Dataset, IterableDataset]:
+    """Applies a resolved transformation with a single batched map. Streaming datasets are transformed lazily while
+    iterating, in which case num_proc and new_fingerprint are ignored.
+
+    Args:
+        dataset (Union[Dataset, IterableDataset]): huggingface Dataset or streaming IterableDataset to transform
+        transformation (BatchedTransformation): transformation resolved against the features of the dataset
+        num_proc (int, optional): number of processes. Defaults to None.
+        batch_size (int, optional): number of examples per batch. Defaults to 1000.
+        new_fingerprint (str, optional): fingerprint of the transformed dataset. Defaults to None, so that datasets
+        computes it from the function and its arguments.
+
+    Returns:
+        Union[Dataset, IterableDataset]: transformed huggingface Dataset or streaming IterableDataset
+    """
+    remove_columns = [column for column in get_features(dataset) if column not in transformation.features]
+
+    if isinstance(dataset, IterableDataset):
+        return dataset.map(
+            transformation.function,
+            batched=True,
+            batch_size=batch_size,
+            features=transformation.features,
+            fn_kwargs=transformation.fn_kwargs,
+            remove_columns=remove_columns,
+        )
+
+    return dataset.map(
+        transformation.function,
+        batched=True,
+        batch_size=batch_size,
+        num_proc=num_proc,
+        features=transformation.features,
+        fn_kwargs=transformation.fn_kwargs,
+        remove_columns=remove_columns,
+        new_fingerprint=new_fingerprint,
+    )
@@ -0,0 +1,184 @@
+import json
+
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+from datasets import Dataset, DatasetInfo, Features, config
+from datasets.arrow_writer import ArrowWriter, ParquetWriter
+from datasets.fingerprint import Hasher
+from loguru import logger
+
+
+class DatasetWriter:
+    """Accumulates generated rows and writes them column-wise as fixed-size Arrow record batches to disk.
+    At most writer_batch_size rows are held in memory, and the finished dataset is memory-mapped from the file."""
+
+    def __init__(self, path: Union[str, Path], features: Features, writer_batch_size: int = 1000):
+        """Initialize the DatasetWriter with the file to write to and the schema of the rows.
+
+        Args:
+            path (Union[str, Path]): Path of the Arrow file.
+            features (Features): Features of the rows. Missing columns of a row are written as None.
+            writer_batch_size (int, optional): Number of rows per record batch. Defaults to 1000.
+        """
+        self.path = Path(path)
+        self.features = features
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._writer = ArrowWriter(features=features, path=str(self.path), writer_batch_size=writer_batch_size)
+
+    def __len__(self) -> int:
+        """Number of rows written so far."""
+        return len(self._writer)
+
+    def add(self, example: Dict[str, Any]) -> None:
+        """Add a single row. Values are encoded with the features of the writer.
+
+        Args:
+            example (Dict[str, Any]): Row to add.
+        """
+        self._writer.write(self.features.encode_example({column: example.get(column) for column in self.features}))
+
+    def finalize(self) -> Dataset:
+        """Flush the remaining rows and close the file.
+
+        Returns:
+            Dataset: Memory-mapped dataset of all written rows.
+        """
+        self._writer.finalize()
+        self._writer.close()
+        return Dataset.from_file(str(self.path))
+
+
+class ShardedDatasetWriter:
+    """Writes generated rows to rolling Arrow or Parquet shards in an output directory while they are produced.
+    A shard is closed once it holds rows_per_shard rows and manifest.json is rewritten after every closed shard,
+    so the rows of an interrupted run are still readable. Arrow shards are written in the layout of save_to_disk
+    and can be loaded with load_from_disk, Parquet shards can be loaded with Dataset.from_parquet. Both are
+    memory-mapped when loaded."""
+
+    SHARD_FORMATS = {"arrow": ArrowWriter, "parquet": ParquetWriter}
+    MANIFEST_FILENAME = "manifest.json"
+
+    def __init__(
+        self,
+        output_dir: Union[str, Path],
+        features: Features,
+        rows_per_shard: int = 100_000,
+        shard_format: str = "arrow",
+        writer_batch_size: int = 1000,
+    ):
+        """Initialize the ShardedDatasetWriter with the output directory and the schema of the rows.
+
+        Args:
+            output_dir (Union[str, Path]): Directory to write the shards and the manifest to.
+            features (Features): Features of the rows. Missing columns of a row are written as None.
+            rows_per_shard (int, optional): Maximum number of rows per shard. Defaults to 100_000.
+            shard_format (str, optional): Format of the shards, "arrow" or "parquet". Defaults to "arrow".
+            writer_batch_size (int, optional): Number of rows per record batch / row group. Defaults to 1000.
+        """
+        if shard_format not in self.SHARD_FORMATS:
+            raise ValueError(f"Shard format must be one of {list(self.SHARD_FORMATS)}, got '{shard_format}'.")
+
+        if rows_per_shard < 1:
+            raise ValueError(f"rows_per_shard must be a positive integer, got {rows_per_shard}.")
+
+        self.output_dir = Path(output_dir)
+        self.features = features
+        self.rows_per_shard = rows_per_shard
+        self.shard_format = shard_format
+        self.writer_batch_size = writer_batch_size
+        self.shards: List[Dict[str, Any]] = []
+        self._num_rows = 0
+        self._writer: Optional[ArrowWriter] = None
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        if any(self.output_dir.glob(f"data-*.{shard_format}")):
+            raise ValueError(f"Output directory {self.output_dir} already contains {shard_format} shards.")
+
+    def __len__(self) -> int:
+        """Number of rows written so far."""
+        return self._num_rows
+
+    @property
+    def shard_paths(self) -> List[Path]:
+        """Paths of all closed shards."""
+        return [self.output_dir / shard["filename"] for shard in self.shards]
+
+    def add(self, example: Dict[str, Any]) -> None:
+        """Add a single row and roll over to a new shard if the current one is full.
+
+        Args:
+            example (Dict[str, Any]): Row to add.
+        """
+        if self._writer is None:
+            self._open_shard()
+
+        self._writer.write(self.features.encode_example({column: example.get(column) for column in self.features}))
+        self._num_rows += 1
+
+        if len(self._writer) >= self.rows_per_shard:
+            self._close_shard()
+
+    def _open_shard(self) -> None:
+        filename = f"data-{len(self.shards):05d}.{self.shard_format}"
+        self._writer = self.SHARD_FORMATS[self.shard_format](
+            features=self.features, path=str(self.output_dir / filename), writer_batch_size=self.writer_batch_size
+        )
+        self.shards.append({"filename": filename, "num_rows": 0})
+
+    def _close_shard(self) -> None:
+        num_rows, _ = self._writer.finalize()
+        self._writer.close()
+        self._writer = None
+        self.shards[-1]["num_rows"] = num_rows
+        logger.info("Wrote shard {} with {} rows.", self.shard_paths[-1], num_rows)
+        self._write_manifest()
+
+    def _write_manifest(self) -> None:
+        manifest = {
+            "format": self.shard_format,
+            "num_rows": sum(shard["num_rows"] for shard in self.shards),
+            "features": self.features.to_dict(),
+            "shards": self.shards,
+        }
+        self._write_json(self.MANIFEST_FILENAME, manifest)
+
+    def _write_json(self, filename: str, content: Dict[str, Any]) -> None:
+        # Write to a temporary file first, so readers never see a partially written file
+        tmp_path = self.output_dir / f".{filename}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as json_file:
+            json.dump(content, json_file, indent=2)
+        tmp_path.replace(self.output_dir / filename)
+
+    def finalize(self) -> Dataset:
+        """Close the current shard and write the dataset metadata.
+
+        Returns:
+            Dataset: Memory-mapped dataset of all written rows.
+        """
+        # An empty run still writes one (empty) shard, so the output directory can be loaded
+        if self._writer is None and not self.shards:
+            self._open_shard()
+
+        if self._writer is not None:
+            self._close_shard()
+
+        if self.shard_format == "parquet":
+            if not self._num_rows:
+                return Dataset.from_dict({column: [] for column in self.features}, features=self.features)
+            return Dataset.from_parquet([str(path) for path in self.shard_paths], features=self.features)
+
+        state = {
+            "_data_files": [{"filename": shard["filename"]} for shard in self.shards],
+            "_fingerprint": Hasher.hash([str(self.output_dir.resolve()), self.shards]),
+            "_format_columns": None,
+            "_format_kwargs": {},
+            "_format_type": None,
+            "_output_all_columns": False,
+            "_split": None,
+        }
+        self._write_json(config.DATASET_STATE_JSON_FILENAME, state)
+        self._write_json(config.DATASET_INFO_FILENAME, asdict(DatasetInfo(features=self.features)))
+
+        return Dataset.load_from_disk(str(self.output_dir))
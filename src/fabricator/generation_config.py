@@ -0,0 +1,104 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+from .backends import LocalBatchExecutor, ModelCascade, RequestHedger
+from .scoring import LabelScorer
+
+
+@dataclass
+class GenerationConfig:  # pylint: disable=too-many-instance-attributes
+    """Options of a generation run that go beyond prompting, i.e. how rows are written, how prompt calls are run
+    and how predictions are checked. Options that cannot be combined are rejected when the config is created.
+
+    Example:
+        config = GenerationConfig(max_concurrent_calls=4, limit_generation_length=True)
+        generated_dataset = generator.generate(prompt_template, unlabeled_dataset=dataset, generation_config=config)
+
+    Attributes:
+        output_dir (Optional[Union[str, Path]]): Directory to write the generated rows to as rolling shards while
+            they are produced. Defaults to None, which writes a single Arrow file next to the log and takes the
+            passthrough columns of the unlabeled examples from the unlabeled dataset with a single Arrow copy of the
+            annotated rows instead of writing them row by row.
+        rows_per_shard (int): Maximum number of rows per shard if output_dir is set. Defaults to 100_000.
+        output_format (str): Format of the shards, "arrow" (loadable with load_from_disk) or "parquet" (loadable
+            with Dataset.from_parquet). Defaults to "arrow".
+        prefetch_batch_size (int): Number of unlabeled examples to read at once. Defaults to 1000.
+        completions_per_call (int): Number of completions to request per prompt call. Each completion becomes a
+            separate row with the labels and unlabeled example of its prompt. Defaults to 1.
+        label_quotas (Optional[Dict[str, Union[int, float]]]): Exact number of rows per label, or a target
+            distribution over the labels for num_samples_to_generate rows. Every prompt is conditioned on a single
+            label like with uniform sampling, but the labels are scheduled until all quotas are met. Invalid outputs
+            do not count towards the quota. Defaults to None.
+        label_scorer (Optional[LabelScorer]): Annotates unlabeled examples with the most probable of the label
+            options under a local language model instead of generating text. The calibrated label probabilities are
+            added as "<column>_probabilities" in the order of the label options. Defaults to None.
+        batch_executor (Optional[LocalBatchExecutor]): Runs the prompts with the local model of the prompt node in
+            length-bucketed micro-batches instead of one prompt per call. Up to max_pending prompts of the executor
+            are submitted ahead, the rows keep the order of the prompts. Defaults to None.
+        fewshot_group_size (int): Number of consecutive unlabeled examples that are annotated with the same sampled
+            fewshot examples. Their prompts share the prefix up to the target formatting template (see
+            BasePrompt.split_prompt_text), so backends can reuse past key values or serve it from their prompt
+            cache. The rows keep the order of the unlabeled examples. Defaults to 1, which samples fewshot examples
+            for every prompt.
+        limit_generation_length (bool): Whether to stop predictions early. The maximum number of new tokens is
+            derived from the longest label when annotating with label options, or from the longest target of the
+            fewshot examples, and the fewshot example separator is passed as stop sequence. Defaults to False,
+            which uses the defaults of the backend.
+        stream_predictions (bool): Whether to stream predictions and cancel a request as soon as its output is
+            complete, i.e. a stop sequence, the key of the next example or the end of a JSON object follows, or
+            cannot become valid anymore, i.e. it is no prefix of a label if the prompt is constrained to label
+            options. The time to the first token and the number of stopped requests are added to run_summary.
+            Defaults to False.
+        request_hedger (Optional[RequestHedger]): Duplicates prompt calls that are slower than a percentile of the
+            recent latencies and takes the first successful response. Prompt nodes whose invocation layer keeps the
+            kwargs of a call, e.g. the OpenAI layer, require an alternate_prompt_node of the hedger. The number of
+            hedged requests and hedges that answered first are added to run_summary. Defaults to None.
+        max_concurrent_calls (int): Number of prompt calls running at the same time. The rows keep the order of the
+            prompts. Use it with a BackendPool as prompt node to spread the calls over several backends, whose
+            statistics are added to run_summary. Invocation layers that keep the kwargs of a call, e.g. the OpenAI
+            layer, run one call at a time, so such a prompt node needs a backend per concurrent call. Defaults to 1.
+        model_cascade (Optional[ModelCascade]): Annotates every unlabeled example with the cheapest prompt node of
+            the cascade whose output is valid, i.e. one of the label options if there are any, and agrees across
+            its samples. Other examples are escalated to the next prompt node. The calls, accepted and escalated
+            examples and the cost per prompt node are added to run_summary. Defaults to None.
+    """
+
+    output_dir: Optional[Union[str, Path]] = None
+    rows_per_shard: int = 100_000
+    output_format: str = "arrow"
+    prefetch_batch_size: int = 1000
+    completions_per_call: int = 1
+    label_quotas: Optional[Dict[str, Union[int, float]]] = None
+    label_scorer: Optional[LabelScorer] = None
+    batch_executor: Optional[LocalBatchExecutor] = None
+    fewshot_group_size: int = 1
+    limit_generation_length: bool = False
+    stream_predictions: bool = False
+    request_hedger: Optional[RequestHedger] = None
+    max_concurrent_calls: int = 1
+    model_cascade: Optional[ModelCascade] = None
+
+    def __post_init__(self):
+        if self.completions_per_call < 1:
+            raise ValueError(f"completions_per_call must be a positive integer, got {self.completions_per_call}.")
+
+        if self.max_concurrent_calls < 1:
+            raise ValueError(f"max_concurrent_calls must be a positive integer, got {self.max_concurrent_calls}.")
+
+        if self.fewshot_group_size < 1:
+            raise ValueError(f"fewshot_group_size must be a positive integer, got {self.fewshot_group_size}.")
+
+        if self.stream_predictions and (self.completions_per_call > 1 or self.batch_executor is not None):
+            raise ValueError("Streamed predictions require a single completion per call and no batch_executor.")
+
+        if self.request_hedger is not None and self.batch_executor is not None:
+            raise ValueError("Requests run by a batch_executor cannot be hedged.")
+
+        if self.model_cascade is not None and (
+            self.completions_per_call > 1 or self.stream_predictions
+            or any(option is not None for option in (self.label_scorer, self.batch_executor, self.request_hedger))
+        ):
+            raise ValueError("A model_cascade annotates unlabeled examples with a single completion per call and "
+                             "cannot be combined with a label_scorer, batch_executor, streamed predictions or "
+                             "request_hedger.")
@@ -0,0 +1,140 @@
+"""Strategies to run the prompt calls of the generation loop"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from loguru import logger
+
+from .backends import LocalBatchExecutor, ValidatingStreamHandler
+from .scoring import LabelScorer
+from .utils import fill_prompt
+
+Prediction = Optional[Union[str, List[str]]]
+
+
+class PromptCalls:
+    """Runs every prompt call when the generation loop processes its row, so only one prompt is in flight. Other
+    strategies submit up to max_pending prompts ahead of the row that is processed, the rows are still processed in
+    the order of the prompts."""
+
+    max_pending = 1
+
+    def __init__(self, generate: Callable[..., Prediction]):
+        """Initialize the PromptCalls with the function that runs a prompt call.
+
+        Args:
+            generate (Callable[..., Prediction]): Called with the prompt text, the invocation context and the
+            stream_handler keyword, returns the completions or None if the call failed.
+        """
+        self.generate = generate
+
+    def submit(
+        self, prompt_text: str, invocation_context: Optional[Dict], stream_handler: Optional[ValidatingStreamHandler]
+    ) -> Optional[Future]:
+        """Starts a prompt call ahead of its row, None if the call runs when its row is processed."""
+        # pylint: disable=unused-argument
+        return None
+
+    def result(
+        self,
+        prompt_text: str,
+        invocation_context: Optional[Dict],
+        stream_handler: Optional[ValidatingStreamHandler],
+        future: Optional[Future],
+    ) -> Tuple[Prediction, Dict[str, Any]]:
+        """Completions of a prompt call, None if it failed, and further values of its rows."""
+        # pylint: disable=unused-argument
+        return self.generate(prompt_text, invocation_context, stream_handler=stream_handler), {}
+
+    def close(self) -> None:
+        """Stops the calls that are still running once the generation loop ends."""
+
+    @staticmethod
+    def wait_for_prediction(future: Future) -> Prediction:
+        """Waits for the completions of a prompt call submitted ahead, None if the call failed."""
+        try:
+            return future.result()
+        except Exception as error:
+            logger.error(f"Error while generating example: {error}")
+            return None
+
+
+class ConcurrentPromptCalls(PromptCalls):
+    """Runs up to max_concurrent_calls prompt calls at the same time in a thread pool."""
+
+    def __init__(self, generate: Callable[..., Prediction], max_concurrent_calls: int):
+        super().__init__(generate)
+        self.max_pending = max_concurrent_calls
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_calls, thread_name_prefix="PromptCall")
+
+    def submit(
+        self, prompt_text: str, invocation_context: Optional[Dict], stream_handler: Optional[ValidatingStreamHandler]
+    ) -> Optional[Future]:
+        return self._executor.submit(self.generate, prompt_text, invocation_context, stream_handler=stream_handler)
+
+    def result(
+        self,
+        prompt_text: str,
+        invocation_context: Optional[Dict],
+        stream_handler: Optional[ValidatingStreamHandler],
+        future: Optional[Future],
+    ) -> Tuple[Prediction, Dict[str, Any]]:
+        return self.wait_for_prediction(future), {}
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+class BatchedPromptCalls(PromptCalls):
+    """Submits the prompts to a LocalBatchExecutor, which runs them in length-bucketed micro-batches."""
+
+    def __init__(
+        self,
+        batch_executor: LocalBatchExecutor,
+        completions_per_call: int = 1,
+        generation_kwargs: Optional[Dict[str, Any]] = None,
+    ):
+        super().__init__(generate=None)
+        self.batch_executor = batch_executor
+        self.max_pending = batch_executor.max_pending
+        self.completions_per_call = completions_per_call
+        self.generation_kwargs = generation_kwargs or {}
+
+    def submit(
+        self, prompt_text: str, invocation_context: Optional[Dict], stream_handler: Optional[ValidatingStreamHandler]
+    ) -> Optional[Future]:
+        return self.batch_executor.submit(
+            fill_prompt(prompt_text, invocation_context),
+            self.completions_per_call,
+            max_new_tokens=self.generation_kwargs.get("max_length"),
+            stop_words=self.generation_kwargs.get("stop_words"),
+        )
+
+    def result(
+        self,
+        prompt_text: str,
+        invocation_context: Optional[Dict],
+        stream_handler: Optional[ValidatingStreamHandler],
+        future: Optional[Future],
+    ) -> Tuple[Prediction, Dict[str, Any]]:
+        return self.wait_for_prediction(future), {}
+
+
+class ScoredPromptCalls(PromptCalls):
+    """Annotates with the most probable label under a LabelScorer instead of running the prompt node. The label
+    probabilities are added to the row."""
+
+    def __init__(self, label_scorer: LabelScorer, label_options: List[str], probabilities_column: str):
+        super().__init__(generate=None)
+        self.label_scorer = label_scorer
+        self.label_options = label_options
+        self.probabilities_column = probabilities_column
+
+    def result(
+        self,
+        prompt_text: str,
+        invocation_context: Optional[Dict],
+        stream_handler: Optional[ValidatingStreamHandler],
+        future: Optional[Future],
+    ) -> Tuple[Prediction, Dict[str, Any]]:
+        prediction, label_probabilities = self.label_scorer.score(prompt_text, self.label_options, invocation_context)
+        return prediction, {self.probabilities_column: label_probabilities}
@@ -1,8 +1,11 @@
 __all__ = [
     "BasePrompt",
+    "OutputDecoder",
+    "StreamValidator",
     "infer_prompt_from_dataset",
     "infer_prompt_from_task_template"
 ]
 
 from .base import BasePrompt
+from .decoding import OutputDecoder, StreamValidator
 from .utils import infer_prompt_from_dataset, infer_prompt_from_task_template
@@ -1,8 +1,14 @@
-from typing import List, Dict, Union, Optional
+import json
+import math
+import re
 
-from datasets import Dataset
+from typing import Callable, List, Dict, Tuple, Union, Optional
+
+from datasets import Dataset, Features
 from loguru import logger
 
+from .decoding import OutputDecoder, StreamValidator
+
 
 class BasePrompt:
     """Base class for prompt generation. This class formats the prompt for the fewshot / support set examples
@@ -14,19 +20,23 @@ class BasePrompt:
     def __init__(
         self,
         task_description: str,
-        generate_data_for_column: Optional[str] = None,
+        generate_data_for_column: Optional[Union[List[str], str]] = None,
         fewshot_example_columns: Optional[Union[List[str], str]] = None,
         label_options: Optional[List[str]] = None,
         fewshot_formatting_template: Optional[str] = None,
         target_formatting_template: Optional[str] = None,
         fewshot_example_separator: str = "\n\n",
         inner_fewshot_example_separator: str = "\n",
+        constrain_to_label_options: bool = False,
+        fuzzy_matching_cutoff: Optional[float] = None,
     ):
         """Base class for prompt generation. This class formats the prompt for the fewshot / support set examples.
 
         Args:
             task_description (Optional[str], optional): Task description for the prompt (prefix).
-            generate_data_for_column (Optional[str], optional): The column name to generate data for. Defaults to None.
+            generate_data_for_column (Optional[Union[List[str], str]], optional): The column name(s) to generate data
+            for. If several columns are given, they are generated in a single call as keyed lines and parsed with
+            parse_prediction. Defaults to None.
             fewshot_example_columns (Union[List[str], str]): List of strings or string of column names for the
             fewshot / support set examples. Defaults to None.
             label_options (Optional[ClassificationOptions], optional): Label options for the LLM to choose from.
@@ -39,6 +49,11 @@ class BasePrompt:
             Defaults to "\n\n".
             inner_fewshot_example_separator (str, optional): Separator in-between a single fewshot examples.
             Defaults to "\n".
+            constrain_to_label_options (bool, optional): Whether predictions for generate_data_for_column must be
+            one of label_options. Responses like "Positive." are normalized to the label, other responses are
+            invalid. Defaults to False.
+            fuzzy_matching_cutoff (Optional[float], optional): Minimum similarity ratio between 0 and 1 to match
+            misspelled labels. Defaults to None, which disables fuzzy matching.
 
         Raises:
             AttributeError: If label_options is not a dict or list
@@ -52,10 +67,22 @@ class BasePrompt:
             self._assert_task_description_is_formattable(task_description)
         self.label_options = label_options
 
+        if constrain_to_label_options and not label_options:
+            raise ValueError("label_options are required to constrain predictions to label options.")
+        self.constrain_to_label_options = constrain_to_label_options
+        self.fuzzy_matching_cutoff = fuzzy_matching_cutoff
+
         if isinstance(generate_data_for_column, str) and generate_data_for_column:
             generate_data_for_column = [generate_data_for_column]
         self.generate_data_for_column = generate_data_for_column
 
+        if self.generates_multiple_columns:
+            # Matches the keys of the target columns at the start of a line, e.g. "answer: "
+            self._target_key_pattern = re.compile(
+                r"^\s*(" + "|".join(re.escape(column) for column in generate_data_for_column) + r")\s*:[ \t]*",
+                re.MULTILINE,
+            )
+
         if isinstance(fewshot_example_columns, str) and fewshot_example_columns:
             fewshot_example_columns = [fewshot_example_columns]
         self.fewshot_example_columns = fewshot_example_columns
@@ -86,6 +113,11 @@ class BasePrompt:
 
         logger.info(self._log_prompt())
 
+    @property
+    def generates_multiple_columns(self) -> bool:
+        """Whether several target columns are generated in a single call."""
+        return bool(self.generate_data_for_column) and len(self.generate_data_for_column) > 1
+
     @staticmethod
     def _assert_task_description_is_formattable(task_description: str) -> None:
         """Checks if task_description is formattable.
@@ -103,7 +135,17 @@ class BasePrompt:
         Returns:
             str: Target formatting template
         """
-        if self.generate_data_for_column and self.fewshot_example_columns:
+        if self.generates_multiple_columns:
+            target_template = self.inner_fewshot_example_separator.join(
+                [
+                    "Answer with one line per field, each starting with the field name: "
+                    f"{', '.join(self.generate_data_for_column)}."
+                ] +
+                [f"{var}: {{{var}}}" for var in self.fewshot_example_columns or []] +
+                [f"{self.generate_data_for_column[0]}: "]
+            )
+
+        elif self.generate_data_for_column and self.fewshot_example_columns:
             target_template = self.inner_fewshot_example_separator.join(
                 [f"{var}: {{{var}}}" for var in self.fewshot_example_columns] +
                 [f"{self.generate_data_for_column[0]}: "]
@@ -121,6 +163,161 @@ class BasePrompt:
 
         return target_template
 
+    def parse_prediction(self, prediction: str) -> Dict[str, Optional[str]]:
+        """Parse the prediction of the LLM into the target columns. If several columns are generated, the prediction
+        is read as a JSON object or as keyed lines ("question: ...\nanswer: ..."). Since the prompt already ends
+        with the key of the first target column, the prediction may start with its value. Values can span multiple
+        lines until the next key.
+
+        Args:
+            prediction (str): Prediction of the LLM.
+
+        Returns:
+            Dict[str, Optional[str]]: Value for each target column, None if the column could not be parsed.
+        """
+        if not self.generates_multiple_columns:
+            return {self.generate_data_for_column[0]: prediction}
+
+        parsed = dict.fromkeys(self.generate_data_for_column)
+        prediction = prediction.strip()
+
+        if prediction.startswith("{"):
+            try:
+                values = json.loads(prediction)
+            except json.JSONDecodeError:
+                values = None
+            if isinstance(values, dict):
+                for column in self.generate_data_for_column:
+                    if values.get(column) is not None:
+                        parsed[column] = str(values[column])
+                return parsed
+
+        matches = list(self._target_key_pattern.finditer(prediction))
+        if not matches or matches[0].start() > 0:
+            # The prediction continues the key of the first target column from the prompt
+            first_value_end = matches[0].start() if matches else len(prediction)
+            parsed[self.generate_data_for_column[0]] = prediction[:first_value_end].strip() or None
+
+        for match, next_match in zip(matches, matches[1:] + [None]):
+            value = prediction[match.end():next_match.start() if next_match else len(prediction)].strip()
+            # The first occurrence of a key wins, the LLM may continue with further examples
+            if parsed[match.group(1)] is None and value:
+                parsed[match.group(1)] = value
+
+        return parsed
+
+    def get_output_decoder(self, features: Features) -> OutputDecoder:
+        """Get the decoder for predictions of the target columns.
+
+        Args:
+            features (Features): Features of the target columns.
+
+        Returns:
+            OutputDecoder: Decoder casting predictions to the features and, if requested, to the label options.
+        """
+        return OutputDecoder(
+            features,
+            label_options=self.label_options,
+            label_columns=self.generate_data_for_column if self.constrain_to_label_options else None,
+            fuzzy_cutoff=self.fuzzy_matching_cutoff,
+        )
+
+    def get_stream_validator(self, use_label_options: bool = False) -> StreamValidator:
+        """Get the validator for streamed predictions of the target columns.
+
+        Args:
+            use_label_options (bool, optional): Whether the prediction must be one of label_options.
+            Defaults to False.
+
+        Returns:
+            StreamValidator: Validator stopping at the stop words or the key of the next example.
+        """
+        if self.generates_multiple_columns:
+            # Keys of the other target columns are part of the prediction
+            stop_keys = [column for column in self.fewshot_example_columns or []
+                         if column not in self.generate_data_for_column]
+        else:
+            stop_keys = (self.fewshot_example_columns or []) + (self.generate_data_for_column or [])
+
+        return StreamValidator(
+            stop_sequences=self.get_stop_words(),
+            stop_keys=stop_keys,
+            label_options=self.label_options if use_label_options else None,
+        )
+
+    def get_stop_words(self) -> List[str]:
+        """Get the stop sequences of a prediction. After the target, the LLM tends to continue with further examples,
+        which start with the fewshot example separator.
+
+        Returns:
+            List[str]: Stop sequences, empty if the separator can occur within the target.
+        """
+        if not self.fewshot_example_separator:
+            return []
+
+        if self.generates_multiple_columns and self.fewshot_example_separator in self.inner_fewshot_example_separator:
+            return []
+
+        return [self.fewshot_example_separator]
+
+    def estimate_max_new_tokens(
+        self,
+        count_tokens: Callable[[str], int],
+        fewshot_examples: Optional[Dataset] = None,
+        use_label_options: bool = False,
+        margin: float = 1.5,
+    ) -> Optional[int]:
+        """Estimate the number of tokens a prediction needs from the longest label or the longest target of the
+        fewshot examples, multiplied by a margin.
+
+        Args:
+            count_tokens (Callable[[str], int]): Number of tokens of a text for the tokenizer of the LLM.
+            fewshot_examples (Optional[Dataset], optional): Fewshot examples with the target columns.
+            Defaults to None.
+            use_label_options (bool, optional): Whether the prediction is one of label_options. Defaults to False.
+            margin (float, optional): Factor for the length of the longest target. Defaults to 1.5.
+
+        Returns:
+            Optional[int]: Maximum number of new tokens, None if there is nothing to estimate it from.
+        """
+        if use_label_options and self.label_options:
+            # Labels are generated after "label: ", so they are tokenized with a leading space
+            targets = [f" {label}" for label in self.label_options]
+        elif (
+            fewshot_examples
+            and self.generate_data_for_column
+            and set(self.generate_data_for_column) <= set(fewshot_examples.column_names)
+        ):
+            targets = [
+                self.inner_fewshot_example_separator.join(
+                    f"{column}: {example[column]}" for column in self.generate_data_for_column
+                ) if self.generates_multiple_columns else f" {example[self.generate_data_for_column[0]]}"
+                for example in fewshot_examples.select_columns(self.generate_data_for_column)
+            ]
+        else:
+            return None
+
+        return max(1, math.ceil(max(count_tokens(target) for target in targets) * margin))
+
+    def split_prompt_text(self, prompt_text: str) -> Tuple[str, str]:
+        """Split a prompt text of get_prompt_text at the boundary between the prefix, which is the task description
+        and the fewshot examples, and the target formatting template. Prompts with the same labels and fewshot
+        examples share the prefix, so local backends can reuse its past key values and hosted APIs can serve it
+        from their prompt cache.
+
+        Args:
+            prompt_text (str): Prompt text of get_prompt_text. Filling in the invocation context only changes the
+            suffix, so the length of the prefix is the boundary in the filled prompt text as well.
+
+        Returns:
+            Tuple[str, str]: Shared prefix, including the trailing separator, and the target formatting template.
+        """
+        if not prompt_text.endswith(self.target_formatting_template):
+            raise ValueError("The prompt text does not end with the target formatting template of this prompt.")
+
+        boundary = len(prompt_text) - len(self.target_formatting_template)
+        return prompt_text[:boundary], prompt_text[boundary:]
+
     def _log_prompt(self) -> str:
         """Log prompt.
 
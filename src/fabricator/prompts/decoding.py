@@ -0,0 +1,328 @@
+import ast
+import difflib
+import json
+import re
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from datasets import ClassLabel, Features, Value
+from datasets.features.features import encode_nested_example
+
+NUMBER_PATTERN = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+WORD_PATTERN = re.compile(r"\w+")
+TRUE_VALUES = {"true", "yes", "1"}
+FALSE_VALUES = {"false", "no", "0"}
+
+
+def normalize_words(text: str) -> Tuple[str, ...]:
+    """Lowercases a text and splits it into words, dropping punctuation and whitespace."""
+    return tuple(WORD_PATTERN.findall(text.lower()))
+
+
+class LabelMatcher:
+    """Maps free-form responses of the LLM to one of a fixed set of labels. The labels are compiled once into a
+    lookup of their normalized forms and a word-level prefix trie, so "Positive." matches "positive" directly and
+    "The label is negative" is found by scanning the response with the trie. Optionally, close misspellings are
+    matched with difflib."""
+
+    _END = object()
+
+    def __init__(self, labels: List[str], fuzzy_cutoff: Optional[float] = None):
+        """Initialize the LabelMatcher with the labels to match against.
+
+        Args:
+            labels (List[str]): Labels to match against.
+            fuzzy_cutoff (Optional[float], optional): Minimum similarity ratio between 0 and 1 for fuzzy matches.
+            Defaults to None, which disables fuzzy matching.
+        """
+        self.labels = labels
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self._lookup: Dict[str, str] = {}
+        self._trie: Dict[Any, Any] = {}
+        self._max_label_words = 0
+
+        for label in labels:
+            words = normalize_words(label)
+            if not words or " ".join(words) in self._lookup:
+                continue
+            self._lookup[" ".join(words)] = label
+            self._max_label_words = max(self._max_label_words, len(words))
+
+            node = self._trie
+            for word in words:
+                node = node.setdefault(word, {})
+            node[self._END] = label
+
+    def match(self, response: str) -> Optional[str]:
+        """Matches a response to a label.
+
+        Args:
+            response (str): Response of the LLM.
+
+        Returns:
+            Optional[str]: The matched label, None if no label or several different labels occur in the response.
+        """
+        words = normalize_words(response)
+        if not words:
+            return None
+
+        label = self._lookup.get(" ".join(words))
+        if label is not None:
+            return label
+
+        # Find the longest label starting at every word, the response must mention exactly one label
+        found_labels = set()
+        for start in range(len(words)):
+            node = self._trie
+            longest_label = None
+            for word in words[start:]:
+                node = node.get(word)
+                if node is None:
+                    break
+                longest_label = node.get(self._END, longest_label)
+            if longest_label is not None:
+                found_labels.add(longest_label)
+
+        if len(found_labels) == 1:
+            return found_labels.pop()
+
+        if found_labels or self.fuzzy_cutoff is None:
+            return None
+
+        return self._fuzzy_match(words)
+
+    def _fuzzy_match(self, words: Tuple[str, ...]) -> Optional[str]:
+        """Matches the whole response or any window of words as long as the longest label to the closest label."""
+        candidates = [" ".join(words)] + [
+            " ".join(words[start:start + length])
+            for length in range(1, self._max_label_words + 1)
+            for start in range(len(words) - length + 1)
+        ]
+        found_labels = set()
+        for candidate in candidates:
+            close_matches = difflib.get_close_matches(candidate, self._lookup, n=1, cutoff=self.fuzzy_cutoff)
+            if close_matches:
+                found_labels.add(self._lookup[close_matches[0]])
+        return found_labels.pop() if len(found_labels) == 1 else None
+
+
+class OutputDecoder:
+    """Decodes parsed predictions into the feature types of the target columns. Label columns of a prompt are
+    normalized to one of the label options, other columns with a ClassLabel feature to one of their names. Numbers
+    and booleans are extracted from the response. Values that cannot be decoded are reported as invalid so that the
+    row can be generated again."""
+
+    def __init__(
+        self,
+        features: Features,
+        label_options: Optional[List[str]] = None,
+        label_columns: Optional[List[str]] = None,
+        fuzzy_cutoff: Optional[float] = None,
+    ):
+        """Initialize the OutputDecoder with the features of the target columns.
+
+        Args:
+            features (Features): Features of the target columns.
+            label_options (Optional[List[str]], optional): Labels for the label columns. Defaults to None.
+            label_columns (Optional[List[str]], optional): Columns whose values must be one of label_options.
+            Defaults to None.
+            fuzzy_cutoff (Optional[float], optional): Minimum similarity ratio between 0 and 1 for fuzzy label
+            matches. Defaults to None, which disables fuzzy matching.
+        """
+        if label_columns and not label_options:
+            raise ValueError("label_options are required to constrain label columns.")
+
+        self.features = features
+        self._label_matchers: Dict[str, LabelMatcher] = {}
+        for column, feature in features.items():
+            if column in (label_columns or []):
+                self._label_matchers[column] = LabelMatcher(label_options, fuzzy_cutoff)
+            elif isinstance(feature, ClassLabel):
+                self._label_matchers[column] = LabelMatcher(feature.names, fuzzy_cutoff)
+
+    def decode(self, values: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+        """Decodes the values of the target columns.
+
+        Args:
+            values (Dict[str, Any]): Parsed prediction for each target column.
+
+        Returns:
+            Tuple[Dict[str, Any], List[str]]: Decoded values, None for invalid ones, and the invalid columns.
+        """
+        decoded = {}
+        invalid_columns = []
+        for column, feature in self.features.items():
+            decoded[column] = self._decode_value(column, feature, values.get(column))
+            if decoded[column] is None:
+                invalid_columns.append(column)
+        return decoded, invalid_columns
+
+    def _decode_value(self, column: str, feature: Any, value: Any) -> Any:
+        if value is None:
+            return None
+
+        if not isinstance(value, str):
+            return self._validate(feature, value)
+
+        value = value.strip()
+        if not value:
+            return None
+
+        if column in self._label_matchers:
+            return self._label_matchers[column].match(value)
+
+        if isinstance(feature, Value):
+            if feature.dtype in ("string", "large_string"):
+                return value
+
+            if feature.dtype == "bool":
+                words = normalize_words(value)
+                if words and words[0] in TRUE_VALUES:
+                    return True
+                if words and words[0] in FALSE_VALUES:
+                    return False
+                return None
+
+            number = NUMBER_PATTERN.search(value)
+            if number is None:
+                return None
+            number = float(number.group())
+            if "int" in feature.dtype:
+                return int(number) if number.is_integer() else None
+            return number
+
+        # Nested features like sequences are read as JSON or Python literals
+        for parse in (json.loads, ast.literal_eval):
+            try:
+                return self._validate(feature, parse(value))
+            except (ValueError, SyntaxError, TypeError):
+                continue
+        return None
+
+    @staticmethod
+    def _validate(feature: Any, value: Any) -> Any:
+        """Returns the value if it can be encoded with the feature, None otherwise."""
+        try:
+            encode_nested_example(feature, value)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return None
+        return value
+
+
+class StreamValidator:
+    """Checks a prediction incrementally while it is streamed, so the request can be stopped as soon as the output
+    is complete or cannot become valid anymore. An output is complete once a stop sequence or the key of a new
+    example follows the target, or once a JSON object or list is closed. With label options, an output is invalid
+    as soon as it is no prefix of any label, and complete once it is a label followed by a word boundary."""
+
+    CONTINUE = "continue"
+    FINAL = "final"
+    INVALID = "invalid"
+
+    def __init__(
+        self,
+        stop_sequences: Optional[List[str]] = None,
+        stop_keys: Optional[List[str]] = None,
+        label_options: Optional[List[str]] = None,
+    ):
+        """Initialize the StreamValidator with the signs of a complete output.
+
+        Args:
+            stop_sequences (Optional[List[str]], optional): Sequences that end the output. Defaults to None.
+            stop_keys (Optional[List[str]], optional): Keys that start a new example at the beginning of a line,
+            e.g. the fewshot example columns. Defaults to None.
+            label_options (Optional[List[str]], optional): Labels the output must be one of. Defaults to None.
+        """
+        self.stop_sequences = [sequence for sequence in stop_sequences or [] if sequence]
+        self._stop_key_pattern = re.compile(
+            r"\n[ \t]*(?:" + "|".join(re.escape(key) for key in stop_keys) + r")[ \t]*:"
+        ) if stop_keys else None
+        self._label_words = [normalize_words(label) for label in label_options or []]
+
+    def check(self, text: str) -> Tuple[str, str]:
+        """Checks the output streamed so far.
+
+        Args:
+            text (str): Output streamed so far.
+
+        Returns:
+            Tuple[str, str]: Status (CONTINUE, FINAL or INVALID) and the output, truncated at its end if it is final.
+        """
+        content_start = len(text) - len(text.lstrip())
+        if content_start == len(text):
+            return self.CONTINUE, text
+
+        end = None
+        for sequence in self.stop_sequences:
+            position = text.find(sequence, content_start)
+            if position >= 0 and (end is None or position < end):
+                end = position
+        if self._stop_key_pattern is not None:
+            match = self._stop_key_pattern.search(text, content_start)
+            if match is not None and (end is None or match.start() < end):
+                end = match.start()
+
+        if text[content_start] in "{[":
+            structure_end = self._find_structure_end(text, content_start)
+            if structure_end == -1:
+                return self.INVALID, text
+            if structure_end is not None and (end is None or structure_end < end):
+                end = structure_end
+
+        if self._label_words:
+            status = self._check_label(text if end is None else text[:end])
+            if status != self.CONTINUE:
+                return status, text if end is None else text[:end]
+
+        if end is not None:
+            return self.FINAL, text[:end]
+        return self.CONTINUE, text
+
+    def _check_label(self, text: str) -> str:
+        words = normalize_words(text)
+        if not words:
+            return self.CONTINUE
+
+        # The last word may still be incomplete
+        candidates = [
+            label_words for label_words in self._label_words
+            if len(label_words) >= len(words)
+            and label_words[:len(words) - 1] == words[:-1]
+            and label_words[len(words) - 1].startswith(words[-1])
+        ]
+        if not candidates:
+            return self.INVALID
+
+        ends_with_boundary = not WORD_PATTERN.fullmatch(text[-1])
+        if ends_with_boundary and words in candidates and all(
+            label_words == words for label_words in candidates if label_words[:len(words)] == words
+        ):
+            return self.FINAL
+        return self.CONTINUE
+
+    @staticmethod
+    def _find_structure_end(text: str, start: int) -> Optional[int]:
+        """End of the JSON object or list starting at start, None if it is still open and -1 if it is malformed."""
+        closing_brackets = {"{": "}", "[": "]"}
+        expected = []
+        in_string = False
+        escaped = False
+        for position in range(start, len(text)):
+            char = text[position]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char in closing_brackets:
+                expected.append(closing_brackets[char])
+            elif char in "}]":
+                if not expected or expected.pop() != char:
+                    return -1
+                if not expected:
+                    return position + 1
+        return None
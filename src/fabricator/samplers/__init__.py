@@ -2,8 +2,11 @@ __all__ = [
     "single_label_task_sampler",
     "single_label_stratified_sample",
     "random_sampler",
-    "ml_mc_sampler"
+    "ml_mc_sampler",
+    "interleave_class_indices",
+    "LabelQuotaScheduler",
 ]
 
 from .samplers import single_label_task_sampler, single_label_stratified_sample, \
-    random_sampler, ml_mc_sampler
+    random_sampler, ml_mc_sampler, interleave_class_indices
+from .quota import LabelQuotaScheduler
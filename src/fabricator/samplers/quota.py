@@ -0,0 +1,152 @@
+"""Label scheduling for label-conditioned generation"""
+import math
+from typing import Dict, List, Optional, Union
+
+from loguru import logger
+
+
+class LabelQuotaScheduler:
+    """Schedules the label of every prompt call such that the generated dataset meets exact per-label quotas.
+    The next label is always the one with the largest share of its quota still missing, so labels whose outputs
+    fail are scheduled again until they are filled. The scheduler is done as soon as all quotas are met. Prompt
+    calls that run concurrently reserve the rows of their label, so no more calls are scheduled than the quotas
+    still need.
+
+    Example:
+        scheduler = LabelQuotaScheduler({"positive": 0.3, "negative": 0.7}, num_samples=100)
+        label = scheduler.next_label()
+        scheduler.record(label, success=True)
+    """
+
+    def __init__(
+        self,
+        label_quotas: Dict[str, Union[int, float]],
+        num_samples: Optional[int] = None,
+        max_failures_per_label: Optional[int] = None,
+    ):
+        """Initialize the LabelQuotaScheduler with the quotas per label.
+
+        Args:
+            label_quotas (Dict[str, Union[int, float]]): Exact number of rows per label, or a target distribution
+            over the labels if the values are not all integers. A distribution is normalized and requires
+            num_samples.
+            num_samples (Optional[int], optional): Total number of rows if label_quotas is a distribution.
+            Defaults to None.
+            max_failures_per_label (Optional[int], optional): Number of failed outputs after which a label is
+            given up. Defaults to None, which never gives up a label.
+        """
+        if not label_quotas:
+            raise ValueError("label_quotas must contain at least one label.")
+
+        if any(quota < 0 for quota in label_quotas.values()):
+            raise ValueError("Label quotas must not be negative.")
+
+        if all(isinstance(quota, int) and not isinstance(quota, bool) for quota in label_quotas.values()):
+            self.quotas = dict(label_quotas)
+        else:
+            if num_samples is None:
+                raise ValueError("num_samples is required if label_quotas is a distribution.")
+            self.quotas = self._distribution_to_counts(label_quotas, num_samples)
+
+        self.max_failures_per_label = max_failures_per_label
+        self.counts = dict.fromkeys(self.quotas, 0)
+        self.failures = dict.fromkeys(self.quotas, 0)
+        self.abandoned_labels: List[str] = []
+        # Rows that prompt calls in flight may still add per label
+        self.reserved = dict.fromkeys(self.quotas, 0)
+
+    @staticmethod
+    def _distribution_to_counts(distribution: Dict[str, float], num_samples: int) -> Dict[str, int]:
+        """Converts a distribution to counts summing up to num_samples with the largest remainder method."""
+        total = sum(distribution.values())
+        if total <= 0:
+            raise ValueError("The label distribution must have a positive sum.")
+
+        exact_counts = {label: num_samples * share / total for label, share in distribution.items()}
+        counts = {label: math.floor(count) for label, count in exact_counts.items()}
+        missing = num_samples - sum(counts.values())
+        for label in sorted(exact_counts, key=lambda label: counts[label] - exact_counts[label])[:missing]:
+            counts[label] += 1
+        return counts
+
+    @property
+    def total(self) -> int:
+        """Total number of rows of all quotas."""
+        return sum(self.quotas.values())
+
+    @property
+    def remaining(self) -> Dict[str, int]:
+        """Number of rows still missing per label, zero for abandoned labels."""
+        return {
+            label: 0 if label in self.abandoned_labels else self.quotas[label] - self.counts[label]
+            for label in self.quotas
+        }
+
+    @property
+    def unreserved(self) -> Dict[str, int]:
+        """Number of rows still missing per label that no prompt call in flight is reserved for."""
+        return {label: max(0, missing - self.reserved[label]) for label, missing in self.remaining.items()}
+
+    @property
+    def done(self) -> bool:
+        """Whether all quotas are met or given up."""
+        return not any(self.remaining.values())
+
+    def next_label(self) -> Optional[str]:
+        """Label for the next prompt call.
+
+        Returns:
+            Optional[str]: Label with the largest share of its quota still missing, None if all quotas are met.
+        """
+        remaining = self.unreserved
+        open_labels = [label for label, missing in remaining.items() if missing > 0]
+        if not open_labels:
+            return None
+        return max(open_labels, key=lambda label: remaining[label] / self.quotas[label])
+
+    def reserve(self, label: str, num_rows: int = 1) -> int:
+        """Reserve rows of a label for a prompt call in flight, so concurrent calls do not exceed the quota.
+
+        Args:
+            label (str): Label of the prompt call.
+            num_rows (int, optional): Number of rows the prompt call may add. Defaults to 1.
+
+        Returns:
+            int: Number of reserved rows, at most the unreserved rows of the label. Release them once the outputs
+            of the prompt call are recorded.
+        """
+        num_rows = min(num_rows, self.unreserved[label])
+        self.reserved[label] += num_rows
+        return num_rows
+
+    def release(self, label: str, num_rows: int) -> None:
+        """Release the rows reserved for a prompt call that finished or was cancelled.
+
+        Args:
+            label (str): Label of the prompt call.
+            num_rows (int): Number of rows returned by reserve.
+        """
+        self.reserved[label] -= num_rows
+
+    def record(self, label: str, success: bool = True) -> None:
+        """Record the outcome of a generated output for a label.
+
+        Args:
+            label (str): Label of the output.
+            success (bool, optional): Whether the output is valid and counts towards the quota. Defaults to True.
+        """
+        if success:
+            self.counts[label] += 1
+            return
+
+        self.failures[label] += 1
+        if (
+            self.max_failures_per_label is not None
+            and self.failures[label] >= self.max_failures_per_label
+            and label not in self.abandoned_labels
+        ):
+            logger.warning(
+                "Giving up label {} after {} failed outputs with {} of {} rows generated.",
+                label, self.failures[label], self.counts[label], self.quotas[label]
+            )
+            self.abandoned_labels.append(label)
@@ -4,9 +4,8 @@ NOTE: All methods do not ensure, that all labels are contained in the samples.
 """
 import random
 from typing import Dict, List, Set, Union, Tuple
-from collections import defaultdict, deque
-from itertools import cycle
 
+import numpy as np
 from datasets import ClassLabel, Dataset, Sequence, Value
 from loguru import logger
 from tqdm import tqdm
@@ -48,14 +47,14 @@ def single_label_task_sampler(
     unique_classes_sampled = set()
     total_examples_sampled = 0
 
-    sampled_indices = []
+    sampled_mask = np.zeros(len(dataset), dtype=bool)
 
     while total_examples_sampled < num_examples:
         # Lets try to be as random and possible and sample from the entire dataset
         idx = random.sample(range(len(dataset)), 1)[0]
 
         # Pass already sampled idx
-        if idx in sampled_indices:
+        if sampled_mask[idx]:
             continue
 
         sample = dataset.select([idx])[0]
@@ -64,58 +63,90 @@ def single_label_task_sampler(
         # First sample at least one example per label
         if label not in unique_classes_sampled:
             unique_classes_sampled.add(label)
-            sampled_indices.append(idx)
+            sampled_mask[idx] = True
             total_examples_sampled += 1
             pbar.update(1)
 
         # Further sample if we collected at least one example per label
-        elif len(sampled_indices) < num_examples and len(unique_classes_sampled) == num_classes:
-            sampled_indices.append(idx)
+        elif total_examples_sampled < num_examples and len(unique_classes_sampled) == num_classes:
+            sampled_mask[idx] = True
             total_examples_sampled += 1
             pbar.update(1)
 
+    return _select_by_mask(dataset, sampled_mask, return_unused_split)
+
+
+def _select_by_mask(
+        dataset: Dataset, sampled_mask: np.ndarray, return_unused_split: bool = False
+) -> Union[Dataset, Tuple[Dataset, Dataset]]:
+    """Select the sampled rows (and optionally the unused rows) of a dataset from a boolean mask.
+    The mask costs one byte per row and both index arrays keep the original row order.
+
+    Args:
+        dataset: Dataset
+        sampled_mask: Boolean mask of length len(dataset), True for sampled rows
+        return_unused_split: Whether to return the unused split
+
+    Returns:
+        Sampled dataset or tuple of sampled and unused dataset
+    """
+    sampled_dataset = dataset.select(np.flatnonzero(sampled_mask))
+
     if return_unused_split:
-        unused_indices = list(set(range(len(dataset))) - set(sampled_indices))
-        return dataset.select(sampled_indices), dataset.select(unused_indices)
+        return sampled_dataset, dataset.select(np.flatnonzero(~sampled_mask))
 
-    return dataset.select(sampled_indices)
+    return sampled_dataset
 
 
-def _alternate_classes(dataset: Dataset, column: str) -> Dataset:
-    """Alternate the occurrence of each class in the dataset.
+def interleave_class_indices(labels: Union[List, np.ndarray]) -> np.ndarray:
+    """Compute the row order that alternates the occurrence of each class, i.e. a round-robin over the classes
+    in order of their first occurrence. Once a class is exhausted, the remaining classes continue to alternate.
+    Can be used for any label-balanced ordering, e.g. of sampled fewshot examples or generated datasets.
 
     Args:
-        dataset: Dataset
-        column: Name of the column to alternate the classes of
+        labels: Label of each row
 
     Returns:
-        Dataset with the classes alternated
+        Indices of the rows in alternated order
     """
+    if len(labels) == 0:
+        return np.zeros(0, dtype=np.int64)
 
-    # Group the indices of each unique value in 'target' column
-    targets = defaultdict(deque)
-    for i, elem in enumerate(dataset[column]):
-        targets[elem].append(i)
-
-    # Create a cycle iterator from targets
-    targets_cycle = cycle(targets.keys())
-
-    # Alternate the occurrence of each class
-    alternate_indices = []
-    for target in targets_cycle:
-        if not targets[target]:  # If this class has no more indices, remove it from the cycle
-            del targets[target]
-        else:  # Otherwise, add the next index of this class to the list
-            alternate_indices.append(targets[target].popleft())
-
-        # If there are no more indices, break the loop
-        if not targets:
-            break
+    class_ids = _encode_class_ids(labels)
+
+    # Rank of each row within its class
+    grouped_indices = np.argsort(class_ids, kind="stable")
+    group_starts = np.concatenate(([0], np.cumsum(np.bincount(class_ids))[:-1]))
+    ranks = np.empty(len(class_ids), dtype=np.int64)
+    ranks[grouped_indices] = np.arange(len(class_ids)) - group_starts[class_ids[grouped_indices]]
+
+    # Order by (rank, class)
+    return np.lexsort((class_ids, ranks))
 
-    # Create new dataset from the alternate indices
-    alternate_dataset = dataset.select(alternate_indices)
 
-    return alternate_dataset
+def _encode_class_ids(labels: Union[List, np.ndarray]) -> np.ndarray:
+    """Encode the labels as class ids numbered by their first occurrence.
+
+    Args:
+        labels: Label of each row, missing labels (None) form a class of their own
+
+    Returns:
+        Class id of each row
+    """
+    labels = np.asarray(labels)
+    if labels.dtype == object:
+        # np.unique sorts the labels and cannot compare None with strings
+        class_mapping = {}
+        return np.fromiter(
+            (class_mapping.setdefault(label, len(class_mapping)) for label in labels),
+            dtype=np.int64,
+            count=len(labels),
+        )
+
+    _, first_occurrence, class_ids = np.unique(labels, return_index=True, return_inverse=True)
+    class_order = np.empty_like(first_occurrence)
+    class_order[np.argsort(first_occurrence, kind="stable")] = np.arange(len(first_occurrence))
+    return class_order[class_ids.reshape(-1)]
 
 
 def single_label_stratified_sample(
@@ -140,28 +171,29 @@ def single_label_stratified_sample(
         raise ValueError("'num_examples_per_class' should be a positive integer.")
 
     # Group the indices of each unique value in 'target' column
-    targets = defaultdict(list)
-    for i, elem in enumerate(dataset[label_column]):
-        targets[elem].append(i)
+    class_ids = _encode_class_ids(dataset[label_column])
+    grouped_indices = np.argsort(class_ids, kind="stable")
+    group_sizes = np.bincount(class_ids)
 
     # Check if k is smaller or equal than the size of the smallest group
-    if num_examples_per_class > min(len(indices) for indices in targets.values()):
+    if num_examples_per_class > group_sizes.min():
         raise ValueError(
             "'num_examples_per_class' is greater than the size of the smallest group in the target column."
         )
 
-    # Stratified sampling
-    sample_indices = []
-    for indices in targets.values():
-        sample_indices.extend(random.sample(indices, num_examples_per_class))
+    # Stratified sampling, random.sample returns the rows of each class in random order
+    sampled_indices = np.concatenate([
+        indices[random.sample(range(len(indices)), num_examples_per_class)]
+        for indices in np.split(grouped_indices, np.cumsum(group_sizes)[:-1])
+    ])
 
-    # Create new dataset from the sample
-    sample_dataset = dataset.select(sample_indices)
-    sample_dataset = _alternate_classes(sample_dataset, label_column)
+    # Alternate the classes, the interleaving keeps the random order within each class
+    sample_dataset = dataset.select(sampled_indices[interleave_class_indices(class_ids[sampled_indices])])
 
     if return_unused_split:
-        unused_indices = list(set(range(len(dataset))) - set(sample_indices))
-        return sample_dataset, dataset.select(unused_indices)
+        sampled_mask = np.zeros(len(dataset), dtype=bool)
+        sampled_mask[sampled_indices] = True
+        return sample_dataset, dataset.select(np.flatnonzero(~sampled_mask))
 
     return sample_dataset
 
@@ -0,0 +1,188 @@
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .utils import fill_prompt
+
+
+class LabelScorer:
+    """Annotates label option prompts by scoring every label as a continuation of the prompt with a local causal
+    language model instead of decoding free text. The prompt is run once and its cached keys and values are shared
+    by all label continuations, which are scored in one batched forward pass. The probabilities of the labels are
+    calibrated with a content-free input (contextual calibration), which removes the bias of the prompt and the
+    model towards certain labels. Small models run on CPU.
+
+    Requires torch and transformers, which are imported when the scorer is created.
+    """
+
+    def __init__(
+        self,
+        model_name_or_path: str,
+        device: str = "cpu",
+        calibrate: bool = True,
+        content_free_input: str = "N/A",
+        length_normalize: bool = False,
+        max_cached_prompts: int = 128,
+    ):
+        """Initialize the LabelScorer with a Hugging Face causal language model.
+
+        Args:
+            model_name_or_path (str): Name or path of the causal language model.
+            device (str, optional): Device to run the model on. Defaults to "cpu".
+            calibrate (bool, optional): Whether to calibrate the label probabilities with a content-free input.
+            Defaults to True.
+            content_free_input (str, optional): Replaces the values of the invocation context for calibration.
+            Defaults to "N/A".
+            length_normalize (bool, optional): Whether to average the log probabilities over the tokens of a label
+            instead of summing them. Defaults to False.
+            max_cached_prompts (int, optional): Number of prompts whose content-free probabilities are kept. A prompt
+            is reused by all unlabeled examples that share its fewshot examples, the least recently used prompts are
+            dropped. Defaults to 128.
+        """
+        try:
+            import torch
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+        except ImportError as error:
+            raise ImportError(
+                "The LabelScorer requires torch and transformers. Install them with: pip install torch transformers"
+            ) from error
+
+        self._torch = torch
+        self.device = device
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
+        self.model = AutoModelForCausalLM.from_pretrained(model_name_or_path).to(device)
+        self.model.eval()
+        self.calibrate = calibrate
+        self.content_free_input = content_free_input
+        self.length_normalize = length_normalize
+        self.max_cached_prompts = max_cached_prompts
+        self._content_free_probabilities: "OrderedDict[Tuple[str, Tuple[str, ...]], np.ndarray]" = OrderedDict()
+
+    def label_log_probs(self, prompt_text: str, label_options: List[str]) -> np.ndarray:
+        """Log probability of every label as continuation of the prompt.
+
+        Args:
+            prompt_text (str): Prompt, already filled with the invocation context.
+            label_options (List[str]): Labels to score.
+
+        Returns:
+            np.ndarray: Log probability of each label.
+        """
+        torch = self._torch
+
+        # Whitespace at the end of the prompt belongs to the first token of the label for most tokenizers
+        prefix = prompt_text.rstrip()
+        separator = prompt_text[len(prefix):] or " "
+        prompt_ids = self.tokenizer(prefix)["input_ids"]
+        label_ids = [
+            self.tokenizer(separator + label, add_special_tokens=False)["input_ids"] for label in label_options
+        ]
+
+        max_label_length = max(len(ids) for ids in label_ids)
+        pad_token_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else 0
+        targets = torch.full((len(label_options), max_label_length), pad_token_id)
+        label_mask = torch.zeros((len(label_options), max_label_length))
+        for label_idx, ids in enumerate(label_ids):
+            targets[label_idx, :len(ids)] = torch.tensor(ids)
+            label_mask[label_idx, :len(ids)] = 1
+
+        with torch.no_grad():
+            logits = self._continuation_logits(prompt_ids, targets, label_mask)
+
+        log_probs = torch.log_softmax(logits.float(), dim=-1).cpu()
+        token_log_probs = log_probs.gather(-1, targets.unsqueeze(-1)).squeeze(-1) * label_mask
+
+        scores = token_log_probs.sum(dim=-1)
+        if self.length_normalize:
+            scores = scores / label_mask.sum(dim=-1)
+        return scores.numpy()
+
+    def _continuation_logits(self, prompt_ids: List[int], targets: Any, label_mask: Any) -> Any:
+        """Logits that predict every token of the label continuations. The prompt runs once, the labels attend to
+        its cached keys and values, so the prompt is not encoded again for every label."""
+        torch = self._torch
+        num_labels, max_label_length = targets.shape
+
+        prompt_output = self.model(input_ids=torch.tensor([prompt_ids], device=self.device), use_cache=True)
+        # The last logits of the prompt predict the first token of every label
+        first_token_logits = prompt_output.logits[:, -1:, :].expand(num_labels, -1, -1)
+        if max_label_length == 1:
+            return first_token_logits
+
+        past_key_values = prompt_output.past_key_values
+        if hasattr(past_key_values, "batch_repeat_interleave"):
+            past_key_values.batch_repeat_interleave(num_labels)
+        else:
+            past_key_values = tuple(
+                tuple(tensor.expand(num_labels, *tensor.shape[1:]) for tensor in layer) for layer in past_key_values
+            )
+        attention_mask = torch.cat([torch.ones((num_labels, len(prompt_ids))), label_mask], dim=-1)
+        # The logits at label position t predict the label token at position t + 1
+        label_logits = self.model(
+            input_ids=targets[:, :-1].to(self.device),
+            attention_mask=attention_mask[:, :-1].to(self.device),
+            past_key_values=past_key_values,
+        ).logits
+        return torch.cat([first_token_logits, label_logits], dim=1)
+
+    def score(
+        self, prompt_text: str, label_options: List[str], invocation_context: Optional[Dict[str, Any]] = None
+    ) -> Tuple[str, List[float]]:
+        """Scores the labels for a prompt and returns the most probable one.
+
+        Args:
+            prompt_text (str): Prompt text with placeholders for the invocation context.
+            label_options (List[str]): Labels to score.
+            invocation_context (Optional[Dict[str, Any]], optional): Values of the placeholders. Defaults to None.
+
+        Returns:
+            Tuple[str, List[float]]: Most probable label and the (calibrated) probability of each label.
+        """
+        probabilities = self._softmax(
+            self.label_log_probs(fill_prompt(prompt_text, invocation_context), label_options)
+        )
+
+        if self.calibrate:
+            probabilities = self.calibrate_probabilities(
+                probabilities, self._get_content_free_probabilities(prompt_text, label_options, invocation_context)
+            )
+
+        return label_options[int(np.argmax(probabilities))], probabilities.tolist()
+
+    def _get_content_free_probabilities(
+        self, prompt_text: str, label_options: List[str], invocation_context: Optional[Dict[str, Any]]
+    ) -> np.ndarray:
+        """Label probabilities of the prompt with a content-free invocation context, cached per prompt."""
+        content_free_key = (prompt_text, tuple(label_options))
+        if content_free_key in self._content_free_probabilities:
+            self._content_free_probabilities.move_to_end(content_free_key)
+            return self._content_free_probabilities[content_free_key]
+
+        content_free_context = dict.fromkeys(invocation_context or {}, self.content_free_input)
+        content_free_probabilities = self._softmax(
+            self.label_log_probs(fill_prompt(prompt_text, content_free_context), label_options)
+        )
+        self._content_free_probabilities[content_free_key] = content_free_probabilities
+        if len(self._content_free_probabilities) > self.max_cached_prompts:
+            self._content_free_probabilities.popitem(last=False)
+        return content_free_probabilities
+
+    @staticmethod
+    def calibrate_probabilities(probabilities: np.ndarray, content_free_probabilities: np.ndarray) -> np.ndarray:
+        """Divides the label probabilities by the probabilities for a content-free input and renormalizes them.
+
+        Args:
+            probabilities (np.ndarray): Probabilities of the labels for the actual input.
+            content_free_probabilities (np.ndarray): Probabilities of the labels for the content-free input.
+
+        Returns:
+            np.ndarray: Calibrated probabilities.
+        """
+        calibrated = probabilities / np.clip(content_free_probabilities, 1e-12, None)
+        return calibrated / calibrated.sum()
+
+    @staticmethod
+    def _softmax(scores: np.ndarray) -> np.ndarray:
+        exp_scores = np.exp(scores - np.max(scores))
+        return exp_scores / exp_scores.sum()
@@ -1,5 +1,10 @@
 import datetime
 import os
+import threading
+import weakref
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
 
 
 def log_dir():
@@ -20,3 +25,49 @@ def save_create_directory(path: str):
     """Creates a directory if it does not exist."""
     if not os.path.exists(path):
         os.makedirs(path)
+
+
+def fill_prompt(prompt_text: str, invocation_context: Optional[Dict[str, Any]]) -> str:
+    """Fills the placeholders of the invocation context like the prompt node does."""
+    for column, value in (invocation_context or {}).items():
+        prompt_text = prompt_text.replace(f"{{{column}}}", str(value))
+    return prompt_text
+
+
+def get_invocation_layer(prompt_node: Any) -> Optional[Any]:
+    """Returns the invocation layer of a haystack prompt node, None if it has none."""
+    return getattr(getattr(prompt_node, "prompt_model", None), "model_invocation_layer", None)
+
+
+def keeps_call_kwargs(prompt_node: Any) -> bool:
+    """Whether the invocation layer of a prompt node merges the kwargs of a call into its model input kwargs, so
+    calls on it run one at a time, see exclusive_call."""
+    return isinstance(getattr(get_invocation_layer(prompt_node), "model_input_kwargs", None), dict)
+
+
+# Invocation layer -> lock of the calls running on it, entries are dropped with their layer
+_layer_locks: "weakref.WeakKeyDictionary[Any, threading.Lock]" = weakref.WeakKeyDictionary()
+_layer_locks_lock = threading.Lock()
+
+
+@contextmanager
+def exclusive_call(prompt_node: Any) -> Iterator[None]:
+    """Runs a call on a prompt node without sharing the call state of its invocation layer. Several haystack
+    invocation layers, e.g. the OpenAI layer, merge the generation kwargs and the stream handler of a call into
+    their model input kwargs and keep them. Calls on such a layer run one at a time and its model input kwargs are
+    restored after each call, other prompt nodes are called concurrently."""
+    invocation_layer = get_invocation_layer(prompt_node)
+    model_input_kwargs = getattr(invocation_layer, "model_input_kwargs", None)
+    if not isinstance(model_input_kwargs, dict):
+        yield
+        return
+
+    with _layer_locks_lock:
+        layer_lock = _layer_locks.setdefault(invocation_layer, threading.Lock())
+    with layer_lock:
+        original_kwargs = dict(model_input_kwargs)
+        try:
+            yield
+        finally:
+            model_input_kwargs.clear()
+            model_input_kwargs.update(original_kwargs)
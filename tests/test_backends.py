@@ -0,0 +1,531 @@
+import random
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+from datasets import Dataset
+
+from fabricator import (
+    BackendPool, DatasetGenerator, GenerationConfig, LocalBatchExecutor, ModelCascade, RequestHedger, StopStreaming,
+    ValidatingStreamHandler
+)
+from fabricator.prompts import BasePrompt, StreamValidator
+
+
+class FakePipeline:
+    """Text generation pipeline that records its batches and labels reviews by keyword. Batched sequences are
+    generated past their stop words, so every generation can be followed by a continuation."""
+
+    def __init__(self, continuation=""):
+        self.batches = []
+        self.continuation = continuation
+
+    def __call__(self, prompts, batch_size=None, **kwargs):
+        self.batches.append(prompts)
+        return [
+            [{"generated_text": ("positive" if "good" in prompt.lower() else "negative") + self.continuation}]
+            * kwargs.get("num_return_sequences", 1)
+            for prompt in prompts
+        ]
+
+
+class TestLocalBatchExecutor(unittest.TestCase):
+    """Testcase for length-bucketed batching of prompts"""
+
+    def test_batches_are_bucketed_by_length(self):
+        pipe = FakePipeline()
+        executor = LocalBatchExecutor(pipe, max_batch_size=2, max_wait_seconds=60, bucket_width=5, length_function=len)
+        with executor:
+            futures = [executor.submit(prompt) for prompt in ["good", "bad movie", "so good", "bad", "boring"]]
+            self.assertEqual(futures[0].result(timeout=5), ["positive"])
+
+        # Buckets run independently of each other, so only the prompts of each batch are fixed
+        self.assertCountEqual(pipe.batches, [["good", "bad"], ["bad movie", "so good"], ["boring"]])
+        self.assertEqual(
+            [future.result() for future in futures][1:], [["negative"], ["positive"], ["negative"], ["negative"]]
+        )
+        self.assertEqual(executor.stats["batches"], 3)
+        self.assertEqual(executor.stats["padding_tokens"], 1 + 2)
+
+    def test_bucket_is_flushed_after_deadline(self):
+        pipe = FakePipeline()
+        with LocalBatchExecutor(pipe, max_batch_size=8, max_wait_seconds=0.01) as executor:
+            self.assertEqual(executor.submit("good", num_completions=2).result(timeout=5), ["positive", "positive"])
+        self.assertEqual(pipe.batches, [["good"]])
+
+        with self.assertRaises(RuntimeError):
+            executor.submit("good")
+
+    def test_completions_are_cut_at_stop_words(self):
+        pipe = FakePipeline(continuation="\n\nText: A good movie.\nLabel: positive")
+        with LocalBatchExecutor(pipe, max_batch_size=2, max_wait_seconds=0.01) as executor:
+            future = executor.submit("Bad.", num_completions=2, stop_words=["\n\n", "Label:"])
+            unstopped_future = executor.submit("Good.")
+            self.assertEqual(future.result(timeout=5), ["negative", "negative"])
+            self.assertEqual(unstopped_future.result(timeout=5), ["positive" + pipe.continuation])
+
+    def test_generation_with_batch_executor_uses_stop_words(self):
+        prompt = BasePrompt(
+            task_description="Generate a {} movie review.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="text",
+        )
+        pipe = FakePipeline(continuation="\n\ntext: A further review.")
+
+        with LocalBatchExecutor(pipe, max_batch_size=8, max_wait_seconds=0.01) as executor:
+            generated_dataset = DatasetGenerator(None).generate(
+                prompt_template=prompt,
+                max_prompt_calls=2,
+                generation_config=GenerationConfig(batch_executor=executor, limit_generation_length=True),
+            )
+
+        self.assertEqual(sorted(generated_dataset["text"]), ["negative", "negative"])
+
+    def test_annotation_with_batch_executor(self):
+        unlabeled_dataset = Dataset.from_dict({"text": ["A good movie.", "Boring.", "Good!", "Too long.", "Bad."]})
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews as either: {}.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+        )
+        pipe = FakePipeline()
+
+        with LocalBatchExecutor(pipe, max_batch_size=2, max_wait_seconds=0.01, bucket_width=1000) as executor:
+            generated_dataset = DatasetGenerator(None).generate(
+                prompt_template=prompt,
+                unlabeled_dataset=unlabeled_dataset,
+                max_prompt_calls=5,
+                generation_config=GenerationConfig(batch_executor=executor),
+            )
+
+        self.assertEqual(generated_dataset["text"], unlabeled_dataset["text"])
+        self.assertEqual(generated_dataset["label"], ["positive", "negative", "positive", "negative", "negative"])
+        self.assertEqual([len(batch) for batch in pipe.batches], [2, 2, 1])
+        # Prompts are filled with the unlabeled example before they are batched
+        self.assertIn("A good movie.", pipe.batches[0][0])
+
+    def test_generation_with_batch_executor_and_label_quotas(self):
+        prompt = BasePrompt(
+            task_description="Generate a {} movie review.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="text",
+        )
+        pipe = FakePipeline()
+        generator = DatasetGenerator(None)
+
+        with LocalBatchExecutor(pipe, max_batch_size=8, max_wait_seconds=0.01) as executor:
+            generated_dataset = generator.generate(
+                prompt_template=prompt,
+                max_prompt_calls=20,
+                generation_config=GenerationConfig(
+                    label_quotas={"positive": 2, "negative": 1}, batch_executor=executor
+                ),
+            )
+
+        # Only the prompts the quotas need are batched, although the executor accepts more pending prompts
+        self.assertEqual(sorted(generated_dataset["label"]), ["negative", "positive", "positive"])
+        self.assertEqual(sum(len(batch) for batch in pipe.batches), 3)
+        self.assertEqual(generator.run_summary["prompt_calls"], 3)
+
+
+class SlowPromptNode:
+    """Prompt node that streams its result token by token with a delay per token."""
+
+    def __init__(self, result, delay_per_token):
+        self.result = result
+        self.delay_per_token = delay_per_token
+
+    def run(self, prompt_template=None, invocation_context=None, generation_kwargs=None):
+        for token in self.result.split(" "):
+            time.sleep(self.delay_per_token)
+            generation_kwargs["stream_handler"](token)
+        return {"results": [self.result]}, "output_1"
+
+
+class TestRequestHedger(unittest.TestCase):
+    """Testcase for hedged requests"""
+
+    @staticmethod
+    def send(prompt_node, handler):
+        try:
+            return prompt_node.run(generation_kwargs={"stream_handler": handler})[0]["results"]
+        except StopStreaming:
+            return None
+
+    def test_slow_request_is_hedged(self):
+        hedger = RequestHedger(
+            percentile=50, budget=1.0, alternate_prompt_node=SlowPromptNode("fast", 0.0), min_samples=3
+        )
+        slow_prompt_node = SlowPromptNode(" ".join(["slow"] * 50), 0.02)
+
+        # Without latencies there is no hedge delay yet
+        self.assertIsNone(hedger.hedge_delay())
+        hedger.latencies.extend([0.01, 0.01, 0.01])
+
+        self.assertEqual(hedger.run(self.send, slow_prompt_node), ["fast"])
+        self.assertEqual(hedger.stats, {"requests": 1, "hedged_requests": 1, "hedge_wins": 1})
+        hedger.close()
+        # The cancelled request does not count towards the latencies
+        self.assertEqual(len(hedger.latencies), 3)
+
+    def test_hedge_budget(self):
+        hedger = RequestHedger(
+            percentile=50, budget=0.0, alternate_prompt_node=SlowPromptNode("fast", 0.0), min_samples=1
+        )
+        hedger.latencies.append(0.01)
+
+        self.assertEqual(hedger.run(self.send, SlowPromptNode("slow", 0.05)), ["slow"])
+        self.assertEqual(hedger.stats["hedged_requests"], 0)
+
+        with self.assertRaises(ValueError):
+            RequestHedger(percentile=100)
+
+    def test_invalid_response_does_not_win(self):
+        def send(prompt_node, handler):
+            try:
+                return prompt_node.run(generation_kwargs={"stream_handler": handler})[0]["results"]
+            except StopStreaming:
+                return None if handler.status == ValidatingStreamHandler.CANCELLED else [handler.text]
+
+        hedger = RequestHedger(
+            percentile=50, budget=1.0, alternate_prompt_node=SlowPromptNode("maybe", 0.0), min_samples=1
+        )
+        hedger.latencies.append(0.01)
+        stream_handler = ValidatingStreamHandler(StreamValidator(label_options=["positive", "negative"]))
+
+        # The hedge answers first, but its output is no label, so the primary request is not cancelled
+        self.assertEqual(hedger.run(send, SlowPromptNode("positive", 0.1), stream_handler), ["positive"])
+        self.assertEqual(hedger.stats, {"requests": 1, "hedged_requests": 1, "hedge_wins": 0})
+
+        # Requests that cannot be cancelled are not hedged
+        self.assertEqual(hedger.run(send, SlowPromptNode("negative", 0.1), cancellable=False), ["negative"])
+        self.assertEqual(hedger.stats["hedged_requests"], 1)
+        hedger.close()
+
+    def test_generation_with_request_hedger(self):
+        prompt = BasePrompt(task_description="Generate a movie review.")
+        hedger = RequestHedger(
+            percentile=50, budget=1.0, alternate_prompt_node=SlowPromptNode("A fast review.", 0.0), min_samples=1
+        )
+        hedger.latencies.append(0.01)
+        generator = DatasetGenerator(SlowPromptNode("A slow review.", 0.5))
+
+        generated_dataset = generator.generate(
+            prompt_template=prompt, max_prompt_calls=2, num_samples_to_generate=2,
+            generation_config=GenerationConfig(request_hedger=hedger),
+        )
+
+        self.assertEqual(generated_dataset["text"], ["A fast review.", "A fast review."])
+        self.assertEqual(generator.run_summary["hedged_requests"], 2)
+        self.assertEqual(generator.run_summary["hedge_wins"], 2)
+
+    def test_hedge_to_prompt_node_with_shared_kwargs(self):
+        unlabeled_dataset = Dataset.from_dict({"text": ["A slow review."]})
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews.",
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+        )
+        prompt_node = SharedKwargsPromptNode(delays=[0.3])
+        generator = DatasetGenerator(prompt_node)
+
+        # A hedge to the same layer would share the stream handler of the primary request and wait for it
+        with self.assertRaises(ValueError):
+            generator.generate(
+                prompt_template=prompt, unlabeled_dataset=unlabeled_dataset, max_prompt_calls=1,
+                generation_config=GenerationConfig(request_hedger=RequestHedger(), stream_predictions=True),
+            )
+
+        # A hedge to an alternate prompt node streams to its own handler
+        alternate_prompt_node = SharedKwargsPromptNode()
+        hedger = RequestHedger(percentile=50, budget=1.0, min_samples=1, alternate_prompt_node=alternate_prompt_node)
+        hedger.latencies.append(0.01)
+        generated_dataset = generator.generate(
+            prompt_template=prompt, unlabeled_dataset=unlabeled_dataset, max_prompt_calls=1,
+            generation_config=GenerationConfig(request_hedger=hedger, stream_predictions=True),
+        )
+        hedger.close()
+
+        self.assertEqual(generated_dataset["label"], ["A slow review."])
+        self.assertEqual(generator.run_summary["hedge_wins"], 1)
+        self.assertEqual((prompt_node.calls, alternate_prompt_node.calls), (1, 1))
+        self.assertEqual(prompt_node.prompt_model.model_invocation_layer.model_input_kwargs, {})
+
+
+class RateLimitError(Exception):
+    """Error like the rate limit errors of hosted APIs."""
+
+
+class EchoPromptNode:
+    """Prompt node that answers with the text of the invocation context after a delay, or fails with an error."""
+
+    def __init__(self, delay=0.0, error=None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def run(self, prompt_template=None, invocation_context=None, generation_kwargs=None):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return {"results": [(invocation_context or {}).get("text", "answer")]}, "output_1"
+
+
+class SharedKwargsPromptNode:
+    """Prompt node whose invocation layer writes the kwargs of a call, including its stream handler, into model
+    input kwargs shared by all calls, like the OpenAI layer, and only takes the stream handler once the response
+    arrives. Every call answers with the text of its invocation context, followed by further text."""
+
+    def __init__(self, delays=()):
+        self.delays = iter(delays)
+        # The prompt node is its own invocation layer
+        self.prompt_model = SimpleNamespace(model_invocation_layer=self)
+        self.model_input_kwargs = {}
+        self.calls = 0
+        self.running_calls = 0
+        self.max_running_calls = 0
+        self._lock = threading.Lock()
+
+    def run(self, prompt_template=None, invocation_context=None, generation_kwargs=None):
+        with self._lock:
+            self.calls += 1
+            self.running_calls += 1
+            self.max_running_calls = max(self.max_running_calls, self.running_calls)
+            delay = next(self.delays, 0.0)
+        try:
+            self.model_input_kwargs.update(generation_kwargs or {})
+            time.sleep(delay)
+            stream_handler = self.model_input_kwargs.pop("stream_handler", None)
+            tokens = [(invocation_context or {}).get("text", "answer"), "\n\n", "further text"]
+            for token in tokens:
+                if stream_handler is not None:
+                    stream_handler(token)
+            return {"results": ["".join(tokens)]}, "output_1"
+        finally:
+            with self._lock:
+                self.running_calls -= 1
+
+
+class TestBackendPool(unittest.TestCase):
+    """Testcase for routing prompt calls over several backends"""
+
+    def test_failed_calls_are_rerouted(self):
+        failing, healthy = EchoPromptNode(error=ConnectionError("down")), EchoPromptNode()
+        pool = BackendPool([failing, healthy], names=["failing", "healthy"], max_failures=1, cooldown_seconds=60)
+
+        for _ in range(10):
+            self.assertEqual(pool.run(invocation_context={"text": "a"})[0]["results"], ["a"])
+
+        # The failing backend is left out after its first failure
+        self.assertLessEqual(failing.calls, 1)
+        self.assertEqual(healthy.calls, 10)
+        self.assertEqual(pool.stats["failing"]["failures"], failing.calls)
+
+        with self.assertRaises(ConnectionError):
+            BackendPool([EchoPromptNode(error=ConnectionError("down"))]).run()
+
+    def test_throttled_backend_cools_down(self):
+        throttled, healthy = EchoPromptNode(error=RateLimitError("429")), EchoPromptNode()
+        pool = BackendPool([throttled, healthy], weights=[1000.0, 1.0], max_failures=10)
+
+        for _ in range(5):
+            pool.run()
+
+        self.assertEqual(throttled.calls, 1)
+        self.assertEqual(pool.stats["backend_0"]["throttled"], 1)
+
+    def test_rate_limit_and_weights(self):
+        pool = BackendPool([EchoPromptNode()], requests_per_minute=[600])
+        started = time.monotonic()
+        for _ in range(3):
+            pool.run()
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+        random.seed(42)
+        pool = BackendPool([EchoPromptNode(), EchoPromptNode()], weights=[3.0, 1.0])
+        for _ in range(400):
+            pool.run()
+        self.assertGreater(pool.stats["backend_0"]["requests"], 250)
+
+        with self.assertRaises(ValueError):
+            BackendPool([EchoPromptNode()], weights=[1.0, 1.0])
+
+    def test_concurrent_annotation_with_backend_pool(self):
+        unlabeled_dataset = Dataset.from_dict({"text": [f"review {idx}" for idx in range(8)]})
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews.",
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+        )
+        prompt_nodes = [EchoPromptNode(delay=0.1), EchoPromptNode(delay=0.1)]
+        generator = DatasetGenerator(BackendPool(prompt_nodes, names=["first", "second"]))
+
+        generated_dataset = generator.generate(
+            prompt_template=prompt,
+            unlabeled_dataset=unlabeled_dataset,
+            max_prompt_calls=8,
+            generation_config=GenerationConfig(max_concurrent_calls=4),
+        )
+
+        # The rows keep the order of the prompts although the calls finish in any order
+        self.assertEqual(generated_dataset["label"], unlabeled_dataset["text"])
+        self.assertEqual(sum(prompt_node.calls for prompt_node in prompt_nodes), 8)
+        self.assertEqual(
+            [generator.run_summary["backends"][name]["requests"] for name in ("first", "second")],
+            [prompt_node.calls for prompt_node in prompt_nodes],
+        )
+        self.assertEqual(generator.run_summary["prompt_calls"], 8)
+
+    def test_concurrent_streamed_calls_on_shared_kwargs(self):
+        """Test that concurrent calls on a layer that shares the kwargs of its calls stream to their own handlers."""
+        unlabeled_dataset = Dataset.from_dict({"text": [f"review {idx}" for idx in range(4)]})
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews.",
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+        )
+        prompt_node = SharedKwargsPromptNode(delays=[0.1, 0.0, 0.1, 0.0])
+        generator = DatasetGenerator(prompt_node)
+
+        generated_dataset = generator.generate(
+            prompt_template=prompt,
+            unlabeled_dataset=unlabeled_dataset,
+            max_prompt_calls=4,
+            generation_config=GenerationConfig(max_concurrent_calls=2, stream_predictions=True),
+        )
+
+        self.assertEqual(generated_dataset["label"], unlabeled_dataset["text"])
+        self.assertEqual(generator.run_summary["stopped_final"], 4)
+        self.assertEqual(prompt_node.max_running_calls, 1)
+        self.assertEqual(prompt_node.prompt_model.model_invocation_layer.model_input_kwargs, {})
+
+    def test_concurrent_calls_prefer_idle_backends(self):
+        unlabeled_dataset = Dataset.from_dict({"text": [f"review {idx}" for idx in range(4)]})
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews.",
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+        )
+        prompt_nodes = [SharedKwargsPromptNode(delays=[0.1] * 2), SharedKwargsPromptNode(delays=[0.1] * 2)]
+        generator = DatasetGenerator(BackendPool(prompt_nodes))
+
+        generated_dataset = generator.generate(
+            prompt_template=prompt,
+            unlabeled_dataset=unlabeled_dataset,
+            max_prompt_calls=4,
+            generation_config=GenerationConfig(max_concurrent_calls=2, stream_predictions=True),
+        )
+
+        # Every backend runs one call at a time, so both calls in flight go to different backends
+        self.assertEqual(generated_dataset["label"], unlabeled_dataset["text"])
+        self.assertEqual([prompt_node.calls for prompt_node in prompt_nodes], [2, 2])
+        self.assertEqual([prompt_node.max_running_calls for prompt_node in prompt_nodes], [1, 1])
+
+    def test_concurrent_generation_with_label_quotas(self):
+        prompt = BasePrompt(
+            task_description="Generate a {} movie review.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="text",
+        )
+        prompt_node = EchoPromptNode(delay=0.05)
+        generator = DatasetGenerator(prompt_node)
+
+        generated_dataset = generator.generate(
+            prompt_template=prompt,
+            max_prompt_calls=20,
+            generation_config=GenerationConfig(label_quotas={"positive": 2, "negative": 1}, max_concurrent_calls=4),
+        )
+
+        # Calls in flight reserve their label, so only as many calls are issued as the quotas need
+        self.assertEqual(sorted(generated_dataset["label"]), ["negative", "positive", "positive"])
+        self.assertEqual(prompt_node.calls, 3)
+        self.assertEqual(generator.run_summary["prompt_calls"], 3)
+
+
+class LabelPromptNode:
+    """Prompt node that answers with a label per text, one answer per requested completion."""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = 0
+
+    def run(self, prompt_template=None, invocation_context=None, generation_kwargs=None):
+        self.calls += 1
+        answers = self.answers[invocation_context["text"]]
+        num_completions = (generation_kwargs or {}).get("top_k", 1)
+        return {"results": [answers[idx % len(answers)] for idx in range(num_completions)]}, "output_1"
+
+
+class TestModelCascade(unittest.TestCase):
+    """Testcase for escalating prompts from cheap to strong models"""
+
+    def test_escalation(self):
+        cascade = ModelCascade([object(), object()], costs_per_call=[0.1, 1.0], samples_per_call=3,
+                               min_agreement=0.6)
+        answers = {0: ["a", "a", "b"], 1: ["c", "d", "e"]}
+
+        def send(prompt_node, num_completions):
+            self.assertEqual(num_completions, 3)
+            return answers[cascade.prompt_nodes.index(prompt_node)]
+
+        # The cheap tier agrees on "a" in two of three samples
+        self.assertEqual(cascade.run(send, lambda completion: completion), "a")
+        # Invalid outputs of the cheap tier are escalated, the last tier answers regardless of its agreement
+        self.assertEqual(cascade.run(send, lambda completion: completion if completion != "a" else None), "c")
+        self.assertEqual(cascade.stats["tier_0"],
+                         {"calls": 2, "accepted": 1, "escalated": 1, "invalid": 0, "cost": 0.2})
+        self.assertEqual(cascade.stats["tier_1"],
+                         {"calls": 1, "accepted": 1, "escalated": 0, "invalid": 0, "cost": 1.0})
+
+        # Invalid outputs of the last tier are returned, but not counted as accepted
+        self.assertEqual(cascade.run(send, lambda completion: None), "c")
+        self.assertEqual(cascade.stats["tier_1"],
+                         {"calls": 2, "accepted": 1, "escalated": 0, "invalid": 1, "cost": 2.0})
+
+        with self.assertRaises(ValueError):
+            ModelCascade([object()])
+        with self.assertRaises(ValueError):
+            ModelCascade([object(), object()], min_agreement=0)
+
+    def test_annotation_with_model_cascade(self):
+        unlabeled_dataset = Dataset.from_dict({"text": ["great", "awful", "odd", "meh"]})
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews with {}.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+        )
+        cheap = LabelPromptNode({
+            "great": ["Positive."], "awful": ["neutral"], "odd": ["positive", "negative"], "meh": ["neutral"]
+        })
+        strong = LabelPromptNode({"great": ["positive"], "awful": ["negative"], "odd": ["negative"], "meh": ["meh"]})
+        cascade = ModelCascade([cheap, strong], costs_per_call=[1.0, 10.0], names=["cheap", "strong"],
+                               samples_per_call=2)
+        generator = DatasetGenerator(cheap)
+
+        generated_dataset = generator.generate(
+            prompt_template=prompt,
+            unlabeled_dataset=unlabeled_dataset,
+            max_prompt_calls=4,
+            generation_config=GenerationConfig(model_cascade=cascade),
+        )
+
+        # "awful" is no label and "odd" has disagreeing samples, so both are escalated. Accepted rows hold the label
+        # the output was matched to. The strong tier has no label for "meh", so its row is invalid.
+        self.assertEqual(generated_dataset["label"], ["positive", "negative", "negative"])
+        self.assertEqual(generator.run_summary["invalid_rows"], 1)
+        self.assertEqual((cheap.calls, strong.calls), (4, 3))
+        self.assertEqual(generator.run_summary["cascade"]["cheap"],
+                         {"calls": 4, "accepted": 1, "escalated": 3, "invalid": 0, "cost": 4.0})
+        self.assertEqual(generator.run_summary["cascade"]["strong"],
+                         {"calls": 3, "accepted": 2, "escalated": 0, "invalid": 1, "cost": 30.0})
+
+        with self.assertRaises(ValueError):
+            generator.generate(prompt_template=prompt, max_prompt_calls=3,
+                               generation_config=GenerationConfig(model_cascade=cascade))
+        with self.assertRaises(ValueError):
+            generator.generate(prompt_template=prompt, unlabeled_dataset=unlabeled_dataset,
+                               generation_config=GenerationConfig(model_cascade=cascade, completions_per_call=2))
@@ -1,8 +1,15 @@
+import json
+import tempfile
 import unittest
+from pathlib import Path
+from types import SimpleNamespace
 
-from datasets import Dataset, load_dataset
+from datasets import ClassLabel, Dataset, Value, load_dataset, load_from_disk
+from haystack.nodes.prompt.invocation_layer import OpenAIInvocationLayer
 
-from fabricator import DatasetGenerator
+from fabricator import (
+    DatasetGenerator, GenerationConfig, LocalBatchExecutor, ModelCascade, RequestHedger, StopStreaming
+)
 from fabricator.prompts import BasePrompt
 from fabricator.dataset_transformations.text_classification import convert_label_ids_to_texts
 
@@ -314,3 +321,596 @@ class TestDatasetGenerator(unittest.TestCase):
         self.assertIn("text", generated_dataset.features)
         self.assertEqual(generated_dataset[0]["text"], "This is a dummy movie review as a string.")
         self.assertEqual(generated_dataset[1]["text"], "This is a dummy movie review as a string.")
+
+    def test_generation_is_memory_mapped(self):
+        """Test that generated rows are written to an Arrow file and the result is memory-mapped."""
+        prompt = BasePrompt(
+            task_description="Generate a {} movie review.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="text",
+        )
+
+        generated_dataset = self.generator.generate(
+            fewshot_dataset=self.text_classification_dataset,
+            fewshot_examples_per_class=1,
+            fewshot_sampling_strategy="uniform",
+            fewshot_sampling_column="label",
+            prompt_template=prompt,
+            max_prompt_calls=3,
+            dummy_response="A dummy movie review.",
+        )
+
+        self.assertEqual(len(generated_dataset), 3)
+        self.assertEqual(len(generated_dataset.cache_files), 1)
+        self.assertEqual(generated_dataset.features["label"].dtype, "string")
+        self.assertIn(generated_dataset[0]["label"], ["positive", "negative"])
+
+    def test_generation_to_output_dir(self):
+        """Test that generated rows are written to rolling shards in the output directory."""
+        prompt = BasePrompt(
+            task_description="Generate a short movie review.",
+        )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            generated_dataset = self.generator.generate(
+                prompt_template=prompt,
+                max_prompt_calls=5,
+                num_samples_to_generate=5,
+                dummy_response="A dummy movie review.",
+                generation_config=GenerationConfig(output_dir=tmp_dir, rows_per_shard=2),
+            )
+
+            self.assertEqual(len(generated_dataset), 5)
+            self.assertEqual(len(list(Path(tmp_dir).glob("data-*.arrow"))), 3)
+            self.assertEqual(load_from_disk(tmp_dir)["text"], ["A dummy movie review."] * 5)
+
+    def test_annotation_references_unlabeled_examples(self):
+        """Test that passthrough columns and returned unlabeled rows are selected from the unlabeled dataset."""
+        unlabeled_dataset = Dataset.from_dict({
+            "text": ["This movie was a blast!", "This movie was not bad!", "This movie was boring."],
+            "id": [7, 8, 9],
+        })
+
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews as either: {}.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+        )
+
+        generated_dataset, original_dataset = self.generator.generate(
+            prompt_template=prompt,
+            unlabeled_dataset=unlabeled_dataset,
+            return_unlabeled_dataset=True,
+            max_prompt_calls=2,
+            dummy_response="positive",
+        )
+
+        self.assertEqual(generated_dataset.column_names, ["text", "label"])
+        self.assertEqual(generated_dataset["text"], unlabeled_dataset["text"][:2])
+        self.assertEqual(generated_dataset["label"], ["positive", "positive"])
+        self.assertEqual(original_dataset.to_dict(), unlabeled_dataset.select(range(2)).to_dict())
+
+    def test_annotation_skips_invalid_unlabeled_examples(self):
+        """Test that unlabeled examples with invalid predictions are left out of both returned datasets."""
+        unlabeled_dataset = Dataset.from_dict({
+            "text": ["This movie was a blast!", "This movie was not bad!", "This movie was boring."],
+            "id": [7, 8, 9],
+        })
+
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews as either: {}.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+            constrain_to_label_options=True,
+        )
+        responses = iter(["positive", "maybe", "negative"])
+
+        generated_dataset, original_dataset = self.generator.generate(
+            prompt_template=prompt,
+            unlabeled_dataset=unlabeled_dataset,
+            return_unlabeled_dataset=True,
+            max_prompt_calls=3,
+            dummy_response=lambda _: next(responses),
+        )
+
+        self.assertEqual(generated_dataset["text"], [unlabeled_dataset["text"][0], unlabeled_dataset["text"][2]])
+        self.assertEqual(generated_dataset["label"], ["positive", "negative"])
+        self.assertEqual(original_dataset["id"], [7, 9])
+
+    def test_annotation_is_not_limited_by_num_samples_to_generate(self):
+        """Test that all unlabeled examples up to max_prompt_calls are annotated with the default arguments."""
+        unlabeled_dataset = Dataset.from_dict({"text": [f"review {idx}" for idx in range(30)]})
+
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews as either: {}.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+        )
+
+        generated_dataset = self.generator.generate(
+            prompt_template=prompt,
+            unlabeled_dataset=unlabeled_dataset,
+            max_prompt_calls=30,
+            dummy_response="positive",
+        )
+
+        self.assertEqual(len(generated_dataset), 30)
+        self.assertEqual(generated_dataset["text"], unlabeled_dataset["text"])
+
+    def test_prefetch_unlabeled_examples(self):
+        """Test that unlabeled examples are read in batches restricted to the fewshot example columns."""
+        unlabeled_dataset = Dataset.from_dict({
+            "id": list(range(5)),
+            "text": [f"review {idx}" for idx in range(5)],
+            "question": [f"question {idx}" for idx in range(5)],
+        })
+
+        examples = list(self.generator._iter_unlabeled_examples(unlabeled_dataset, ["question", "text"], 2))
+
+        self.assertEqual(len(examples), 5)
+        self.assertEqual(examples[3], {"text": "review 3", "question": "question 3"})
+
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews as either: {}.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+        )
+
+        generated_dataset = self.generator.generate(
+            prompt_template=prompt,
+            unlabeled_dataset=unlabeled_dataset,
+            max_prompt_calls=5,
+            num_samples_to_generate=5,
+            dummy_response="positive",
+            generation_config=GenerationConfig(prefetch_batch_size=2),
+        )
+
+        self.assertEqual(generated_dataset["text"], unlabeled_dataset["text"])
+
+    def test_annotation_with_shared_fewshot_prefix(self):
+        """Test that groups of consecutive unlabeled examples share the sampled fewshot examples."""
+        fewshot_dataset = Dataset.from_dict({
+            "text": [f"review {idx}" for idx in range(10)],
+            "label": ["positive", "negative"] * 5,
+        })
+        unlabeled_dataset = Dataset.from_dict({"text": [f"new review {idx}" for idx in range(7)]})
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews as either: {}.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+        )
+        prompts = []
+
+        def dummy_response(prompt_text):
+            prompts.append(prompt_text)
+            return "positive"
+
+        generated_dataset = self.generator.generate(
+            prompt_template=prompt,
+            fewshot_dataset=fewshot_dataset,
+            fewshot_sampling_strategy="stratified",
+            fewshot_examples_per_class=2,
+            unlabeled_dataset=unlabeled_dataset,
+            max_prompt_calls=7,
+            num_samples_to_generate=7,
+            dummy_response=dummy_response,
+            generation_config=GenerationConfig(fewshot_group_size=3),
+        )
+
+        self.assertEqual(generated_dataset["text"], unlabeled_dataset["text"])
+        prefixes = [prompt.split_prompt_text(prompt_text)[0] for prompt_text in prompts]
+        self.assertEqual(len(set(prefixes[:3])), 1)
+        self.assertEqual(len(set(prefixes[3:6])), 1)
+
+        with self.assertRaises(ValueError):
+            self.generator.generate(prompt_template=prompt, generation_config=GenerationConfig(fewshot_group_size=3))
+
+    def test_generation_length_is_limited(self):
+        """Test that the maximum length and stop sequences are derived from the prompt and passed to every call."""
+        unlabeled_dataset = Dataset.from_dict({"text": ["A good movie.", "Boring."]})
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews as either: {}.",
+            label_options=["positive", "very negative"],
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+        )
+        prompt_node = RecordingPromptNode(["positive"])
+
+        generated_dataset = DatasetGenerator(prompt_node).generate(
+            prompt_template=prompt,
+            unlabeled_dataset=unlabeled_dataset,
+            max_prompt_calls=2,
+            generation_config=GenerationConfig(limit_generation_length=True),
+        )
+
+        self.assertEqual(generated_dataset["label"], ["positive", "positive"])
+        # Without a tokenizer, characters are counted: 1.5 * len(" very negative")
+        self.assertEqual(prompt_node.generation_kwargs, [{"stop_words": ["\n\n"], "max_length": 21}] * 2)
+
+        # OpenAI models read max_tokens instead
+        prompt_node.prompt_model = SimpleNamespace(
+            model_invocation_layer=OpenAIInvocationLayer.__new__(OpenAIInvocationLayer)
+        )
+        generation_kwargs = DatasetGenerator(prompt_node)._derive_generation_kwargs(
+            prompt, None, use_label_options=True
+        )
+        self.assertEqual(generation_kwargs, {"stop_words": ["\n\n"], "max_tokens": 21})
+
+    def test_generation_kwargs_do_not_stick_to_prompt_node(self):
+        """Test that the kwargs of a call are removed from invocation layers that keep them."""
+        unlabeled_dataset = Dataset.from_dict({"text": ["A good movie."]})
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews as either: {}.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+        )
+        prompt_node = StickyKwargsPromptNode(["positive"])
+        generator = DatasetGenerator(prompt_node)
+
+        generator.generate(prompt_template=prompt, unlabeled_dataset=unlabeled_dataset, max_prompt_calls=1,
+                           generation_config=GenerationConfig(limit_generation_length=True))
+        generator.generate(prompt_template=prompt, unlabeled_dataset=unlabeled_dataset, max_prompt_calls=1)
+
+        self.assertIn("max_length", prompt_node.call_kwargs[0])
+        self.assertEqual(prompt_node.call_kwargs[1], {"temperature": 0.5})
+        self.assertEqual(prompt_node.prompt_model.model_invocation_layer.model_input_kwargs, {"temperature": 0.5})
+
+    def test_streamed_call_does_not_stick_to_prompt_node(self):
+        """Test that a plain call after a streamed call on the same prompt node does not stream to the old handler."""
+        unlabeled_dataset = Dataset.from_dict({"text": ["A good movie."]})
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews as either: {}.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+            constrain_to_label_options=True,
+        )
+        prompt_node = StickyKwargsPromptNode(["posi", "tive", "\n\n", "text"])
+        generator = DatasetGenerator(prompt_node)
+
+        streamed_dataset = generator.generate(
+            prompt_template=prompt, unlabeled_dataset=unlabeled_dataset, max_prompt_calls=1,
+            generation_config=GenerationConfig(stream_predictions=True),
+        )
+        self.assertEqual(generator.run_summary["stopped_final"], 1)
+        plain_dataset = generator.generate(
+            prompt_template=prompt, unlabeled_dataset=unlabeled_dataset, max_prompt_calls=1
+        )
+
+        self.assertEqual(streamed_dataset["label"], ["positive"])
+        self.assertEqual(plain_dataset["label"], ["positive"])
+        self.assertIn("stream_handler", prompt_node.call_kwargs[0])
+        self.assertNotIn("stream_handler", prompt_node.call_kwargs[1])
+
+        # A StopStreaming raised without a stream handler of the generator counts as a failed call
+        def raise_stop_streaming(**kwargs):
+            raise StopStreaming()
+
+        self.assertIsNone(DatasetGenerator._run_prompt_node(
+            SimpleNamespace(run=raise_stop_streaming), "Annotate the review.", None, {}
+        ))
+
+    def test_streamed_predictions_stop_early(self):
+        """Test that streamed predictions are cancelled once they are final or invalid."""
+        unlabeled_dataset = Dataset.from_dict({"text": ["A good movie.", "Boring.", "Bad."]})
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews as either: {}.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+            constrain_to_label_options=True,
+        )
+        prompt_node = StreamingPromptNode([
+            ["pos", "itive", "\n\n", "text: ", "Another review."],
+            ["I", " think", " it is negative."],
+            ["negative"],
+        ])
+        generator = DatasetGenerator(prompt_node)
+
+        generated_dataset = generator.generate(
+            prompt_template=prompt,
+            unlabeled_dataset=unlabeled_dataset,
+            max_prompt_calls=3,
+            generation_config=GenerationConfig(stream_predictions=True),
+        )
+
+        self.assertEqual(generated_dataset["text"], ["A good movie.", "Bad."])
+        self.assertEqual(generated_dataset["label"], ["positive", "negative"])
+        self.assertEqual(prompt_node.delivered_tokens[:2], [["pos", "itive", "\n\n"], ["I"]])
+        self.assertEqual(generator.run_summary["stopped_final"], 1)
+        self.assertEqual(generator.run_summary["stopped_invalid"], 1)
+        self.assertEqual(generator.run_summary["invalid_rows"], 1)
+        self.assertIsNotNone(generator.run_summary["time_to_first_token"])
+
+        with self.assertRaises(ValueError):
+            generator.generate(
+                prompt_template=prompt,
+                generation_config=GenerationConfig(stream_predictions=True, completions_per_call=2),
+            )
+
+    def test_generation_of_multiple_columns(self):
+        """Test that several target columns are generated with a single prompt call per row."""
+        unlabeled_dataset = Dataset.from_dict({
+            "context": ["Faust was written by Goethe.", "Wilhelm Tell was written by Schiller."],
+        })
+
+        prompt = BasePrompt(
+            task_description="Generate a question and its answer for the context.",
+            generate_data_for_column=["question", "answer"],
+            fewshot_example_columns="context",
+        )
+
+        responses = iter(["Who wrote Faust?\nanswer: Goethe", "Who wrote Wilhelm Tell?"])
+        generated_dataset = self.generator.generate(
+            prompt_template=prompt,
+            unlabeled_dataset=unlabeled_dataset,
+            max_prompt_calls=2,
+            dummy_response=lambda _: next(responses),
+        )
+
+        # The second row misses its answer and is reported instead of kept
+        self.assertEqual(generated_dataset.column_names, ["context", "question", "answer"])
+        self.assertEqual(generated_dataset["question"], ["Who wrote Faust?"])
+        self.assertEqual(generated_dataset["answer"], ["Goethe"])
+        self.assertEqual(self.generator.run_summary["prompt_calls"], 2)
+        self.assertEqual(self.generator.run_summary["invalid_rows"], 1)
+        self.assertEqual(self.generator.run_summary["column_failures"], {"question": 0, "answer": 1})
+
+    def test_multiple_completions_per_call(self):
+        """Test that all completions of a prompt call become separate rows."""
+        prompt = BasePrompt(
+            task_description="Generate a {} movie review.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="text",
+        )
+
+        generated_dataset = self.generator.generate(
+            fewshot_dataset=self.text_classification_dataset,
+            fewshot_examples_per_class=1,
+            fewshot_sampling_strategy="uniform",
+            fewshot_sampling_column="label",
+            prompt_template=prompt,
+            max_prompt_calls=10,
+            num_samples_to_generate=5,
+            dummy_response=lambda prompt_text: prompt_text.split("\n")[0],
+            generation_config=GenerationConfig(completions_per_call=3),
+        )
+
+        self.assertEqual(len(generated_dataset), 5)
+        self.assertEqual(self.generator.run_summary["prompt_calls"], 2)
+        self.assertEqual(self.generator.run_summary["completions"], 6)
+        for example in generated_dataset:
+            self.assertEqual(example["text"], f"Generate a {example['label']} movie review.")
+
+        unlabeled_dataset = Dataset.from_dict({"text": ["This movie was a blast!", "This movie was not bad!"]})
+        annotation_prompt = BasePrompt(
+            task_description="Annotate movie reviews as either: {}.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+        )
+
+        generated_dataset, original_dataset = self.generator.generate(
+            prompt_template=annotation_prompt,
+            unlabeled_dataset=unlabeled_dataset,
+            return_unlabeled_dataset=True,
+            max_prompt_calls=2,
+            dummy_response="positive",
+            generation_config=GenerationConfig(completions_per_call=2),
+        )
+
+        self.assertEqual(generated_dataset["text"], [text for text in unlabeled_dataset["text"] for _ in range(2)])
+        self.assertEqual(original_dataset["text"], generated_dataset["text"])
+
+        with self.assertRaises(ValueError):
+            self.generator.generate(
+                prompt_template=prompt,
+                dummy_response="A review.",
+                generation_config=GenerationConfig(completions_per_call=0),
+            )
+
+    def test_generation_config_rejects_conflicting_options(self):
+        """Test that options which cannot be combined are rejected when the config is created."""
+        executor = LocalBatchExecutor(lambda prompts, **kwargs: [])
+        for options in [
+            {"max_concurrent_calls": 0},
+            {"stream_predictions": True, "batch_executor": executor},
+            {"request_hedger": RequestHedger(), "batch_executor": executor},
+            {"model_cascade": ModelCascade([None, None]), "stream_predictions": True},
+        ]:
+            with self.assertRaises(ValueError):
+                GenerationConfig(**options)
+
+        self.assertEqual(GenerationConfig().completions_per_call, 1)
+
+    def test_generation_with_label_quotas(self):
+        """Test that label quotas are met exactly and invalid outputs are scheduled again."""
+        prompt = BasePrompt(
+            task_description="Generate a {} movie review.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="text",
+        )
+
+        responses = iter(["", "A review."] + ["A review."] * 10)
+        generated_dataset = self.generator.generate(
+            fewshot_dataset=self.text_classification_dataset,
+            fewshot_examples_per_class=1,
+            fewshot_sampling_column="label",
+            prompt_template=prompt,
+            max_prompt_calls=20,
+            dummy_response=lambda _: next(responses),
+            generation_config=GenerationConfig(label_quotas={"positive": 3, "negative": 1}),
+        )
+
+        self.assertEqual(sorted(generated_dataset["label"]), ["negative", "positive", "positive", "positive"])
+        self.assertEqual(self.generator.run_summary["prompt_calls"], 5)
+        self.assertEqual(sum(self.generator.run_summary["label_failures"].values()), 1)
+
+        with self.assertRaises(ValueError):
+            self.generator.generate(
+                prompt_template=prompt,
+                dummy_response="A review.",
+                generation_config=GenerationConfig(label_quotas={"neutral": 1}),
+            )
+
+    def test_annotation_is_decoded_to_label_options(self):
+        """Test that annotations are normalized to the label options and cast to the declared features."""
+        unlabeled_dataset = Dataset.from_dict({
+            "text": ["This movie was a blast!", "Not bad.", "Boring.", "Meh.", "Great!"],
+            "label": [0, 0, 0, 0, 0],
+        }).cast_column("label", ClassLabel(names=["negative", "positive"]))
+
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews as either: {}.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+            constrain_to_label_options=True,
+            fuzzy_matching_cutoff=0.8,
+        )
+
+        responses = iter(["Positive.", " the label is negative", "I am not sure.", "positiv", "positive or negative"])
+        generated_dataset = self.generator.generate(
+            prompt_template=prompt,
+            unlabeled_dataset=unlabeled_dataset,
+            max_prompt_calls=5,
+            dummy_response=lambda _: next(responses),
+        )
+
+        self.assertEqual(generated_dataset.features["label"], unlabeled_dataset.features["label"])
+        self.assertEqual(generated_dataset["text"], ["This movie was a blast!", "Not bad.", "Meh."])
+        self.assertEqual(generated_dataset["label"], [1, 0, 1])
+        self.assertEqual(self.generator.run_summary["invalid_rows"], 2)
+
+    def test_annotation_keeps_strings_for_other_class_labels(self):
+        """Test that a ClassLabel of the unlabeled examples is only used if its names are the label options."""
+        unlabeled_dataset = Dataset.from_dict({
+            "text": ["This movie was a blast!", "Boring."],
+            "label": [0, 0],
+        }).cast_column("label", ClassLabel(names=["neg", "pos"]))
+
+        for constrain_to_label_options in (False, True):
+            prompt = BasePrompt(
+                task_description="Annotate movie reviews as either: {}.",
+                label_options=["negative", "positive"],
+                generate_data_for_column="label",
+                fewshot_example_columns="text",
+                constrain_to_label_options=constrain_to_label_options,
+            )
+            responses = iter(["positive", "negative"])
+            generated_dataset = self.generator.generate(
+                prompt_template=prompt,
+                unlabeled_dataset=unlabeled_dataset,
+                max_prompt_calls=2,
+                dummy_response=lambda _: next(responses),
+            )
+
+            self.assertEqual(generated_dataset.features["label"], Value("string"))
+            self.assertEqual(generated_dataset["label"], ["positive", "negative"])
+            self.assertEqual(self.generator.run_summary["invalid_rows"], 0)
+
+    def test_repair_invalid_rows(self):
+        """Test that only invalid rows of a run are queried again and merged into the dataset."""
+        unlabeled_dataset = Dataset.from_dict({
+            "text": ["This movie was a blast!", "Not bad.", "Boring.", "Great!"],
+        })
+
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews as either: {}.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+            constrain_to_label_options=True,
+        )
+
+        responses = iter(["positive", "I don't know.", "positive", "positive"])
+        generated_dataset = self.generator.generate(
+            prompt_template=prompt,
+            unlabeled_dataset=unlabeled_dataset,
+            max_prompt_calls=4,
+            dummy_response=lambda _: next(responses),
+        )
+        self.assertEqual(generated_dataset["text"], ["This movie was a blast!", "Boring.", "Great!"])
+
+        def validator(row):
+            return row["text"] != "Boring." or row["label"] == "negative"
+
+        repaired_dataset = self.generator.repair(
+            self.generator.run_summary["log_file"],
+            prompt,
+            generated_dataset,
+            validator=validator,
+            dummy_response="negative",
+        )
+
+        self.assertEqual(self.generator.run_summary["rows_to_repair"], 2)
+        self.assertEqual(self.generator.run_summary["prompt_calls"], 2)
+        self.assertEqual(self.generator.run_summary["repaired_rows"], 2)
+        self.assertEqual(repaired_dataset["text"], unlabeled_dataset["text"])
+        self.assertEqual(repaired_dataset["label"], ["positive", "negative", "negative", "positive"])
+
+        with open(self.generator.run_summary["log_file"], encoding="utf-8") as log_file:
+            log_entries = [json.loads(line) for line in log_file]
+        self.assertTrue(all(entry["valid"] for entry in log_entries))
+        self.assertEqual([entry["row_idx"] for entry in log_entries], [0, 1, 2, 3])
+
+
+class RecordingPromptNode:
+    """Prompt node that returns fixed results and records the generation kwargs of every call."""
+
+    def __init__(self, results):
+        self.results = results
+        self.generation_kwargs = []
+
+    def run(self, prompt_template=None, invocation_context=None, generation_kwargs=None):
+        self.generation_kwargs.append(generation_kwargs)
+        return {"results": self.results}, "output_1"
+
+
+class StreamingPromptNode:
+    """Prompt node that streams fixed tokens per call to the stream handler and records the delivered tokens."""
+
+    def __init__(self, streams):
+        self.streams = iter(streams)
+        self.delivered_tokens = []
+
+    def run(self, prompt_template=None, invocation_context=None, generation_kwargs=None):
+        tokens = next(self.streams)
+        self.delivered_tokens.append([])
+        for token in tokens:
+            self.delivered_tokens[-1].append(token)
+            generation_kwargs["stream_handler"](token)
+        return {"results": ["".join(tokens)]}, "output_1"
+
+
+class KwargsInvocationLayer:
+    """Invocation layer with model input kwargs, like the haystack layers of hosted models."""
+
+    def __init__(self, model_input_kwargs):
+        self.model_input_kwargs = model_input_kwargs
+
+
+class StickyKwargsPromptNode:
+    """Prompt node whose invocation layer keeps the generation kwargs of every call, like the OpenAI layer, and
+    records the kwargs each call ran with."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.prompt_model = SimpleNamespace(model_invocation_layer=KwargsInvocationLayer({"temperature": 0.5}))
+        self.call_kwargs = []
+
+    def run(self, prompt_template=None, invocation_context=None, generation_kwargs=None):
+        model_input_kwargs = self.prompt_model.model_invocation_layer.model_input_kwargs
+        model_input_kwargs.update(generation_kwargs or {})
+        self.call_kwargs.append(dict(model_input_kwargs))
+        stream_handler = model_input_kwargs.get("stream_handler")
+        for token in self.tokens:
+            if stream_handler is not None:
+                stream_handler(token)
+        return {"results": ["".join(self.tokens)]}, "output_1"
@@ -1,10 +1,11 @@
+import random
 import unittest
 
 from collections import Counter
-from datasets import load_dataset
+from datasets import Dataset, load_dataset
 
 from fabricator.samplers import random_sampler, single_label_task_sampler, ml_mc_sampler, \
-    single_label_stratified_sample
+    single_label_stratified_sample, interleave_class_indices, LabelQuotaScheduler
 
 
 def _flatten(l):
@@ -70,3 +71,120 @@ class TestStratifiedSampler(unittest.TestCase):
 
         for occurences in Counter(subset_dataset["coarse_label"]).values():
             self.assertEqual(occurences, 2)
+
+
+class TestUnusedSplit(unittest.TestCase):
+
+    def setUp(self) -> None:
+        """Create in-memory dataset"""
+        self.dataset = Dataset.from_dict({
+            "text": [f"text {idx}" for idx in range(20)],
+            "label": ["positive", "negative", "neutral", "negative"] * 5,
+        }).class_encode_column("label")
+
+    def test_stratified_sampler_unused_split(self):
+        """Test that sampled and unused split partition the dataset and keep the row order of the unused split"""
+        subset_dataset, unused_dataset = single_label_stratified_sample(
+            self.dataset, label_column="label", num_examples_per_class=2, return_unused_split=True
+        )
+        self.assertEqual(len(subset_dataset), 6)
+        self.assertEqual(len(unused_dataset), 14)
+        self.assertEqual(set(subset_dataset["text"]) | set(unused_dataset["text"]), set(self.dataset["text"]))
+        self.assertEqual(set(subset_dataset["text"]) & set(unused_dataset["text"]), set())
+        unused_ids = [int(text.split(" ")[1]) for text in unused_dataset["text"]]
+        self.assertEqual(unused_ids, sorted(unused_ids))
+
+    def test_stratified_sampler_with_missing_labels(self):
+        """Test that rows without a label are sampled as a class of their own"""
+        dataset = Dataset.from_dict({
+            "text": [f"text {idx}" for idx in range(6)],
+            "label": ["a", None, "b", "a", None, "b"],
+        })
+        subset_dataset = single_label_stratified_sample(dataset, label_column="label", num_examples_per_class=1)
+        self.assertCountEqual(subset_dataset["label"], ["a", None, "b"])
+        self.assertEqual(list(interleave_class_indices(dataset["label"])), [0, 1, 2, 3, 4, 5])
+
+    def test_stratified_sampler_shuffles_rows_within_classes(self):
+        """Test that the rows of each class are sampled in random order that follows the seed"""
+        dataset = Dataset.from_dict({"text": [f"text {idx}" for idx in range(40)], "label": ["a", "b"] * 20})
+
+        random.seed(0)
+        subset_dataset = single_label_stratified_sample(dataset, label_column="label", num_examples_per_class=20)
+        random.seed(0)
+        repeated_dataset = single_label_stratified_sample(dataset, label_column="label", num_examples_per_class=20)
+
+        self.assertEqual(subset_dataset["label"], ["a", "b"] * 20)
+        sampled_ids = [int(text.split(" ")[1]) for text in subset_dataset["text"]]
+        self.assertNotEqual(sampled_ids, list(range(40)))
+        self.assertEqual(sorted(sampled_ids), list(range(40)))
+        self.assertEqual(subset_dataset["text"], repeated_dataset["text"])
+
+    def test_single_label_task_sampler_unused_split(self):
+        """Test single label task sampler with unused split"""
+        subset_dataset, unused_dataset = single_label_task_sampler(
+            self.dataset, label_column="label", num_examples=5, return_unused_split=True
+        )
+        self.assertEqual(len(subset_dataset), 5)
+        self.assertEqual(len(unused_dataset), 15)
+        self.assertEqual(len(set(subset_dataset["label"])), 3)
+        self.assertEqual(set(subset_dataset["text"]) & set(unused_dataset["text"]), set())
+
+    def test_interleave_class_indices(self):
+        """Test round-robin order over classes in order of their first occurrence"""
+        labels = ["b", "b", "a", "c", "a", "b", "b"]
+        self.assertEqual(list(interleave_class_indices(labels)), [0, 2, 3, 1, 4, 5, 6])
+        self.assertEqual(len(interleave_class_indices([])), 0)
+
+
+class TestLabelQuotaScheduler(unittest.TestCase):
+    """Testcase for the label quota scheduler"""
+
+    def test_distribution_to_exact_counts(self):
+        scheduler = LabelQuotaScheduler({"positive": 0.25, "negative": 0.5, "neutral": 0.25}, num_samples=10)
+        self.assertEqual(scheduler.total, 10)
+        self.assertEqual(scheduler.quotas["negative"], 5)
+        self.assertEqual(sorted([scheduler.quotas["positive"], scheduler.quotas["neutral"]]), [2, 3])
+
+        with self.assertRaises(ValueError):
+            LabelQuotaScheduler({"positive": 0.5, "negative": 0.5})
+
+    def test_schedule_until_quotas_are_met(self):
+        scheduler = LabelQuotaScheduler({"positive": 2, "negative": 1})
+        labels = []
+        while not scheduler.done:
+            label = scheduler.next_label()
+            labels.append(label)
+            # The first output for negative fails and is scheduled again
+            scheduler.record(label, success=label != "negative" or scheduler.failures["negative"] > 0)
+
+        self.assertEqual(Counter(labels), Counter({"positive": 2, "negative": 2}))
+        self.assertEqual(scheduler.counts, {"positive": 2, "negative": 1})
+        self.assertIsNone(scheduler.next_label())
+
+    def test_give_up_failing_label(self):
+        scheduler = LabelQuotaScheduler({"positive": 1, "negative": 1}, max_failures_per_label=2)
+        scheduler.record("positive")
+        scheduler.record("negative", success=False)
+        self.assertEqual(scheduler.next_label(), "negative")
+        scheduler.record("negative", success=False)
+        self.assertTrue(scheduler.done)
+        self.assertEqual(scheduler.abandoned_labels, ["negative"])
+
+    def test_reserve_labels_of_concurrent_calls(self):
+        scheduler = LabelQuotaScheduler({"positive": 2, "negative": 1})
+        reservations = []
+        for _ in range(3):
+            label = scheduler.next_label()
+            reservations.append((label, scheduler.reserve(label)))
+
+        # All missing rows are reserved by calls in flight
+        self.assertEqual(Counter(label for label, _ in reservations), Counter({"positive": 2, "negative": 1}))
+        self.assertIsNone(scheduler.next_label())
+        self.assertFalse(scheduler.done)
+
+        # A failed call releases its label, which is scheduled again
+        label, num_rows = reservations.pop()
+        scheduler.release(label, num_rows)
+        scheduler.record(label, success=False)
+        self.assertEqual(scheduler.next_label(), label)
+        self.assertEqual(scheduler.reserve(label, num_rows=2), 1)
@@ -1,11 +1,12 @@
 import unittest
 
-from datasets import load_dataset
+from datasets import ClassLabel, Dataset, DatasetDict, Features, IterableDataset, Sequence, Value, load_dataset
 
 from fabricator.prompts import BasePrompt
 from fabricator.dataset_transformations.question_answering import *
 from fabricator.dataset_transformations.text_classification import *
 from fabricator.dataset_transformations.token_classification import *
+from fabricator.dataset_transformations import TransformationPipeline
 
 
 class TestTransformationsTextClassification(unittest.TestCase):
@@ -79,6 +80,45 @@ class TestTransformationsTextClassification(unittest.TestCase):
             dataset, label_options = convert_label_ids_to_texts("coarse_label", "dataset")
 
 
+class TestTransformationsTextClassificationInMemory(unittest.TestCase):
+    """Testcase for label transformations on an in-memory dataset"""
+
+    def setUp(self) -> None:
+        self.dataset = Dataset.from_dict(
+            {"text": ["a", "b", "c", "d"], "label": [0, 1, -1, 2]},
+            features=Features({"text": Value("string"), "label": ClassLabel(names=["neg", "neu", "pos"])}),
+        )
+
+    def test_label_ids_to_texts_and_back(self):
+        """Test Arrow conversion of label ids to texts and back on a selection of rows"""
+        dataset = convert_label_ids_to_texts(self.dataset.select([3, 2, 0]), "label")
+        self.assertEqual(dataset["label"], ["pos", None, "neg"])
+        self.assertEqual(dataset["text"], ["d", "c", "a"])
+        dataset = convert_texts_to_label_ids(dataset, "label", ["neg", "neu", "pos"])
+        self.assertEqual(dataset["label"], [2, -1, 0])
+        self.assertEqual(dataset.features["label"].names, ["neg", "neu", "pos"])
+
+    def test_label_ids_to_texts_keeps_other_columns(self):
+        """Test that the other columns are not rewritten if the dataset has no indices mapping"""
+        dataset = convert_label_ids_to_texts(self.dataset, "label")
+        self.assertEqual(dataset["label"], ["neg", "neu", None, "pos"])
+        self.assertEqual(
+            dataset.data.column("text").chunks[0].buffers()[2].address,
+            self.dataset.data.column("text").chunks[0].buffers()[2].address,
+        )
+
+    def test_multi_label_ids_to_texts_and_back(self):
+        """Test batched conversion of sequences of label ids"""
+        dataset = Dataset.from_dict(
+            {"labels": [[0, 2], [1]]},
+            features=Features({"labels": Sequence(ClassLabel(names=["neg", "neu", "pos"]))}),
+        )
+        dataset = convert_label_ids_to_texts(DatasetDict({"train": dataset}), "labels")
+        self.assertEqual(dataset["train"]["labels"], [["neg", "pos"], ["neu"]])
+        dataset = convert_texts_to_label_ids(dataset, "labels", {0: "neg", 1: "neu", 2: "pos"})
+        self.assertEqual(dataset["train"]["labels"], [[0, 2], [1]])
+
+
 class TestTransformationsTokenClassification(unittest.TestCase):
     """Testcase for TokenLabelTransformations"""
 
@@ -185,6 +225,43 @@ class TestTransformationsTokenClassification(unittest.TestCase):
             )
 
 
+class TestTransformationsTokenClassificationInMemory(unittest.TestCase):
+    """Testcase for TokenLabelTransformations on an in-memory dataset"""
+
+    def setUp(self) -> None:
+        self.dataset = Dataset.from_dict(
+            {
+                "tokens": [["EU", "rejects", "German", "call"], ["Peter", "Blackburn"], []],
+                "ner_tags": [[3, 0, 7, 0], [1, 2], []],
+            },
+            features=Features({
+                "tokens": Sequence(Value("string")),
+                "ner_tags": Sequence(ClassLabel(
+                    names=["O", "B-PER", "I-PER", "B-ORG", "I-ORG", "B-LOC", "I-LOC", "B-MISC", "I-MISC"]
+                )),
+            }),
+        )
+
+    def test_bio_tokens_to_spans_multiprocess(self):
+        """Test batched conversion with multiple processes"""
+        dataset, label_options = convert_token_labels_to_spans(
+            self.dataset, "tokens", "ner_tags", return_label_options=True, num_proc=2
+        )
+        self.assertEqual(label_options, ["PER", "ORG", "LOC", "MISC"])
+        self.assertEqual(dataset["ner_tags"], [
+            "EU is ORG entity.\nGerman is MISC entity.", "Peter Blackburn is PER entity.", ""
+        ])
+        self.assertEqual(dataset["tokens"], ["EU rejects German call", "Peter Blackburn", ""])
+
+    def test_spans_to_bio_token_labels(self):
+        """Test that multi-token spans are decoded with B- and I- tags"""
+        id2label = dict(enumerate(self.dataset.features["ner_tags"].feature.names))
+        dataset = convert_token_labels_to_spans(self.dataset, "tokens", "ner_tags")
+        dataset = convert_spans_to_token_labels(dataset, "tokens", "ner_tags", id2label=id2label, num_proc=2)
+        self.assertEqual(dataset["ner_tags"], [[3, 0, 7, 0], [1, 2], [0]])
+        self.assertEqual(dataset["tokens"][1], ["Peter", "Blackburn"])
+
+
 class TestTransformationsQuestionAnswering(unittest.TestCase):
     """Testcase for QA Transformations"""
 
@@ -205,3 +282,124 @@ class TestTransformationsQuestionAnswering(unittest.TestCase):
         dataset = postprocess_squad_format(dataset)
         self.assertEqual(type(dataset[0]["answers"]), dict)
         self.assertIn("answer_start", dataset[0]["answers"])
+
+
+class TestTransformationsQuestionAnsweringInMemory(unittest.TestCase):
+    """Testcase for QA Transformations on an in-memory dataset"""
+
+    def setUp(self) -> None:
+        self.dataset = Dataset.from_dict({
+            "context": ["The Eiffel Tower is in Paris.", "Berlin or Berlin?", "No answer here."],
+            "question": ["Where is the Eiffel Tower?", "Which city?", "What?"],
+            "answers": [
+                {"text": ["paris"], "answer_start": [23]},
+                {"text": ["Berlin"], "answer_start": [0]},
+                {"text": [], "answer_start": []},
+            ],
+        })
+
+    def test_squad_roundtrip_multiprocess(self):
+        """Test fused pre- and postprocessing with multiple processes"""
+        dataset = preprocess_squad_format(self.dataset, num_proc=2)
+        self.assertEqual(dataset["answers"], ["paris", "Berlin", ""])
+        dataset = postprocess_squad_format(dataset, num_proc=2)
+        self.assertEqual(dataset[0]["answers"], {"text": ["Paris"], "answer_start": [23]})
+        self.assertEqual(dataset[1]["answers"]["answer_start"], [-1])
+        self.assertNotIn("answer_start", dataset.column_names)
+
+
+class TestTransformationPipeline(unittest.TestCase):
+    """Testcase for the lazy transformation pipeline"""
+
+    def setUp(self) -> None:
+        self.dataset = Dataset.from_dict(
+            {
+                "tokens": [["EU", "rejects", "German", "call"], ["Peter", "Blackburn"]],
+                "ner_tags": [[3, 0, 7, 0], [1, 2]],
+            },
+            features=Features({
+                "tokens": Sequence(Value("string")),
+                "ner_tags": Sequence(ClassLabel(
+                    names=["O", "B-PER", "I-PER", "B-ORG", "I-ORG", "B-LOC", "I-LOC", "B-MISC", "I-MISC"]
+                )),
+            }),
+        )
+        self.id2label = dict(enumerate(self.dataset.features["ner_tags"].feature.names))
+
+    def test_pipeline_matches_single_transformations(self):
+        """Test that fused steps give the same result as applying the transformations one by one"""
+        pipeline = TransformationPipeline().convert_token_labels_to_spans("tokens", "ner_tags")
+        dataset, label_options = pipeline.apply(self.dataset, return_label_options=True)
+        expected, expected_label_options = convert_token_labels_to_spans(
+            self.dataset, "tokens", "ner_tags", return_label_options=True
+        )
+        self.assertEqual(dataset[:], expected[:])
+        self.assertEqual(label_options, expected_label_options)
+
+        roundtrip = pipeline.convert_spans_to_token_labels("tokens", "ner_tags", self.id2label)(self.dataset)
+        self.assertEqual(roundtrip["ner_tags"], self.dataset["ner_tags"])
+        self.assertEqual(len(pipeline), 2)
+
+    def test_pipeline_fingerprint_is_deterministic(self):
+        """Test that identical pipelines produce identical fingerprints and different pipelines do not"""
+        first = TransformationPipeline().convert_token_labels_to_spans("tokens", "ner_tags")
+        second = TransformationPipeline().convert_token_labels_to_spans("tokens", "ner_tags")
+        self.assertEqual(first.fingerprint(self.dataset), second.fingerprint(self.dataset))
+        self.assertEqual(first.apply(self.dataset)._fingerprint, first.fingerprint(self.dataset))
+        second.convert_spans_to_token_labels("tokens", "ner_tags", self.id2label)
+        self.assertNotEqual(first.fingerprint(self.dataset), second.fingerprint(self.dataset))
+
+    def test_squad_pipeline(self):
+        """Test fused SQuAD pre- and postprocessing"""
+        dataset = Dataset.from_dict({
+            "context": ["The Eiffel Tower is in Paris."],
+            "question": ["Where is the Eiffel Tower?"],
+            "answers": [{"text": ["paris"], "answer_start": [23]}],
+        })
+        pipeline = TransformationPipeline().preprocess_squad_format().postprocess_squad_format()
+        dataset = pipeline.apply(dataset, num_proc=1)
+        self.assertEqual(dataset[0]["answers"], {"text": ["Paris"], "answer_start": [23]})
+
+
+class TestTransformationsStreaming(unittest.TestCase):
+    """Testcase for transformations on streamed datasets"""
+
+    def setUp(self) -> None:
+        self.ner_dataset = Dataset.from_dict(
+            {"tokens": [["Peter", "Blackburn", "visits", "Berlin"]], "ner_tags": [[1, 2, 0, 3]]},
+            features=Features({
+                "tokens": Sequence(Value("string")),
+                "ner_tags": Sequence(ClassLabel(names=["O", "B-PER", "I-PER", "B-LOC", "I-LOC"])),
+            }),
+        )
+        self.classification_dataset = Dataset.from_dict(
+            {"text": ["a", "b"], "label": [1, 0]},
+            features=Features({"text": Value("string"), "label": ClassLabel(names=["neg", "pos"])}),
+        )
+
+    def test_streamed_label_ids_to_texts_and_back(self):
+        """Test label conversion of a streamed dataset without scanning it"""
+        streamed_dataset = self.classification_dataset.to_iterable_dataset()
+        dataset, label_options = convert_label_ids_to_texts(streamed_dataset, "label", return_label_options=True)
+        self.assertIsInstance(dataset, IterableDataset)
+        self.assertEqual(label_options, ["neg", "pos"])
+        self.assertEqual([example["label"] for example in dataset], ["pos", "neg"])
+        dataset = convert_texts_to_label_ids(dataset, "label", label_options)
+        self.assertEqual([example["label"] for example in dataset], [1, 0])
+
+    def test_streamed_pipeline(self):
+        """Test token classification transformations on a streamed dataset"""
+        id2label = dict(enumerate(self.ner_dataset.features["ner_tags"].feature.names))
+        pipeline = TransformationPipeline().convert_token_labels_to_spans("tokens", "ner_tags")
+        dataset = pipeline.apply(self.ner_dataset.to_iterable_dataset())
+        self.assertEqual(
+            next(iter(dataset))["ner_tags"], "Peter Blackburn is PER entity.\nBerlin is LOC entity."
+        )
+        dataset = convert_spans_to_token_labels(dataset, "tokens", "ner_tags", id2label)
+        self.assertEqual(next(iter(dataset))["ner_tags"], [1, 2, 0, 3])
+
+    def test_streamed_dataset_without_features(self):
+        """Test that streamed datasets without features raise an error"""
+        streamed_dataset = IterableDataset.from_generator(lambda: iter([{"answers": {"text": ["a"]}}]))
+        with self.assertRaises(ValueError):
+            preprocess_squad_format(streamed_dataset)
@@ -0,0 +1,58 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from datasets import ClassLabel, Dataset, Features, Value, load_from_disk
+
+from fabricator.dataset_writer import DatasetWriter, ShardedDatasetWriter
+
+
+class TestDatasetWriter(unittest.TestCase):
+    """Testcase for the Arrow writer of generated rows"""
+
+    def test_write_record_batches(self):
+        features = Features({"text": Value("string"), "label": ClassLabel(names=["negative", "positive"])})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            writer = DatasetWriter(Path(tmp_dir) / "generated.arrow", features, writer_batch_size=2)
+            for idx in range(5):
+                writer.add({"text": f"review {idx}", "label": idx % 2})
+            writer.add({"text": "review without label"})
+            self.assertEqual(len(writer), 6)
+
+            dataset = writer.finalize()
+
+            self.assertEqual(dataset.features, features)
+            self.assertEqual(dataset["label"], [0, 1, 0, 1, 0, None])
+            self.assertEqual(dataset[5]["text"], "review without label")
+
+    def test_write_rolling_shards(self):
+        features = Features({"text": Value("string"), "label": ClassLabel(names=["negative", "positive"])})
+        for shard_format in ["arrow", "parquet"]:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                writer = ShardedDatasetWriter(tmp_dir, features, rows_per_shard=2, shard_format=shard_format)
+                for idx in range(5):
+                    writer.add({"text": f"review {idx}", "label": idx % 2})
+
+                dataset = writer.finalize()
+
+                with open(Path(tmp_dir) / "manifest.json", encoding="utf-8") as manifest_file:
+                    manifest = json.load(manifest_file)
+                self.assertEqual(manifest["num_rows"], 5)
+                self.assertEqual([shard["num_rows"] for shard in manifest["shards"]], [2, 2, 1])
+                self.assertEqual(dataset.features, features)
+                self.assertEqual(dataset["label"], [0, 1, 0, 1, 0])
+
+                if shard_format == "arrow":
+                    reloaded = load_from_disk(tmp_dir)
+                else:
+                    reloaded = Dataset.from_parquet([str(path) for path in writer.shard_paths])
+                self.assertEqual(reloaded["text"], dataset["text"])
+
+    def test_sharded_writer_rejects_invalid_arguments(self):
+        features = Features({"text": Value("string")})
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with self.assertRaises(ValueError):
+                ShardedDatasetWriter(tmp_dir, features, shard_format="csv")
+            with self.assertRaises(ValueError):
+                ShardedDatasetWriter(tmp_dir, features, rows_per_shard=0)
@@ -1,9 +1,12 @@
 import unittest
 
-from datasets import load_dataset, Dataset, QuestionAnsweringExtractive, TextClassification, Summarization
+from datasets import load_dataset, Dataset, Features, QuestionAnsweringExtractive, Sequence, TextClassification, \
+    Summarization, Value
 
 from fabricator.prompts import (
     BasePrompt,
+    OutputDecoder,
+    StreamValidator,
     infer_prompt_from_task_template,
 )
 
@@ -108,6 +111,123 @@ class TestPrompt(unittest.TestCase):
         self.assertIn("Movie Review: This movie is bad!\nSentiment: negative", prompt_text)
         self.assertIn("Movie Review: {text}\nSentiment: ", prompt.target_formatting_template)
 
+    def test_multiple_target_columns(self):
+        """Test prompt and parsing for several target columns generated in a single call"""
+        prompt = BasePrompt(
+            task_description="Generate a question and its answer for the context.",
+            generate_data_for_column=["question", "answer"],
+            fewshot_example_columns="context",
+        )
+        self.assertTrue(prompt.generates_multiple_columns)
+        self.assertEqual(prompt.relevant_columns_for_fewshot_examples, ["context", "question", "answer"])
+        self.assertTrue(prompt.target_formatting_template.endswith("context: {context}\nquestion: "))
+        self.assertIn("question, answer", prompt.target_formatting_template)
+
+        self.assertEqual(
+            prompt.parse_prediction("Who wrote it?\nanswer: Goethe\n\nquestion: Another one?\nanswer: Schiller"),
+            {"question": "Who wrote it?", "answer": "Goethe"},
+        )
+        self.assertEqual(
+            prompt.parse_prediction("question: Who wrote it?\nanswer: Goethe,\nin 1808"),
+            {"question": "Who wrote it?", "answer": "Goethe,\nin 1808"},
+        )
+        self.assertEqual(
+            prompt.parse_prediction('{"question": "Who wrote it?", "answer": "Goethe"}'),
+            {"question": "Who wrote it?", "answer": "Goethe"},
+        )
+        self.assertEqual(prompt.parse_prediction("Who wrote it?"), {"question": "Who wrote it?", "answer": None})
+        self.assertEqual(prompt.parse_prediction(""), {"question": None, "answer": None})
+
+        single_column_prompt = BasePrompt(task_description="Generate a question.", generate_data_for_column="question")
+        self.assertFalse(single_column_prompt.generates_multiple_columns)
+        self.assertEqual(single_column_prompt.parse_prediction("answer: x"), {"question": "answer: x"})
+
+    def test_output_decoder(self):
+        """Test decoding of predictions to labels and feature types"""
+        prompt = BasePrompt(
+            task_description="Annotate the question as one of: {}.",
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+            label_options=["location", "human being", "number"],
+            constrain_to_label_options=True,
+        )
+        decoder = prompt.get_output_decoder(Features({"label": Value("string")}))
+
+        self.assertEqual(decoder.decode({"label": "Location."}), ({"label": "location"}, []))
+        self.assertEqual(decoder.decode({"label": "It asks for a human being"}), ({"label": "human being"}, []))
+        self.assertEqual(decoder.decode({"label": "human"}), ({"label": None}, ["label"]))
+        self.assertEqual(decoder.decode({"label": "location or number"}), ({"label": None}, ["label"]))
+
+        decoder = OutputDecoder(Features({
+            "score": Value("float32"), "count": Value("int64"), "valid": Value("bool"), "ids": Sequence(Value("int64"))
+        }))
+        decoded, invalid_columns = decoder.decode({
+            "score": "The similarity is 3.5.", "count": "2.5", "valid": "Yes, it is.", "ids": "[1, 2]"
+        })
+        self.assertEqual(decoded, {"score": 3.5, "count": None, "valid": True, "ids": [1, 2]})
+        self.assertEqual(invalid_columns, ["count"])
+
+        with self.assertRaises(ValueError):
+            BasePrompt(task_description="Generate a text.", constrain_to_label_options=True)
+
+    def test_generation_limits(self):
+        """Test deriving stop sequences and the maximum number of new tokens"""
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews as either: {}.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+        )
+
+        def count_words(text):
+            return len(text.split())
+
+        self.assertEqual(prompt.get_stop_words(), ["\n\n"])
+        self.assertEqual(prompt.estimate_max_new_tokens(count_words, use_label_options=True), 2)
+        self.assertEqual(prompt.estimate_max_new_tokens(count_words, self.dataset, margin=2.0), 2)
+        self.assertIsNone(prompt.estimate_max_new_tokens(count_words))
+
+        prompt = BasePrompt(
+            task_description="Generate a question and answer.",
+            generate_data_for_column=["question", "answer"],
+            fewshot_example_separator="\n",
+        )
+        self.assertEqual(prompt.get_stop_words(), [])
+
+    def test_stream_validator(self):
+        """Test incremental validation of streamed predictions"""
+        validator = StreamValidator(["\n\n"], stop_keys=["text"], label_options=["positive", "very negative"])
+
+        self.assertEqual(validator.check("  Pos"), (StreamValidator.CONTINUE, "  Pos"))
+        self.assertEqual(validator.check("positive."), (StreamValidator.FINAL, "positive."))
+        self.assertEqual(validator.check("very neg"), (StreamValidator.CONTINUE, "very neg"))
+        self.assertEqual(validator.check("very negative\ntext: "), (StreamValidator.FINAL, "very negative"))
+        self.assertEqual(validator.check("I think"), (StreamValidator.INVALID, "I think"))
+
+        validator = StreamValidator(["\n\n"])
+        self.assertEqual(validator.check('{"a": "}", "b": [1]} and'), (StreamValidator.FINAL, '{"a": "}", "b": [1]}'))
+        self.assertEqual(validator.check('{"a": "b"'), (StreamValidator.CONTINUE, '{"a": "b"'))
+        self.assertEqual(validator.check('{"a": ]'), (StreamValidator.INVALID, '{"a": ]'))
+        self.assertEqual(validator.check("A text.\n\nNext"), (StreamValidator.FINAL, "A text."))
+
+    def test_split_prompt_text(self):
+        """Test splitting the prompt text at the boundary of the shared prefix"""
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews as either: {}.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+        )
+        prompt_text = prompt.get_prompt_text(prompt.label_options, self.dataset)
+
+        prefix, suffix = prompt.split_prompt_text(prompt_text)
+        self.assertEqual(suffix, prompt.target_formatting_template)
+        self.assertTrue(prefix.startswith("Annotate movie reviews as either: positive, negative."))
+        self.assertIn("This movie is bad!", prefix)
+
+        with self.assertRaises(ValueError):
+            prompt.split_prompt_text(prompt_text.replace("{text}", "A new review."))
+
 
 class TestDownstreamTasks(unittest.TestCase):
     """Testcase for downstream tasks"""
@@ -0,0 +1,114 @@
+import importlib.util
+import unittest
+from collections import OrderedDict
+
+import numpy as np
+from datasets import Dataset, Sequence, Value
+
+from fabricator import DatasetGenerator, GenerationConfig, LabelScorer
+from fabricator.prompts import BasePrompt
+
+
+class StaticLabelScorer(LabelScorer):
+    """Label scorer with fixed label log probabilities instead of a language model."""
+
+    def __init__(self, log_probs, content_free_log_probs, max_cached_prompts=128):
+        self.calibrate = True
+        self.content_free_input = "N/A"
+        self.length_normalize = False
+        self.max_cached_prompts = max_cached_prompts
+        self._content_free_probabilities = OrderedDict()
+        self.log_probs = log_probs
+        self.content_free_log_probs = content_free_log_probs
+        self.content_free_calls = 0
+
+    def label_log_probs(self, prompt_text, label_options):
+        if "N/A" in prompt_text:
+            self.content_free_calls += 1
+            return np.array(self.content_free_log_probs)
+        return np.array(self.log_probs[prompt_text.split("text: ")[-1].split("\n")[0]])
+
+
+class TestLabelScorer(unittest.TestCase):
+    """Testcase for annotation with label scores"""
+
+    def test_calibrate_probabilities(self):
+        calibrated = LabelScorer.calibrate_probabilities(np.array([0.6, 0.4]), np.array([0.8, 0.2]))
+        self.assertAlmostEqual(calibrated.sum(), 1.0)
+        self.assertGreater(calibrated[1], calibrated[0])
+
+    def test_annotation_with_label_scorer(self):
+        unlabeled_dataset = Dataset.from_dict({"text": ["This movie was a blast!", "Not bad."]})
+        prompt = BasePrompt(
+            task_description="Annotate movie reviews as either: {}.",
+            label_options=["positive", "negative"],
+            generate_data_for_column="label",
+            fewshot_example_columns="text",
+        )
+        # The model prefers positive, which the content-free input reveals as bias
+        scorer = StaticLabelScorer(
+            {"This movie was a blast!": np.log([0.9, 0.1]), "Not bad.": np.log([0.7, 0.3])},
+            content_free_log_probs=np.log([0.8, 0.2]),
+        )
+
+        generated_dataset = DatasetGenerator(None).generate(
+            prompt_template=prompt,
+            unlabeled_dataset=unlabeled_dataset,
+            max_prompt_calls=2,
+            generation_config=GenerationConfig(label_scorer=scorer),
+        )
+
+        self.assertEqual(generated_dataset["label"], ["positive", "negative"])
+        self.assertEqual(generated_dataset.features["label_probabilities"], Sequence(Value("float32")))
+        for probabilities in generated_dataset["label_probabilities"]:
+            self.assertAlmostEqual(sum(probabilities), 1.0, places=5)
+
+        with self.assertRaises(ValueError):
+            DatasetGenerator(None).generate(
+                prompt_template=prompt, generation_config=GenerationConfig(label_scorer=scorer)
+            )
+
+    def test_content_free_probabilities_are_cached_per_prompt(self):
+        scorer = StaticLabelScorer(
+            {"good": np.log([0.9, 0.1]), "bad": np.log([0.3, 0.7])},
+            content_free_log_probs=np.log([0.8, 0.2]),
+            max_cached_prompts=2,
+        )
+        labels = ["positive", "negative"]
+        prompts = ["Example A\ntext: {text}", "Example B\ntext: {text}", "Example C\ntext: {text}"]
+
+        for prompt_text in [prompts[0], prompts[0], prompts[1], prompts[0], prompts[2], prompts[0], prompts[1]]:
+            scorer.score(prompt_text, labels, {"text": "good"})
+
+        # The least recently used prompt is dropped whenever a third prompt is cached
+        self.assertEqual(scorer.content_free_calls, 4)
+        cached_prompts = [prompt_text for prompt_text, _ in scorer._content_free_probabilities]
+        self.assertEqual(cached_prompts, [prompts[0], prompts[1]])
+
+    @unittest.skipUnless(importlib.util.find_spec("torch"), "requires torch")
+    def test_shared_prompt_prefix_matches_full_sequences(self):
+        import torch  # pylint: disable=import-outside-toplevel
+
+        scorer = LabelScorer("sshleifer/tiny-gpt2", calibrate=False)
+        label_options = ["positive", "very negative"]
+        log_probs = scorer.label_log_probs("Review: This movie was a blast!\nSentiment: ", label_options)
+
+        prompt_ids = scorer.tokenizer("Review: This movie was a blast!\nSentiment:")["input_ids"]
+        for label, log_prob in zip(label_options, log_probs):
+            label_ids = scorer.tokenizer(" " + label, add_special_tokens=False)["input_ids"]
+            with torch.no_grad():
+                logits = scorer.model(input_ids=torch.tensor([prompt_ids + label_ids])).logits[0]
+            token_log_probs = torch.log_softmax(logits[len(prompt_ids) - 1:-1], dim=-1)
+            expected = token_log_probs.gather(-1, torch.tensor(label_ids).unsqueeze(-1)).sum()
+            self.assertAlmostEqual(float(log_prob), float(expected), places=4)
+
+    @unittest.skipUnless(importlib.util.find_spec("torch"), "requires torch")
+    def test_score_with_language_model(self):
+        scorer = LabelScorer("sshleifer/tiny-gpt2")
+        label, probabilities = scorer.score(
+            "Review: {text}\nSentiment: ", ["positive", "negative"], {"text": "This movie was a blast!"}
+        )
+
+        self.assertIn(label, ["positive", "negative"])
+        self.assertEqual(len(probabilities), 2)
+        self.assertAlmostEqual(sum(probabilities), 1.0, places=5)